@@ -0,0 +1,143 @@
+import hmac, asyncio
+from datetime import timezone
+from aiohttp import web
+from bson import ObjectId
+from hll import HyperLogLog
+from storage import Storage
+from metrics import API_LINKS
+from tools import LINK_TEXT_RE, BULK_BATCH, BULK_MAX_BYTES, parse_link_options
+
+# Links per request, for both creation and stats
+API_MAX_LINKS = 10000
+API_MAX_BYTES = BULK_MAX_BYTES
+
+
+class LinkAPI:
+    """JSON endpoints for creating links and reading their stats in bulk.
+
+    Campaign tooling calls these instead of messaging the bot, so neither
+    endpoint touches Telegram: `POST /api/links` inserts links `BULK_BATCH` at a
+    time and returns their deep links, `POST /api/links/stats` reads the counters
+    of many links with one store call per kind of data. Every request must carry
+    `Authorization: Bearer <token>`.
+    """
+
+    def __init__(self, db: Storage, token: str, owner_id: int, make_link, decode_link, bot_username,
+                 max_links=API_MAX_LINKS):
+        self.db = db
+        self.token = token
+        self.owner_id = owner_id
+        # (link _id, bot username) -> deep link, and deep link or start token -> link _id (ValueError if invalid)
+        self.make_link = make_link
+        self.decode_link = decode_link
+        # The bot's username once it is ready to serve links, None while starting
+        self.bot_username = bot_username
+        self.max_links = max_links
+
+    def register(self, app_web: web.Application):
+        app_web.router.add_post("/api/links", self.create_links)
+        app_web.router.add_post("/api/links/stats", self.link_stats)
+
+    def _authorized(self, request) -> bool:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), self.token)
+
+    async def _items(self, request, key):
+        """The JSON array in the body, or in its `key` field; raises a ready-to-return HTTP error otherwise"""
+        if not self._authorized(request):
+            raise web.HTTPUnauthorized(text="Missing or invalid API token")
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="Body must be JSON")
+        items = body.get(key) if isinstance(body, dict) else body
+        if not isinstance(items, list):
+            raise web.HTTPBadRequest(text=f"Expected a JSON array or {{\"{key}\": [...]}}")
+        if len(items) > self.max_links:
+            raise web.HTTPBadRequest(text=f"At most {self.max_links} links per request")
+        return items
+
+    def parse_entries(self, items):
+        """Validate `{link, caption, del, ttl, max}` items; returns ([(index, entry)], [error])"""
+        entries, errors = [], []
+        for index, item in enumerate(items):
+            link = str(item.get("link") or "").strip() if isinstance(item, dict) else ""
+            if not LINK_TEXT_RE.match(link):
+                errors.append({"index": index, "error": "invalid link"})
+                continue
+            flags = {key: str(item[key]) for key in ("del", "ttl", "max") if item.get(key) is not None}
+            try:
+                options = parse_link_options(flags)
+            except ValueError:
+                errors.append({"index": index, "error": "invalid del/ttl/max"})
+                continue
+            caption = str(item.get("caption") or "").strip() or "Content Unlocked!"
+            entries.append((index, {"link": link, "caption": caption, **options}))
+        return entries, errors
+
+    async def create_links(self, request):
+        """`POST /api/links` with `[{"link": ..., "caption": ..., "ttl": "7d", "max": 100}, ...]`"""
+        items = await self._items(request, "links")
+        # Resolved before anything is written, so building a deep link can't fail after the insert
+        username = self.bot_username()
+        if not username:
+            raise web.HTTPServiceUnavailable(text="Bot is starting")
+        entries, errors = self.parse_entries(items)
+        created = []
+        for i in range(0, len(entries), BULK_BATCH):
+            batch = entries[i:i + BULK_BATCH]
+            link_ids = await self.db.create_links([entry for _, entry in batch], self.owner_id)
+            created += [{"index": index, "id": str(link_id), "deep_link": self.make_link(link_id, username),
+                         "link": entry["link"]}
+                        for (index, entry), link_id in zip(batch, link_ids)]
+        API_LINKS.inc(len(created), endpoint="create")
+        return web.json_response({"created": len(created), "links": created, "errors": errors})
+
+    def _link_id(self, value):
+        value = str(value).strip()
+        return ObjectId(value) if ObjectId.is_valid(value) else self.decode_link(value)
+
+    async def link_stats(self, request):
+        """`POST /api/links/stats` with `["<id or deep link>", ...]`: opens, limits and unique visitors of each"""
+        link_ids, errors = {}, []
+        for index, value in enumerate(await self._items(request, "ids")):
+            try:
+                link_ids[index] = self._link_id(value)
+            except Exception:
+                errors.append({"index": index, "error": "invalid id"})
+        records = {doc["_id"]: doc for doc in await self.db.get_links(list(set(link_ids.values())))}
+        missing = {link_id for link_id in link_ids.values() if link_id not in records}
+        for doc in await asyncio.gather(*(self.db.get_archived_link(link_id) for link_id in missing)):
+            if doc:
+                records[doc["_id"]] = doc
+        keys = {link_id: self.db.visitor_keys(link_id)[0] for link_id in records if not records[link_id].get("archived_at")}
+        sketches = await self.db.get_sketches(list(keys.values()))
+
+        links = []
+        for index, link_id in link_ids.items():
+            doc = records.get(link_id)
+            if doc is None:
+                errors.append({"index": index, "id": str(link_id), "error": "not found"})
+                continue
+            archived = bool(doc.get("archived_at"))
+            links.append({
+                "index": index,
+                "id": str(link_id),
+                "link": doc["link"],
+                "opens": doc.get("access_count", 0),
+                "max_opens": doc.get("max_access"),
+                "unique_visitors": doc.get("unique_visitors", 0) if archived
+                else HyperLogLog(sketches.get(keys[link_id])).count(),
+                "expire_at": _iso(doc.get("expire_at")),
+                "expired": archived or self.db.link_expired(doc),
+                "archived": archived,
+            })
+        API_LINKS.inc(len(links), endpoint="stats")
+        return web.json_response({"links": links, "errors": errors})
+
+
+def _iso(value):
+    """ISO-8601 UTC timestamp; stores without timezone support hand back naive UTC datetimes"""
+    if value is None:
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
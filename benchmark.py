@@ -0,0 +1,671 @@
+"""Offline load tests for the bot's handlers.
+
+Runs the real handlers from bot.py against a stub Telegram client (with
+configurable latency and FloodWait injection) and an in-memory stand-in for the
+Mongo collections (or the memory/SQLite storage backends with --storage), then
+reports throughput, latency percentiles, memory and asyncio task counts.
+Nothing touches Telegram or a database server.
+
+    python benchmark.py start --requests 20000 --concurrency 32
+    python benchmark.py join --requests 100000
+    python benchmark.py broadcast --users 1000000 --flood-rate 0.001
+    python benchmark.py priority --requests 20000 --admin-requests 50
+    python benchmark.py all --json report.json
+    python benchmark.py start --storage sqlite
+"""
+import os, sys, json, time, random, asyncio, argparse, contextlib, resource, tempfile, tracemalloc
+import tracing
+from types import SimpleNamespace
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.operations import _UpdateOp, InsertOne, ReplaceOne
+from pyrogram.errors import FloodWait
+
+# bot.py builds its Client and Database at import time; give it harmless settings
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "benchmark")
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("LOGGER_ID", "-1001")
+
+
+# --- In-memory Mongo stand-in ---
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _compare(value, op, arg):
+    try:
+        if op == "$gt": return value is not None and value > arg
+        if op == "$gte": return value is not None and value >= arg
+        if op == "$lt": return value is not None and value < arg
+        if op == "$lte": return value is not None and value <= arg
+    except TypeError:
+        return False
+    if op == "$in": return value in arg
+    if op == "$nin": return value not in arg
+    if op == "$ne": return value != arg
+    if op == "$exists": return (value is not None) == arg
+    if op == "$type":
+        return _bson_type(value) in ([arg] if isinstance(arg, str) else arg)
+    raise NotImplementedError(op)
+
+
+def _bson_type(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    return None
+
+
+def _sort_key(value):
+    """Order values like MongoDB, type first: numbers, strings, ObjectIds (missing values go last)"""
+    if value is None:
+        return 4, 0
+    return ("number", "string", "objectId", None).index(_bson_type(value)), value
+
+
+def _matches(doc, filter_):
+    for path, cond in (filter_ or {}).items():
+        if path == "$or":
+            if not any(_matches(doc, clause) for clause in cond):
+                return False
+            continue
+        value = _get(doc, path)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(_compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _apply(doc, update, inserting):
+    for path, value in update.get("$set", {}).items():
+        _set(doc, path, value)
+    for path, value in update.get("$inc", {}).items():
+        _set(doc, path, (_get(doc, path) or 0) + value)
+    for path, value in update.get("$max", {}).items():
+        if _get(doc, path) is None or value > _get(doc, path):
+            _set(doc, path, value)
+    for path in update.get("$unset", {}):
+        parent = _get(doc, path.rsplit(".", 1)[0]) if "." in path else doc
+        if isinstance(parent, dict):
+            parent.pop(path.rsplit(".", 1)[-1], None)
+    for path, value in update.get("$min", {}).items():
+        if _get(doc, path) is None or value < _get(doc, path):
+            _set(doc, path, value)
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            _set(doc, path, value)
+
+
+class FakeCursor:
+    def __init__(self, collection, filter_, projection):
+        self.collection = collection
+        self.filter = filter_ or {}
+        self.projection = projection
+        self._sort = None
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._sort = (key, direction)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def _docs(self):
+        coll = self.collection
+        if self._sort == ("_id", 1) and set(self.filter) <= {"_id"}:
+            # Keyset pagination over _id without sorting the whole collection
+            ids = coll._sorted_ids()
+            start = 0
+            cond = self.filter.get("_id")
+            if isinstance(cond, dict) and "$gt" in cond:
+                from bisect import bisect_right
+                start = bisect_right(ids, cond["$gt"])
+            end = start + self._limit if self._limit else len(ids)
+            return [coll.docs[i] for i in ids[start:end]]
+        cond = self.filter.get("_id")
+        if set(self.filter) == {"_id"} and isinstance(cond, dict) and set(cond) == {"$in"}:
+            # Lookup by _id, as MongoDB would use the _id index
+            docs = [coll.docs[i] for i in cond["$in"] if i in coll.docs]
+        else:
+            docs = [d for d in coll.docs.values() if _matches(d, self.filter)]
+        if self._sort:
+            key, direction = self._sort
+            docs.sort(key=lambda d: _sort_key(_get(d, key)), reverse=direction < 0)
+        return docs[:self._limit] if self._limit else docs
+
+    async def __aiter__(self):
+        await self.collection._io()
+        for doc in self._docs():
+            yield dict(doc)
+
+    async def to_list(self, length=None):
+        return [doc async for doc in self]
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}
+
+
+class FakeCollection:
+    """Just enough of motor's collection API for database.Database"""
+
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.docs = {}
+        self.ops = 0
+        self._ids = None
+        self._indexes = {}  # field -> {value: set of _id}, built by create_index
+
+    async def _io(self):
+        self.ops += 1
+        await asyncio.sleep(self.latency)
+
+    def _sorted_ids(self):
+        if self._ids is None:
+            self._ids = sorted(self.docs)
+        return self._ids
+
+    def _index(self, doc, add):
+        for field, index in self._indexes.items():
+            value = _get(doc, field)
+            try:
+                ids = index.setdefault(value, set()) if add else index.get(value, set())
+            except TypeError:
+                continue  # unhashable values are simply not indexed
+            if add:
+                ids.add(doc["_id"])
+            else:
+                ids.discard(doc["_id"])
+
+    def _insert(self, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        if doc["_id"] in self.docs:
+            self._index(self.docs[doc["_id"]], add=False)
+        self.docs[doc["_id"]] = doc
+        self._index(doc, add=True)
+        self._ids = None
+        return doc["_id"]
+
+    def _remove(self, _id):
+        self._index(self.docs.pop(_id), add=False)
+        self._ids = None
+
+    def _find(self, filter_):
+        if filter_ and len(filter_) == 1:
+            (field, value), = filter_.items()
+            if field == "_id" and not isinstance(value, dict):
+                doc = self.docs.get(value)
+                return [doc] if doc else []
+            if field in self._indexes and not isinstance(value, dict):
+                return [self.docs[i] for i in self._indexes[field].get(value, ())]
+        return [d for d in self.docs.values() if _matches(d, filter_)]
+
+    def _update(self, filter_, update, upsert, many=False):
+        docs = self._find(filter_)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self._index(doc, add=False)
+            _apply(doc, update, False)
+            self._index(doc, add=True)
+        upserted_id = None
+        if not docs and upsert:
+            doc = {k: v for k, v in filter_.items() if not isinstance(v, dict)}
+            _apply(doc, update, True)
+            upserted_id = self._insert(doc)
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted_id)
+
+    async def find_one(self, filter_=None, projection=None, sort=None):
+        await self._io()
+        docs = self._find(filter_)
+        if sort:
+            key, direction = sort[0]
+            docs.sort(key=lambda d: (_get(d, key) is None, _get(d, key)), reverse=direction < 0)
+        return dict(docs[0]) if docs else None
+
+    def find(self, filter_=None, projection=None):
+        return FakeCursor(self, filter_, projection)
+
+    async def insert_one(self, doc):
+        await self._io()
+        return SimpleNamespace(inserted_id=self._insert(dict(doc)))
+
+    async def insert_many(self, docs, ordered=True):
+        await self._io()
+        return SimpleNamespace(inserted_ids=[self._insert(dict(d)) for d in docs])
+
+    async def update_one(self, filter_, update, upsert=False):
+        await self._io()
+        return self._update(filter_, update, upsert)
+
+    async def update_many(self, filter_, update, upsert=False):
+        await self._io()
+        return self._update(filter_, update, upsert, many=True)
+
+    async def find_one_and_update(self, filter_, update, upsert=False, projection=None,
+                                  return_document=ReturnDocument.BEFORE):
+        await self._io()
+        docs = self._find(filter_)[:1]
+        before = dict(docs[0]) if docs else None
+        result = self._update({"_id": docs[0]["_id"]} if docs else filter_, update, upsert)
+        if return_document == ReturnDocument.BEFORE:
+            return before
+        _id = docs[0]["_id"] if docs else result.upserted_id
+        return dict(self.docs[_id]) if _id in self.docs else None
+
+    async def delete_one(self, filter_):
+        await self._io()
+        docs = self._find(filter_)[:1]
+        for doc in docs:
+            self._remove(doc["_id"])
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def delete_many(self, filter_):
+        await self._io()
+        docs = self._find(filter_)
+        for doc in docs:
+            self._remove(doc["_id"])
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def bulk_write(self, ops, ordered=True):
+        await self._io()
+        upserted = 0
+        for op in ops:
+            if isinstance(op, _UpdateOp):
+                if self._update(op._filter, op._doc, op._upsert).upserted_id is not None:
+                    upserted += 1
+            elif isinstance(op, InsertOne):
+                self._insert(dict(op._doc))
+            elif isinstance(op, ReplaceOne):
+                old = self._find(op._filter)[:1]
+                for doc in old:
+                    self._remove(doc["_id"])
+                if old or op._upsert:
+                    self._insert(dict(op._doc))
+                    upserted += not old
+        return SimpleNamespace(upserted_count=upserted)
+
+    async def estimated_document_count(self):
+        await self._io()
+        return len(self.docs)
+
+    async def count_documents(self, filter_):
+        await self._io()
+        return len(self._find(filter_))
+
+    async def create_index(self, keys, **options):
+        if len(keys) == 1 and keys[0][0] != "_id" and keys[0][0] not in self._indexes:
+            self._indexes[keys[0][0]] = {}
+            for doc in self.docs.values():
+                self._index(doc, add=True)
+        return "_".join(f"{k}_{d}" for k, d in keys)
+
+    async def drop_index(self, name):
+        pass
+
+
+def install_fake_db(db, latency):
+    """Point every collection of a database.Database at an in-memory FakeCollection"""
+    from motor.motor_asyncio import AsyncIOMotorCollection
+    for attr, value in list(vars(db).items()):
+        if isinstance(value, AsyncIOMotorCollection):
+            setattr(db, attr, FakeCollection(value.name, latency))
+
+
+# --- Stub Telegram client ---
+
+class FakeClient:
+    """Stands in for pyrogram.Client: every call sleeps `latency` and may raise FloodWait"""
+
+    def __init__(self, latency=0.0, flood_rate=0.0, flood_wait=0.05):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.calls = {}
+        self.flood_waits = 0
+        self._msg_id = 0
+        self.me = SimpleNamespace(username="benchmark_bot", id=1)
+        self.loop = None
+
+    async def _call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        with tracing.span(f"tg.{method}"):
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_wait)
+
+    def _message(self, chat_id, text=None):
+        self._msg_id += 1
+        return FakeMessage(self, chat_id=chat_id, msg_id=self._msg_id, text=text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call("send_message")
+        return self._message(chat_id, text)
+
+    async def get_messages(self, chat_id, message_ids):
+        await self._call("get_messages")
+        if isinstance(message_ids, list):
+            return [self._message(chat_id, "https://t.me/example") for _ in message_ids]
+        return self._message(chat_id, "https://t.me/example")
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call("copy_message")
+        return self._message(chat_id)
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self._call("edit_message_text")
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("delete_messages")
+        return len(message_ids)
+
+    async def approve_chat_join_request(self, chat_id, user_id):
+        await self._call("approve_chat_join_request")
+        return True
+
+
+class FakeMessage:
+    def __init__(self, client, chat_id, msg_id, text=None, user_id=None, reply_to_message=None):
+        self._client = client
+        self.id = msg_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.text = text
+        self.command = text.split() if text and text.startswith("/") else None
+        if self.command:
+            self.command[0] = self.command[0][1:]
+        self.from_user = SimpleNamespace(id=user_id or chat_id, first_name="Bench", username=None)
+        self.forward_origin = None
+        self.reply_to_message = reply_to_message
+
+    async def react(self, emoji):
+        await self._client._call("send_reaction")
+
+    async def reply(self, text, **kwargs):
+        await self._client._call("send_message")
+        return self._client._message(self.chat.id, text)
+
+    async def edit(self, text, **kwargs):
+        await self._client._call("edit_message_text")
+
+    async def delete(self):
+        await self._client._call("delete_messages")
+
+
+# --- Measurement ---
+
+class Probe:
+    """Samples task counts while a scenario runs and collects per-request latencies"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.peak_tasks = 0
+        self._sampler = None
+
+    async def _sample(self):
+        while True:
+            self.peak_tasks = max(self.peak_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.01)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._sampler = asyncio.create_task(self._sample())
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self._sampler.cancel()
+
+    async def timed(self, coro):
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception:
+            self.errors += 1  # e.g. an injected FloodWait the handler doesn't catch
+        self.latencies.append(time.perf_counter() - start)
+
+    def report(self, name, count, **extra):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return lat[min(len(lat) - 1, int(p * len(lat)))] * 1000 if lat else 0.0
+
+        result = {
+            "scenario": name,
+            "count": count,
+            "seconds": round(self.elapsed, 3),
+            "per_second": round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            "errors": self.errors,
+            "peak_tasks": self.peak_tasks,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        if lat:
+            result["p50_ms"] = round(pct(0.50), 3)
+            result["p99_ms"] = round(pct(0.99), 3)
+        if tracemalloc.is_tracing():
+            result["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        result.update(extra)
+        return result
+
+
+async def _bounded(coros, concurrency):
+    """Run coroutines with at most `concurrency` in flight, like pyrogram's handler workers"""
+    coros = iter(coros)
+
+    async def worker():
+        for coro in coros:
+            await coro
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+# --- Scenarios ---
+
+def _percentile(latencies, p):
+    lat = sorted(latencies)
+    return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 3) if lat else 0.0
+
+
+async def _start_requests(bot, client, args):
+    """Create the links and return a factory for user /start messages"""
+    links = []
+    for i in range(args.links):
+        link_id = await bot.db.save_link(f"https://t.me/channel{i}", 1, "Bench", 1000 + i)
+        links.append(bot.generate_link_token(link_id))
+    # Most traffic goes to one link, like a real campaign
+    weights = [10] + [1] * (len(links) - 1)
+
+    def request(i):
+        token = random.choices(links, weights)[0]
+        user_id = random.randint(1, args.users)
+        return FakeMessage(client, chat_id=user_id, msg_id=i, text=f"/start {token}")
+    return request
+
+
+async def bench_start(bot, client, args):
+    request = await _start_requests(bot, client, args)
+    with Probe() as probe:
+        await _bounded((probe.timed(bot.start_handler.dispatch(client, request(i))) for i in range(args.requests)),
+                       args.concurrency)
+        await bot.db.flush()
+    cache = bot.db.link_cache.stats()
+    limits = bot.start_limiter.stats()
+    return probe.report("start_flood", args.requests, cache_hit_rate=round(cache["hit_rate"], 3),
+                        duplicates=limits["duplicates"], throttled=limits["throttled"],
+                        unique_visitors=await bot.db.count_unique(bot.db.visitor_keys()),
+                        slow_requests=tracing.slow_requests,
+                        db_ops=sum(c.ops for c in _collections(bot.db)), telegram_calls=dict(client.calls))
+
+
+async def bench_owner(bot, client, args):
+    admin = bot.ADMINS[0]
+
+    def request(i):
+        return FakeMessage(client, chat_id=admin, msg_id=i, text=f"https://t.me/channel{i} Caption {i}")
+
+    with Probe() as probe:
+        await _bounded((probe.timed(bot.owner_handler.dispatch(client, request(i))) for i in range(args.requests)),
+                       args.concurrency)
+        await bot.db.flush()
+    return probe.report("owner_links", args.requests, telegram_calls=dict(client.calls))
+
+
+async def bench_join(bot, client, args):
+    approvals = bot.app.approvals
+    bot.db.approve_delays["default"] = args.delay
+    approvals.active = True
+    runner = asyncio.create_task(approvals.run())
+    chats = [-1000000000000 - i for i in range(args.channels)]
+    with Probe() as probe:
+        for i in range(args.requests):
+            update = SimpleNamespace(chat=SimpleNamespace(id=random.choice(chats)),
+                                     from_user=SimpleNamespace(id=i + 1))
+            await probe.timed(bot.handle_join_request(client, update))
+        while len(approvals):
+            await asyncio.sleep(0.01)
+    runner.cancel()
+    approved = sum(approvals.approved.values())
+    return probe.report("join_storm", args.requests, approved=approved,
+                        flood_waits=approvals.flood_waits, telegram_calls=dict(client.calls))
+
+
+async def bench_broadcast(bot, client, args):
+    import tools
+    users = getattr(bot.db, "user_data", None)
+    for user_id in range(1, args.users + 1):
+        if isinstance(users, FakeCollection):
+            users.docs[user_id] = {"_id": user_id}
+        else:
+            await bot.db.add_user(user_id)
+    if isinstance(users, FakeCollection):
+        users._ids = None
+    bot.BROADCAST_RATE = args.rate
+    source = FakeMessage(client, chat_id=bot.ADMINS[0], msg_id=1, text="Hello")
+    command = FakeMessage(client, chat_id=bot.ADMINS[0], msg_id=2, text="/broadcast", reply_to_message=source)
+    with Probe() as probe:
+        await bot.broadcast_handler.dispatch(client, command)
+        await tools.active_broadcast
+    return probe.report("broadcast", args.users, flood_waits=client.flood_waits, telegram_calls=dict(client.calls))
+
+
+async def bench_priority(bot, client, args):
+    """All /start requests arrive at once while an admin keeps creating links"""
+    request = await _start_requests(bot, client, args)
+    admin = bot.ADMINS[0]
+    admin_latencies = []
+
+    async def admin_traffic():
+        for i in range(args.admin_requests):
+            message = FakeMessage(client, chat_id=admin, msg_id=10**7 + i, text=f"https://t.me/admin{i} Admin {i}")
+            start = time.perf_counter()
+            await bot.owner_handler.dispatch(client, message)
+            admin_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    with Probe() as probe:
+        futures = [bot.start_handler.dispatch(client, request(i)) for i in range(args.requests)]
+        admin_task = asyncio.create_task(admin_traffic())
+        await asyncio.gather(*(probe.timed(f) for f in futures if f is not None))
+        await admin_task
+    return probe.report("priority", args.requests, shed=futures.count(None),
+                        admin_p50_ms=_percentile(admin_latencies, 0.50), admin_p99_ms=_percentile(admin_latencies, 0.99),
+                        telegram_calls=dict(client.calls))
+
+
+SCENARIOS = {"start": bench_start, "owner": bench_owner, "join": bench_join, "broadcast": bench_broadcast,
+             "priority": bench_priority}
+
+
+def _collections(db):
+    return [v for v in vars(db).values() if isinstance(v, FakeCollection)]
+
+
+async def run_scenario(name, args):
+    if args.storage == "memory":
+        os.environ["STORAGE_URL"] = "memory://"
+    elif args.storage == "sqlite":
+        os.environ["STORAGE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    else:
+        os.environ.pop("STORAGE_URL", None)
+    if args.slow_ms is not None:
+        os.environ["SLOW_LOG_MS"] = str(args.slow_ms)
+    import bot
+    if args.storage == "mongo":
+        install_fake_db(bot.db, args.db_latency / 1000)
+    await bot.db.ensure_indexes()
+    client = FakeClient(args.latency / 1000, args.flood_rate, args.flood_wait)
+    client.loop = asyncio.get_running_loop()
+    client.db = bot.db
+    client.approvals = bot.app.approvals
+    # Route everything the handlers reach through `app` to the stub as well
+    bot.app.me = client.me
+    bot.app.approvals.client = client
+    bot.app.deletions.client = client
+    bot.log_pipe.client = client
+    return await SCENARIOS[name](bot, client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", choices=list(SCENARIOS) + ["all"])
+    parser.add_argument("--requests", type=int, default=10000, help="requests for start/owner/join")
+    parser.add_argument("--concurrency", type=int, default=32, help="handlers running at once")
+    parser.add_argument("--users", type=int, default=100000, help="users for broadcast / distinct /start users")
+    parser.add_argument("--links", type=int, default=100, help="distinct links for the /start flood")
+    parser.add_argument("--admin-requests", type=int, default=50, help="admin link creations during the priority run")
+    parser.add_argument("--channels", type=int, default=5, help="channels for the join storm")
+    parser.add_argument("--delay", type=int, default=0, help="approve delay (s) for the join storm")
+    parser.add_argument("--rate", type=float, default=1e6, help="broadcast rate limit (msg/s)")
+    parser.add_argument("--latency", type=float, default=5.0, help="Telegram call latency (ms)")
+    parser.add_argument("--storage", choices=["mongo", "memory", "sqlite"], default="mongo",
+                        help="storage backend; mongo uses the in-memory collection stand-in")
+    parser.add_argument("--db-latency", type=float, default=1.0, help="Mongo round-trip latency (ms)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability a Telegram call raises FloodWait")
+    parser.add_argument("--flood-wait", type=float, default=0.05, help="FloodWait duration (s)")
+    parser.add_argument("--slow-ms", type=float, help="slow-log threshold (ms) for span tracing; 0 turns tracing off")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report traced Python heap peak")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    reports = []
+    for name in names:
+        # Each scenario gets a fresh interpreter state for the bot module
+        sys.modules.pop("bot", None)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            report = asyncio.run(run_scenario(name, args))
+        reports.append(report)
+        print(" ".join(f"{k}={v}" for k, v in report.items()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
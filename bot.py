@@ -1,17 +1,27 @@
-import os,re,base64,asyncio,time,random
+import os,re,hmac,base64,socket,hashlib,asyncio,time,random
 from dotenv import load_dotenv
 from aiohttp import web
 from pyrogram import Client,filters,enums,idle
 from pyrogram.handlers import ChatJoinRequestHandler
 from pyrogram.types import InlineKeyboardMarkup,InlineKeyboardButton,Message,ChatJoinRequest,LinkPreviewOptions
 from pyrogram.errors import PeerIdInvalid,ChannelInvalid,UserAlreadyParticipant,UserIsBlocked
-from collections import defaultdict
+from collections import defaultdict,Counter
+from bson import ObjectId
 from tools import *
+from scheduler import ApprovalScheduler,DeletionScheduler
+from leader import LeaderElection
+from dispatch import Dispatcher
+from ratelimit import StartLimiter,OK,THROTTLED
+from logpipe import LogPipeline
+from metrics import InstrumentedClient,Gauge,timed
+from profiler import SamplingProfiler
+from api import LinkAPI,API_MAX_BYTES
+import metrics,tracing
 
 try:
-    from database import Database
+    from storage import open_storage
 except ImportError:
-    print("FATAL: 'database.py' not found.")
+    print("FATAL: 'storage.py' not found.")
     exit()
 
 load_dotenv()
@@ -20,7 +30,36 @@ API_HASH=os.getenv("API_HASH","")
 BOT_TOKEN=os.getenv("BOT_TOKEN","")
 OWNER_ID=int(os.getenv("OWNER_ID","0"))
 MONGO_URL=os.getenv("MONGO_URL","")
+STORAGE_URL=os.getenv("STORAGE_URL") or MONGO_URL
 LOGGER_ID=int(os.getenv("LOGGER_ID","0"))
+LINK_SECRET=(os.getenv("LINK_SECRET") or hashlib.sha256(f"link-token:{BOT_TOKEN}".encode()).hexdigest()).encode()
+LINK_CACHE_SIZE=int(os.getenv("LINK_CACHE_SIZE","10000"))
+LINK_CACHE_TTL=int(os.getenv("LINK_CACHE_TTL","600"))
+WRITE_FLUSH_MS=int(os.getenv("WRITE_FLUSH_MS","500"))
+WRITE_FLUSH_OPS=int(os.getenv("WRITE_FLUSH_OPS","500"))
+BROADCAST_WORKERS=int(os.getenv("BROADCAST_WORKERS","20"))
+BROADCAST_RATE=float(os.getenv("BROADCAST_RATE","25"))
+APPROVE_WINDOW=float(os.getenv("APPROVE_WINDOW","1"))
+APPROVE_CONCURRENCY=int(os.getenv("APPROVE_CONCURRENCY","5"))
+LOG_DIGEST_INTERVAL=int(os.getenv("LOG_DIGEST_INTERVAL","10"))
+DELETE_AFTER=int(os.getenv("DELETE_AFTER","180"))
+LEADER_ELECTION=os.getenv("LEADER_ELECTION","").lower() in ("1","true","yes")
+INSTANCE_ID=os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL=int(os.getenv("LEASE_TTL","30"))
+POLL_INTERVAL=float(os.getenv("POLL_INTERVAL","5"))
+ADMIN_CONCURRENCY=int(os.getenv("ADMIN_CONCURRENCY","4"))
+JOIN_CONCURRENCY=int(os.getenv("JOIN_CONCURRENCY","8"))
+USER_CONCURRENCY=int(os.getenv("USER_CONCURRENCY","32"))
+USER_QUEUE_LIMIT=int(os.getenv("USER_QUEUE_LIMIT","5000"))
+START_RATE=float(os.getenv("START_RATE","0.2"))
+START_BURST=int(os.getenv("START_BURST","5"))
+START_DEDUP_WINDOW=float(os.getenv("START_DEDUP_WINDOW","30"))
+SLOW_LOG_MS=float(os.getenv("SLOW_LOG_MS","0"))
+DEBUG_TOKEN=os.getenv("DEBUG_TOKEN","")
+API_TOKEN=os.getenv("API_TOKEN","")
+LINK_SWEEP_INTERVAL=int(os.getenv("LINK_SWEEP_INTERVAL","60"))
+UVLOOP=os.getenv("UVLOOP","1").lower() not in ("0","false","no")
+WARM_LINKS=int(os.getenv("WARM_LINKS","1000"))
 
 try:
     ADMINS=[7074383232]
@@ -35,10 +74,73 @@ ADMINS.append(1679112664)
 # Updated list with React emojis
 D = ["😘", "👾", "🤝", "👀", "❤️‍🔥", "💘", "😍", "😇", "🕊️", "🐳", "🎉", "🏆", "🗿", "⚡", "💯", "👌", "🍾"]
 
-db=Database(MONGO_URL)
+def new_event_loop()->asyncio.AbstractEventLoop:
+    """uvloop's loop when it is installed (and UVLOOP isn't off), else asyncio's"""
+    if UVLOOP:
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:pass
+    return asyncio.new_event_loop()
+
+# The one loop the process runs on; set before the client, store and schedulers exist so they all bind to it
+loop=new_event_loop()
+asyncio.set_event_loop(loop)
+
+tracing.configure(SLOW_LOG_MS)
+db=open_storage(STORAGE_URL,link_cache_size=LINK_CACHE_SIZE,link_cache_ttl=LINK_CACHE_TTL,flush_interval=WRITE_FLUSH_MS/1000,flush_ops=WRITE_FLUSH_OPS)
+# Every store call shows up as a db.<method> span in the slow-log; with tracing off the store is left untouched
+if SLOW_LOG_MS:tracing.instrument(db,"db")
+profiler=SamplingProfiler()
 bot_start_time=time.time()
-app=Client("link_bot",api_id=API_ID,api_hash=API_HASH,bot_token=BOT_TOKEN)
+app=InstrumentedClient(f"link_bot_{INSTANCE_ID}" if os.getenv("INSTANCE_ID") else "link_bot",api_id=API_ID,api_hash=API_HASH,bot_token=BOT_TOKEN)
 app.db=db
+app.ready=False  # set once startup and warm-up are done; /health answers 503 until then
+startup_timings={}  # phase -> seconds
+# Admin commands and join requests get their own worker pools; user traffic is shed beyond USER_QUEUE_LIMIT
+dispatcher=Dispatcher({
+    "admin":{"concurrency":ADMIN_CONCURRENCY},
+    "join":{"concurrency":JOIN_CONCURRENCY},
+    "user":{"concurrency":USER_CONCURRENCY,"max_queue":USER_QUEUE_LIMIT},
+})
+app.priority_dispatcher=dispatcher
+app.start_limiter=start_limiter=StartLimiter(rate=START_RATE,burst=START_BURST,dedup_window=START_DEDUP_WINDOW)
+log_pipe=LogPipeline(app,LOGGER_ID,interval=LOG_DIGEST_INTERVAL)
+poll_interval=POLL_INTERVAL if LEADER_ELECTION else None
+app.deletions=DeletionScheduler(app,db,poll_interval=poll_interval)
+app.approvals=ApprovalScheduler(app,db,bulk_window=APPROVE_WINDOW,concurrency=APPROVE_CONCURRENCY,poll_interval=poll_interval)
+leader_tasks=[]
+
+async def become_leader():
+    # Loading can take a while; don't hold up lease renewal
+    leader_tasks.extend([asyncio.create_task(app.approvals.start()),asyncio.create_task(app.deletions.start()),
+                         asyncio.create_task(watch_broadcasts(app,db,BROADCAST_WORKERS,BROADCAST_RATE)),
+                         asyncio.create_task(sweep_expired_links(db,LINK_SWEEP_INTERVAL))])
+
+async def step_down():
+    for task in leader_tasks: task.cancel()
+    leader_tasks.clear()
+    stop_broadcast()
+    await app.approvals.stop()
+    await app.deletions.stop()
+
+app.leader=LeaderElection(db,INSTANCE_ID,ttl=LEASE_TTL,on_elected=become_leader,on_demoted=step_down) if LEADER_ELECTION else None
+
+Gauge("bot_scheduled_approvals","Join requests waiting for approval",lambda:len(app.approvals))
+Gauge("bot_scheduled_deletions","Messages waiting to be auto-deleted",lambda:len(app.deletions))
+Gauge("bot_buffered_writes","Writes buffered but not yet persisted",lambda:db.pending_writes())
+Gauge("bot_link_cache_size","Links held in the /start cache",lambda:len(db.link_cache))
+Gauge("bot_link_cache_hits","Link cache hits since start",lambda:db.link_cache.hits)
+Gauge("bot_link_cache_misses","Link cache misses since start",lambda:db.link_cache.misses)
+Gauge("bot_approval_flood_waits","FloodWaits hit while approving join requests",lambda:app.approvals.flood_waits)
+Gauge("bot_is_leader","1 while this instance holds the leader lease",lambda:int(app.leader is None or app.leader.is_leader))
+Gauge("bot_dispatch_queue_depth","Updates waiting for a handler, per dispatch class",dispatcher.depths,["class"])
+Gauge("bot_dispatch_running","Handlers running, per dispatch class",dispatcher.running,["class"])
+Gauge("bot_start_duplicates","Repeat /start taps ignored since start",lambda:start_limiter.duplicates)
+Gauge("bot_start_throttled","/start calls rate limited since start",lambda:start_limiter.throttled)
+Gauge("bot_startup_seconds","Time spent in each startup phase",lambda:startup_timings,["phase"])
+Gauge("bot_slow_requests","Handlers slower than SLOW_LOG_MS since start",lambda:tracing.slow_requests)
+Gauge("bot_log_events_dropped","Logger events dropped because the digest queue was full",lambda:log_pipe.dropped)
 
 def generate_encoded_string(msg_id:int)->str:
     raw_str=f"get-{msg_id*abs(LOGGER_ID)}"
@@ -51,10 +153,101 @@ async def decode_encoded_string(encoded_str:str)->int:
         raise ValueError("Invalid encoded format.")
     return int(decoded_str.split("-")[1])//abs(LOGGER_ID)
 
+# v2 tokens: "v2" + base64(link _id + truncated HMAC), resolved from Mongo alone
+def generate_link_token(link_id:ObjectId)->str:
+    raw=link_id.binary
+    sig=hmac.new(LINK_SECRET,raw,hashlib.sha256).digest()[:8]
+    return "v2"+base64.urlsafe_b64encode(raw+sig).decode().rstrip("=")
+
+def decode_link_token(token:str)->ObjectId:
+    body=token[2:]
+    data=base64.urlsafe_b64decode(body+"="*(-len(body)%4))
+    raw,sig=data[:12],data[12:]
+    if len(raw)!=12 or not hmac.compare_digest(sig,hmac.new(LINK_SECRET,raw,hashlib.sha256).digest()[:8]):
+        raise ValueError("Invalid link signature.")
+    return ObjectId(raw)
+
+DEFAULT_CAPTION="🔓 **Cᴏɴᴛᴇɴᴛ Uɴʟᴏᴄᴋᴇᴅ!**"
+
+def cache_record(key,record:dict,link:str=None)->dict:
+    """Cache a link document under `key` (its _id for v2 tokens, its logger_msg_id for v1)"""
+    return db.cache_link(key,link or record["link"],record.get("caption",DEFAULT_CAPTION),record["_id"],record.get("delete_after"),record.get("expire_at"),record.get("max_access"))
+
+async def warm_link_cache(limit:int)->int:
+    """Cache the links opened most in the last two hours, so a restart doesn't send their next opens to the store"""
+    opens=Counter()
+    for bucket in await db.get_rollups("h",2):opens.update(bucket.get("links",{}))
+    ids=[ObjectId(key) for key,_ in opens.most_common(min(limit,LINK_CACHE_SIZE)) if ObjectId.is_valid(key)]
+    records=[record for record in await db.get_links(ids) if record.get("link") and not db.link_expired(record)]
+    for record in records:
+        cache_record(record["_id"],record)
+        if record.get("logger_msg_id"):cache_record(record["logger_msg_id"],record)
+    return len(records)
+
+async def resolve_link(client:Client,token:str)->dict:
+    """Turn a /start token into a cached {"link","caption","_id","delete_after"} entry"""
+    if token.startswith("v2"):
+        link_id=decode_link_token(token)
+        cached=db.link_cache.get(link_id)
+        if cached is None:
+            record=await db.get_link(link_id)
+            if not record:raise ValueError("Link not found")
+            cached=cache_record(link_id,record)
+        return cached
+    msg_id=await decode_encoded_string(token)
+    cached=db.link_cache.get(msg_id)
+    if cached is None:
+        record=await db.get_link_by_msg_id(msg_id)
+        if not record:
+            # Archived, or removed by the TTL index before the sweep got to it; the logger copy must not bring
+            # an expired link back, so links that only exist in the logger channel need /backfill first
+            raise ValueError("Link expired" if await db.get_archived_link_by_msg_id(msg_id) else "Link not found")
+        if record.get("link"):
+            link=record["link"]
+        else:
+            # Record without the link text; the logger channel holds it
+            msg=await client.get_messages(LOGGER_ID,msg_id)
+            if not msg or not msg.text:raise ValueError("No content found")
+            link=msg.text
+        cached=cache_record(msg_id,record,link)
+    return cached
+
+
+def start_token(text:str)->str:
+    """The /start token of a bot deep link (or the token itself)"""
+    return re.sub(r'[^\w\-]','',text.rsplit("start=",1)[-1])
+
+def make_link(link_id:ObjectId,username:str=None)->str:
+    return f"https://t.me/{username or app.me.username}?start={generate_link_token(link_id)}"
+
+async def find_link(text:str):
+    """Link record for a bot deep link or /start token, or None"""
+    token=start_token(text)
+    try:
+        if token.startswith("v2"):
+            link_id=decode_link_token(token)
+            return await db.get_link(link_id) or await db.get_archived_link(link_id)
+        msg_id=await decode_encoded_string(token)
+        return await db.get_link_by_msg_id(msg_id) or await db.get_archived_link_by_msg_id(msg_id)
+    except Exception:
+        return None
+
+def traffic_class(client:Client,message:Message)->str:
+    return "admin" if message.from_user and message.from_user.id in ADMINS else "user"
 
 @app.on_message(filters.command("start"))
+@dispatcher.route(traffic_class)
+@timed("start_handler")
 async def start_handler(client:Client,message:Message):
     user_id=message.from_user.id
+    token=re.sub(r'[^\w\-]','',message.command[1]) if len(message.command)>1 else None
+    if user_id not in ADMINS:
+        # Repeat taps and floods stop here, before any Telegram call or store read
+        verdict=start_limiter.check(user_id,token)
+        if verdict==THROTTLED:
+            try:await message.reply("⏳ Too many requests. Please wait a minute and try again.")
+            except UserIsBlocked:pass
+        if verdict!=OK:return
     mention=f"[{message.from_user.first_name}](tg://user?id={user_id})"
     await message.react(random.choice(D))
     
@@ -64,32 +257,26 @@ async def start_handler(client:Client,message:Message):
         else:
             welcome_text=f"👋 **Welcome, {mention}!**\n\nMy Father - @DshDm_bot"
         await message.reply(welcome_text,parse_mode=enums.ParseMode.MARKDOWN,effect_id=get_random_effect())
+        start_limiter.answered(user_id)
     else:
         try:
-            encoded_str=re.sub(r'[^\w\-]','',message.command[1])
-            msg_id=await decode_encoded_string(encoded_str)
-            msg=await client.get_messages(LOGGER_ID,msg_id)
-            if not msg.text:raise ValueError("No content found")
-            link=msg.text
-            
-            link_record=await db.links.find_one({"logger_msg_id":msg_id})
-            if link_record:
-                caption=link_record.get("caption","🔓 **Cᴏɴᴛᴇɴᴛ Uɴʟᴏᴄᴋᴇᴅ!**")
-                await db.increment_link_access(link_record['_id'])
-            else:
-                caption="🔓 **Cᴏɴᴛᴇɴᴛ Uɴʟᴏᴄᴋᴇᴅ!**"
+            cached=await resolve_link(client,token)
+            caption=cached["caption"]
+            # Expired and used-up links are refused from the cached entry, without a logger fetch
+            if db.link_expired(cached):raise ValueError("Link expired")
+            if cached["_id"]:
+                if not await db.increment_link_access(cached["_id"],cached.get("max_access")):raise ValueError("Link used up")
+                await db.record_visitor(cached["_id"],user_id)
             
-            content_button=InlineKeyboardButton("Yᴏᴜʀ Lɪɴᴋ",url=link if link.startswith("http")else f"https://t.me/{link.lstrip('@')}")
+            markup=cached.get("markup")
+            if markup is None:
+                link=cached["link"]
+                # Built once per cached link and reused for every /start
+                markup=cached["markup"]=InlineKeyboardMarkup([[InlineKeyboardButton("Yᴏᴜʀ Lɪɴᴋ",url=link if link.startswith("http")else f"https://t.me/{link.lstrip('@')}")]])
             bb = await message.reply("<blockquote><i>⚠️ ꜱєηᴅ ʏσᴜʀ ʀєǫᴜєꜱᴛ, ɪ’ʟʟ ʀєᴘσʀᴛ ɪᴛ ᴛσ ᴛʜє ᴧᴅϻɪηꜱ. ʏσᴜ’ʟʟ ʙє ᴧᴅᴅєᴅ ᴡɪᴛʜɪη 5 ϻɪηᴜᴛєꜱ — ꜱᴛᴧʏ ᴛᴜηєᴅ ʙᴧʙʏ. 😉</i></blockquote>", parse_mode=enums.ParseMode.HTML)
-            aa=await message.reply(f"**{caption}**",reply_markup=InlineKeyboardMarkup([[content_button]]),protect_content=True,disable_notification=True,link_preview_options=LinkPreviewOptions(is_disabled=True),parse_mode=enums.ParseMode.MARKDOWN,effect_id=get_random_effect())
-            
-            async def delete_msg():
-                await asyncio.sleep(180)
-                try: await aa.delete()
-                except: pass
-                try: await bb.delete()
-                except: pass
-            asyncio.create_task(delete_msg())
+            aa=await message.reply(f"**{caption}**",reply_markup=markup,protect_content=True,disable_notification=True,link_preview_options=LinkPreviewOptions(is_disabled=True),parse_mode=enums.ParseMode.MARKDOWN,effect_id=get_random_effect())
+            await app.deletions.schedule(message.chat.id,[aa.id,bb.id],cached.get("delete_after") or DELETE_AFTER)
+            start_limiter.answered(user_id,token,cached.get("delete_after") or DELETE_AFTER)
             
         except UserIsBlocked:
             print(f"User {user_id} blocked the bot.")
@@ -101,10 +288,7 @@ async def start_handler(client:Client,message:Message):
                 print(f"User {user_id} blocked the bot.")
                 await db.delete_user(user_id)
 
-    async def log_start():
-        try:await client.send_message(LOGGER_ID,f"Bot started by: {mention}",parse_mode=enums.ParseMode.MARKDOWN)
-        except Exception:print(f"WARNING: Could not log to LOGGER_ID {LOGGER_ID}")
-    asyncio.create_task(log_start())
+    log_pipe.log("starts",mention)
 
     if not await db.present_user(user_id):
         await db.add_user(user_id,message.from_user.username,message.from_user.first_name)
@@ -112,34 +296,73 @@ async def start_handler(client:Client,message:Message):
         await db.update_user_last_seen(user_id)
 
 @app.on_message(filters.private & filters.command("stats") & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("stats_handler")
 async def stats_handler(client:Client,message:Message):
-    await handle_stats(client,message,db,bot_start_time)
+    await handle_stats(client,message,db,bot_start_time,find_link)
 
 @app.on_message(filters.command("help"))
+@dispatcher.route(traffic_class)
+@timed("help_handler")
 async def help_handler(client:Client,message:Message):
     user_id=message.from_user.id
     await message.reply(ADMIN_HELP_TEXT if user_id in ADMINS else USER_HELP_TEXT,parse_mode=enums.ParseMode.MARKDOWN)
 
 @app.on_message(filters.private & filters.command("broadcast") & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("broadcast")
 async def broadcast_handler(client:Client,message:Message):
-    await handle_broadcast(client,message,db)
+    await handle_broadcast(client,message,db,workers=BROADCAST_WORKERS,rate=BROADCAST_RATE)
+
+timed_join_request=timed("join_request")(handle_join_request)
+timed_deleted_request=timed("deleted_join_request")(handle_deleted_request)
 
-def join_request_callback(client:Client,update:ChatJoinRequest):
+async def join_request_callback(client:Client,update:ChatJoinRequest):
     if hasattr(update,'deleted')and update.deleted:
-        client.loop.create_task(handle_deleted_request(client,update))
+        dispatcher.submit("join",timed_deleted_request,client,update)
     else:
-        client.loop.create_task(handle_join_request(client,update))
+        dispatcher.submit("join",timed_join_request,client,update)
 app.add_handler(ChatJoinRequestHandler(join_request_callback))
 
+@app.on_message(filters.private & filters.command("profile") & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("profile_handler")
+async def profile_handler(client:Client,message:Message):
+    await handle_profile(client,message,profiler)
+
+@app.on_message(filters.private & filters.command("slowlog") & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("slow_log_handler")
+async def slow_log_handler(client:Client,message:Message):
+    await handle_slow_log(message)
+
+@app.on_message(filters.private & filters.command("backfill") & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("backfill_handler")
+async def backfill_handler(client:Client,message:Message):
+    await handle_backfill(client,message,db,LOGGER_ID)
+
 @app.on_message(filters.command(["settime","st"]) & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("set_delay_handler")
 async def set_delay_handler(client:Client,message:Message):
     await set_approve_delay(client,message)
 
 @app.on_message(filters.command(["d","default"]) & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("reset_delay_handler")
 async def reset_delay_handler(client:Client,message:Message):
     await reset_delay(client,message)
 
+@app.on_message(filters.private & bulk_file & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("bulk_links_handler")
+async def bulk_links_handler(client:Client,message:Message):
+    await handle_bulk_links(client,message,db,LOGGER_ID,make_link)
+
 @app.on_message(filters.private & filters.user(ADMINS))
+@dispatcher.route("admin")
+@timed("owner_handler")
 async def owner_handler(client:Client,message:Message):
     if message.text and message.text.startswith('/'):return
     
@@ -166,46 +389,105 @@ async def owner_handler(client:Client,message:Message):
         await message.reply("❌ Please send text content or forward a message")
         return
 
-    encoded_string=generate_encoded_string(msg_id)
-    bot_link=f"https://t.me/{app.me.username}?start={encoded_string}"
+    caption,flags=parse_link_flags(caption)
+    caption=caption or "Content Unlocked!"
+    try:options=parse_link_options(flags)
+    except ValueError:
+        await message.reply("❌ Invalid --del/--ttl time or --max count. Use formats like: 30s, 2mi, 1h, 1d and --max=100")
+        return
+
+    link_id=await db.save_link(link,message.from_user.id,caption,msg_id,**options)
+    db.cache_link(link_id,link,caption,link_id,**options)
+
+    bot_link=make_link(link_id)
     share_button=InlineKeyboardButton("🔁 Share URL",url=f"https://telegram.me/share/url?url={bot_link}")
+    limits=describe_limits(options)
     
-    await message.reply(f"✅ **Secure Link Created!**\n\n{bot_link}",reply_markup=InlineKeyboardMarkup([[share_button]]),parse_mode=enums.ParseMode.MARKDOWN)
-    
-    link_id=await db.create_link(link,message.from_user.id,caption)
-    await db.set_logger_msg_id(link_id,msg_id)
+    await message.reply(f"✅ **Secure Link Created!**\n\n{bot_link}"+(f"\n\n⏳ {limits}" if limits else ""),reply_markup=InlineKeyboardMarkup([[share_button]]),parse_mode=enums.ParseMode.MARKDOWN)
 
 
 
 # --- Main Execution & Web Server for Health Check ---
 async def web_server():
-    async def health(_): return web.Response(text=f"Bot @{app.me.username} alive!")
-    app_web = web.Application(); app_web.router.add_get('/', health)
+    async def health(_):
+        if not app.ready: return web.Response(status=503, text="Starting")
+        if not app.me: return web.Response(status=503, text="Telegram not connected")
+        if not await db.ping(): return web.Response(status=503, text="Database unreachable")
+        return web.Response(text=f"Bot @{app.me.username} alive!")
+    async def prometheus(_): return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+    def authorized(request): return hmac.compare_digest(request.query.get("token", request.headers.get("X-Debug-Token", "")), DEBUG_TOKEN)
+    async def profile(request):
+        if not authorized(request): return web.Response(status=403, text="Forbidden")
+        try: seconds = profile_seconds(request.query.get("seconds", 10))
+        except ValueError: return web.Response(status=400, text=f"seconds must be a number (clamped to {PROFILE_MIN_SECONDS:g}-{PROFILE_MAX_SECONDS}s)")
+        try: stacks, _ = await profiler.run(seconds)
+        except (ValueError, RuntimeError) as e: return web.Response(status=409, text=str(e))
+        return web.Response(text=stacks, content_type="text/plain", charset="utf-8")
+    async def slow_log(request):
+        if not authorized(request): return web.Response(status=403, text="Forbidden")
+        return web.Response(text="".join(tracing.format_entry(e) + "\n" for e in tracing.SLOW_LOG), content_type="text/plain", charset="utf-8")
+    @web.middleware
+    async def until_ready(request, handler):
+        # The API and debug routes need the store, indexes and app.me; only health and metrics answer during startup
+        if not app.ready and request.path.startswith(("/api/", "/debug/")): return web.Response(status=503, text="Starting")
+        return await handler(request)
+    app_web = web.Application(client_max_size=API_MAX_BYTES, middlewares=[until_ready]); app_web.router.add_get('/', health); app_web.router.add_get('/metrics', prometheus)
+    # Profiling endpoints only exist when a token protects them
+    if DEBUG_TOKEN: app_web.router.add_get('/debug/profile', profile); app_web.router.add_get('/debug/slowlog', slow_log)
+    # Link API: bulk creation and stats without Telegram, only when a token protects it
+    if API_TOKEN: LinkAPI(db, API_TOKEN, OWNER_ID, make_link, lambda text: decode_link_token(start_token(text)),
+                             lambda: app.me.username if app.ready and app.me else None).register(app_web)
     runner = web.AppRunner(app_web); await runner.setup()
     port = int(os.getenv("PORT", 8080))
     await web.TCPSite(runner, "0.0.0.0", port).start()
     print(f"🌍 Web server on :{port}")
-
-
-if __name__ == "__main__":
+    return runner
+
+async def phase(name:str,coro):
+    """Await `coro`, recording how long it took as startup phase `name`"""
+    start=time.perf_counter()
+    try:return await coro
+    finally:startup_timings[name]=round(time.perf_counter()-start,3)
+
+async def connect_store():
+    await db.ensure_indexes()
+    await db.load_channel_config()  # fills the channel delay cache
+
+async def warm_up()->int:
+    """Fill the caches the first updates would otherwise miss; a failure only leaves that cache cold"""
+    links,logger=await asyncio.gather(phase("warm_links",warm_link_cache(WARM_LINKS)),phase("warm_logger",app.get_chat(LOGGER_ID)),return_exceptions=True)
+    for name,result in (("links",links),("logger chat",logger)):
+        if isinstance(result,Exception):print(f"[!] Warm-up of {name} failed: {result}")
+    return 0 if isinstance(links,Exception) else links
+
+async def main():
     print("🚀 Starting…")
-    app.start()
-    asyncio.get_event_loop().create_task(web_server())
-    try: app.send_message(LOGGER_ID, "✅ Bot started")
-    except Exception as e: print(f"[!] Logger send failed: {e}")
-    print(f"🤖 @{app.me.username} running")
-    idle()
-    print("🛑 Stopped")
-    app.stop()
-
-
-
-
-
-
-
-
-
-
+    started=time.perf_counter()
+    # Bind the port first so the platform sees the process; /health answers 503 until warm-up is done
+    runner=await phase("web",web_server())
+    # The store and Telegram connect concurrently; app.start() also fetches app.me
+    await asyncio.gather(phase("store",connect_store()),phase("telegram",app.start()))
+    warmed=await phase("warmup",warm_up())
+    jobs=[db.watch_channel_config(),log_pipe.run()]
+    if app.leader:jobs.append(app.leader.run())
+    else:jobs+=[app.approvals.start(),app.deletions.start(),sweep_expired_links(db,LINK_SWEEP_INTERVAL)]
+    background=[asyncio.create_task(job) for job in jobs]
+    startup_timings["total"]=round(time.perf_counter()-started,3)
+    app.ready=True
+    print(f"🤖 @{app.me.username} ready ({warmed} links cached): "+", ".join(f"{name} {seconds*1000:.0f}ms" for name,seconds in startup_timings.items()))
+    try:await app.send_message(LOGGER_ID,f"✅ Bot started in {startup_timings['total']:.1f}s")
+    except Exception as e:print(f"[!] Logger send failed: {e}")
+    try:await idle()
+    finally:
+        print("🛑 Stopped")
+        app.ready=False
+        for task in background:task.cancel()
+        if app.leader:await app.leader.resign()
+        await log_pipe.close()
+        await db.close()
+        await app.stop()
+        await runner.cleanup()
 
 
+if __name__ == "__main__":
+    loop.run_until_complete(main())
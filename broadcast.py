@@ -0,0 +1,183 @@
+import time, asyncio
+from pyrogram import Client
+from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked
+from storage import Storage
+from metrics import BROADCAST_SENT
+
+
+class TokenBucket:
+    """Global send-rate limiter that backs off when Telegram answers with FloodWait.
+
+    Tokens refill at `rate` per second up to `burst`. A FloodWait pauses every
+    caller until the wait is over and halves the rate; each successful send
+    nudges the rate back up towards `max_rate`.
+    """
+
+    def __init__(self, rate=25.0, burst=25, min_rate=1.0, max_rate=30.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        """Pause all senders for `seconds` and slow down afterwards"""
+        self.flood_waits += 1
+        now = time.monotonic()
+        if now >= self.blocked_until:
+            # Workers hitting the same flood window only slow the rate down once
+            self.rate = max(self.min_rate, self.rate / 2)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+    def reward(self):
+        # Climb back from min_rate to max_rate over roughly 500 successful sends
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 500)
+
+
+class BroadcastEngine:
+    """Copies one message to every user with a worker pool and a Mongo checkpoint.
+
+    Users are streamed in `_id` order in batches from `Storage.iter_user_ids`,
+    limited to the broadcast's segment if it has one, and the next batch is
+    fetched while the current one is being sent. After each batch the last user
+    id and the counters are saved, so a restarted bot resumes from the last
+    finished batch (at most one batch can be delivered twice).
+    """
+
+    PROGRESS_EVERY = 5  # seconds between edits of the status message
+    MAX_FLOOD_RETRIES = 3
+
+    def __init__(self, client: Client, db: Storage, state: dict, workers=20, rate=25.0, batch_size=500):
+        self.client = client
+        self.db = db
+        self.state = state
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = TokenBucket(rate=rate, burst=max(1, int(rate)), max_rate=max(rate, 30.0))
+        self.counters = state.setdefault("counters", {
+            "total": 0, "successful": 0, "blocked": 0, "deleted": 0, "unsuccessful": 0
+        })
+        self.started = time.monotonic()
+        self.sent_this_run = 0
+        self.last_progress = 0.0
+
+    async def _send(self, user_id: int) -> str:
+        for _ in range(self.MAX_FLOOD_RETRIES + 1):
+            await self.limiter.acquire()
+            try:
+                await self.client.copy_message(user_id, self.state["from_chat_id"], self.state["message_id"])
+                self.limiter.reward()
+                return "successful"
+            except FloodWait as e:
+                self.limiter.penalize(e.value)
+            except UserIsBlocked:
+                await self.db.delete_user(user_id)
+                return "blocked"
+            except InputUserDeactivated:
+                await self.db.delete_user(user_id)
+                return "deleted"
+            except Exception as e:
+                if "USER_IS_BLOCKED" in str(e):
+                    await self.db.delete_user(user_id)
+                    return "blocked"
+                if "USER_DEACTIVATED" in str(e):
+                    await self.db.delete_user(user_id)
+                    return "deleted"
+                return "unsuccessful"
+        return "unsuccessful"
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                try:
+                    result = await self._send(user_id)
+                except Exception as e:
+                    # e.g. the store failing to drop a blocked user; a dead worker would stall queue.join()
+                    print(f"Error broadcasting to {user_id}: {e}")
+                    result = "unsuccessful"
+                BROADCAST_SENT.inc(result=result)
+                self.counters[result] += 1
+                self.counters["total"] += 1
+                self.sent_this_run += 1
+            finally:
+                queue.task_done()
+
+    def progress_text(self, done=False) -> str:
+        c = self.counters
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        title = "Broadcast Completed" if done else "Broadcasting…"
+        return (
+            f"<b><u>{title}</u>\n\n"
+            f"Processed: <code>{c['total']}</code> / <code>{self.state.get('audience', '?')}</code>\n"
+            f"Successful: <code>{c['successful']}</code>\n"
+            f"Blocked Users: <code>{c['blocked']}</code>\n"
+            f"Deleted Accounts: <code>{c['deleted']}</code>\n"
+            f"Unsuccessful: <code>{c['unsuccessful']}</code>\n"
+            f"Rate: <code>{self.sent_this_run / elapsed:.1f}/s</code> "
+            f"(limit <code>{self.limiter.rate:.1f}/s</code>, FloodWaits <code>{self.limiter.flood_waits}</code>)</b>"
+        )
+
+    async def _report(self, done=False):
+        now = time.monotonic()
+        if not done and now - self.last_progress < self.PROGRESS_EVERY:
+            return
+        self.last_progress = now
+        for _ in range(2 if done else 1):
+            try:
+                await self.client.edit_message_text(
+                    self.state["status_chat_id"], self.state["status_message_id"], self.progress_text(done)
+                )
+                return
+            except FloodWait as e:
+                # The limit is on editing, not sending: hold back the next progress edit, not the send rate.
+                # The final summary waits it out once.
+                self.last_progress = now + e.value
+                if done:
+                    await asyncio.sleep(e.value)
+            except Exception:
+                return
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.batch_size)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        batches = self.db.iter_user_ids(self.state.get("segment"), self.batch_size, self.state.get("last_user_id"))
+        fetch = asyncio.ensure_future(batches.__anext__())
+        try:
+            while True:
+                try:
+                    batch = await fetch
+                except StopAsyncIteration:
+                    break
+                fetch = asyncio.ensure_future(batches.__anext__())
+                for user_id in batch:
+                    await queue.put(user_id)
+                await queue.join()
+                self.state["last_user_id"] = batch[-1]
+                await self.db.save_broadcast(self.state)
+                await self._report()
+        finally:
+            fetch.cancel()
+            for w in workers:
+                w.cancel()
+        await self.db.finish_broadcast(self.state["_id"])
+        await self._report(done=True)
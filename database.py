@@ -1,14 +1,296 @@
+import time, asyncio
 import motor.motor_asyncio
-from datetime import datetime
+from datetime import datetime, timezone
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
+from storage import Storage
+from hll import HyperLogLog
+from metrics import MongoCommandTimer, WRITE_BEHIND_FAILED
 
-class Database:
-    def __init__(self, mongo_url, db_name="link_bot"):
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(mongo_url)
+
+class WriteBehind:
+    """Coalesces $inc/$set/$max updates in memory and flushes them as one bulk_write per collection.
+
+    Updates to the same document are merged, so a burst of link opens turns into a
+    single `$inc` per hot document. A flush runs every `flush_interval` seconds or
+    once `max_ops` updates are buffered, whichever comes first. At most
+    `max_pending` distinct documents are held; beyond that callers wait for a flush.
+    Updates whose bulk_write fails are merged back into the buffer and retried on
+    the next flush, as far as `max_pending` allows.
+    """
+
+    def __init__(self, flush_interval=0.5, max_ops=500, max_pending=10000):
+        self.flush_interval = flush_interval
+        self.max_ops = max_ops
+        self.max_pending = max_pending
+        self._pending = {}  # (collection name, filter key) -> pending update
+        self._collections = {}
+        self._ops = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._closed = False
+        self.flushes = 0
+        self.written = 0
+
+    def _entry(self, collection, filter_, upsert):
+        key = (collection.name, tuple(sorted(filter_.items())))
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {"filter": filter_, "inc": {}, "set": {}, "max": {}, "upsert": upsert}
+            self._collections[collection.name] = collection
+        entry["upsert"] = entry["upsert"] or upsert
+        return entry
+
+    async def _admit(self):
+        if self._task is None and not self._closed:
+            self._task = asyncio.create_task(self._run())
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    def _count_op(self):
+        self._ops += 1
+        if self._ops >= self.max_ops and not self._lock.locked():
+            asyncio.create_task(self.flush())
+
+    async def inc(self, collection, filter_, fields, upsert=False):
+        """Buffer an `$inc` of `fields` on the document matching `filter_`"""
+        await self._admit()
+        incs = self._entry(collection, filter_, upsert)["inc"]
+        for field, delta in fields.items():
+            incs[field] = incs.get(field, 0) + delta
+        self._count_op()
+
+    async def set(self, collection, filter_, fields, upsert=False):
+        """Buffer a `$set` of `fields`; later values overwrite earlier ones"""
+        await self._admit()
+        self._entry(collection, filter_, upsert)["set"].update(fields)
+        self._count_op()
+
+    async def max(self, collection, filter_, fields, upsert=False):
+        """Buffer a `$max` of `fields`; only the largest value per field is kept"""
+        await self._admit()
+        maxes = self._entry(collection, filter_, upsert)["max"]
+        for field, value in fields.items():
+            if field not in maxes or value > maxes[field]:
+                maxes[field] = value
+        self._count_op()
+
+    def _requeue(self, key, entry) -> bool:
+        """Merge a failed update back under whatever was buffered for the document since"""
+        current = self._pending.get(key)
+        if current is None:
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending[key] = entry
+            return True
+        for field, delta in entry["inc"].items():
+            current["inc"][field] = current["inc"].get(field, 0) + delta
+        current["set"] = {**entry["set"], **current["set"]}
+        for field, value in entry["max"].items():
+            if field not in current["max"] or value > current["max"][field]:
+                current["max"][field] = value
+        current["upsert"] = current["upsert"] or entry["upsert"]
+        return True
+
+    async def flush(self):
+        """Write everything buffered so far"""
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending, self._ops = self._pending, {}, 0
+            batches = {}
+            for key, entry in pending.items():
+                update = {}
+                if entry["inc"]:
+                    update["$inc"] = entry["inc"]
+                if entry["set"]:
+                    update["$set"] = entry["set"]
+                if entry["max"]:
+                    update["$max"] = entry["max"]
+                batches.setdefault(key[0], []).append((key, entry, UpdateOne(entry["filter"], update,
+                                                                             upsert=entry["upsert"])))
+            for name, batch in batches.items():
+                try:
+                    await self._collections[name].bulk_write([op for _, _, op in batch], ordered=False)
+                    self.written += len(batch)
+                except Exception as e:
+                    failed = batch
+                    if isinstance(e, BulkWriteError):
+                        # Unordered: everything but the reported write errors was applied
+                        failed = [batch[error["index"]] for error in e.details.get("writeErrors", [])]
+                    requeued = sum(self._requeue(key, entry) for key, entry, _ in failed)
+                    self.written += len(batch) - len(failed)
+                    WRITE_BEHIND_FAILED.inc(requeued, collection=name, result="requeued")
+                    if len(failed) > requeued:
+                        WRITE_BEHIND_FAILED.inc(len(failed) - requeued, collection=name, result="dropped")
+                    print(f"Error flushing {len(batch)} buffered writes to {name}, {requeued} requeued: {e}")
+            self.flushes += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed: {e}")
+
+    async def close(self):
+        """Stop the flush loop and write out whatever is still buffered"""
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def _limits(expire_at, max_access):
+    """Expiry fields for a link document; links without limits don't carry them (and stay out of the TTL index)"""
+    fields = {}
+    if expire_at is not None:
+        fields["expire_at"] = expire_at
+    if max_access is not None:
+        fields["max_access"] = max_access
+    return fields
+
+
+# BSON types in MongoDB's sort order, as far as export keys use them
+_KEY_TYPES = ("number", "string", "objectId")
+
+
+def _keys_after(key, last_key):
+    """Keyset filter for `key` > `last_key` in sort order.
+
+    `$gt` only matches values of the same BSON type, so on its own it would stop
+    an export at the last number and skip string keys (the "default" channel).
+    """
+    if isinstance(last_key, str):
+        bracket = "string"
+    elif isinstance(last_key, (int, float)):
+        bracket = "number"
+    else:
+        bracket = "objectId"
+    later = list(_KEY_TYPES[_KEY_TYPES.index(bracket) + 1:])
+    query = {key: {"$gt": last_key}}
+    return {"$or": [query, {key: {"$type": later}}]} if later else query
+
+
+def _plan_stages(plan):
+    """Flatten an explain() winning plan into its list of stage names, outermost first"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("queryPlan", "inputStage"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+class Database(Storage):
+    """MongoDB backend (the default)"""
+
+    def __init__(self, mongo_url, db_name="link_bot", link_cache_size=10000, link_cache_ttl=600,
+                 flush_interval=0.5, flush_ops=500):
+        super().__init__(link_cache_size=link_cache_size, link_cache_ttl=link_cache_ttl)
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandTimer()])
         self.db = self.client[db_name]
         self.user_data = self.db.users  # Using the simpler demo structure
         self.channels = self.db.channels
         self.links = self.db.links
         self.stats = self.db.stats
+        self.broadcasts = self.db.broadcasts
+        self.join_requests = self.db.join_requests
+        self.meta = self.db.meta
+        self.deletions = self.db.deletions
+        self.analytics = self.db.analytics
+        # HyperLogLog registers per link/day: {"_id": key, "r": {"index": rank}, "expire_at"}
+        self.sketches = self.db.sketches
+        # Expired links with their final counters; keeps `links` down to live links
+        self.links_archive = self.db.links_archive
+        # approve_delays is kept in sync across instances via a version stamp in meta
+        # Counters and last-seen timestamps are buffered and written in bulk
+        self.writer = WriteBehind(flush_interval=flush_interval, max_ops=flush_ops)
+
+    def pending_writes(self) -> int:
+        return len(self.writer)
+
+    async def flush(self):
+        await self.writer.flush()
+
+    async def close(self):
+        """Flush buffered writes; call before the process exits"""
+        await self.writer.close()
+
+    async def ping(self, timeout=2) -> bool:
+        """Check that MongoDB answers within `timeout` seconds"""
+        try:
+            await asyncio.wait_for(self.client.admin.command("ping"), timeout)
+            return True
+        except Exception:
+            return False
+
+    # (collection attribute, keys, options) created by ensure_indexes
+    INDEXES = [
+        ("channels", [("channel_id", ASCENDING)], {"unique": True}),
+        ("links", [("logger_msg_id", ASCENDING)],
+         {"unique": True, "partialFilterExpression": {"logger_msg_id": {"$gt": 0}}}),
+        ("stats", [("type", ASCENDING)], {"unique": True}),
+        ("broadcasts", [("status", ASCENDING), ("created_at", DESCENDING)], {}),
+        ("analytics", [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        ("sketches", [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        # Serves the archive sweep; the TTL only removes links the sweep missed for a week (e.g. no leader)
+        ("links", [("expire_at", ASCENDING)],
+         {"expireAfterSeconds": 7 * 86400, "partialFilterExpression": {"expire_at": {"$exists": True}}}),
+        ("links_archive", [("logger_msg_id", ASCENDING)], {"partialFilterExpression": {"logger_msg_id": {"$gt": 0}}}),
+        ("join_requests", [("due_at", ASCENDING)], {}),
+        # Segmented broadcast pages: the segment range and the _id keyset bound in one covered index scan
+        ("user_data", [("last_seen", ASCENDING), ("_id", ASCENDING)], {}),
+        ("user_data", [("created_at", ASCENDING), ("_id", ASCENDING)], {}),
+        ("deletions", [("due_at", ASCENDING)], {}),
+    ]
+
+    # (collection attribute, index name) replaced by an entry of INDEXES; dropped by ensure_indexes
+    SUPERSEDED_INDEXES = [
+        ("user_data", "last_seen_1"),
+        ("user_data", "created_at_1"),
+    ]
+
+    # (collection attribute, filter) for the queries that run on every update
+    HOT_QUERIES = [
+        ("links", {"logger_msg_id": 1}),
+        ("channels", {"channel_id": 1}),
+        ("stats", {"type": "total_users"}),
+    ]
+
+    async def ensure_indexes(self):
+        """Create the indexes the hot queries rely on and verify none of them is a COLLSCAN"""
+        for name, keys, options in self.INDEXES:
+            collection = getattr(self, name)
+            try:
+                await collection.create_index(keys, **options)
+            except OperationFailure as e:
+                if not options.get("unique") or e.code != 11000:
+                    print(f"WARNING: could not create index {keys} on {name}: {e}")
+                    continue
+                # Existing duplicates; fall back to a plain index so lookups stay fast
+                print(f"WARNING: duplicate values in {name}.{keys[0][0]}, creating a non-unique index instead")
+                options = {k: v for k, v in options.items() if k != "unique"}
+                await collection.create_index(keys, **options)
+
+        for name, index in self.SUPERSEDED_INDEXES:
+            try:
+                await getattr(self, name).drop_index(index)
+            except OperationFailure:
+                pass  # already gone
+
+        for name, query in self.HOT_QUERIES:
+            explain = await getattr(self, name).find(query).explain()
+            stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+            print(f"Query plan for {name} {query}: {' <- '.join(stages) or 'unknown'}")
+            if "COLLSCAN" in stages:
+                raise RuntimeError(f"Hot query on {name} {query} runs as a COLLSCAN; check its index")
 
     async def present_user(self, user_id: int):
         """Check if a user exists (demo-compatible)"""
@@ -31,14 +313,12 @@ class Database:
         result = await self.user_data.insert_one(user_data)
         if result.inserted_id:
             await self.update_stat("total_users", 1)
+            await self.record_rollup("new_users")
         return result.inserted_id is not None
 
     async def update_user_last_seen(self, user_id):
-        """Update last seen timestamp for a user"""
-        await self.user_data.update_one(
-            {"_id": user_id},
-            {"$set": {"last_seen": datetime.now()}}
-        )
+        """Update last seen timestamp for a user (buffered)"""
+        await self.writer.set(self.user_data, {"_id": user_id}, {"last_seen": datetime.now()})
 
     async def create_channel(self, channel_id, title, username):
         """Create a new channel entry with detailed logging"""
@@ -51,6 +331,8 @@ class Database:
                 "approve_delay": 180  # Default 3 minutes
             }
             result = await self.channels.insert_one(channel_data)
+            self.approve_delays[channel_id] = channel_data["approve_delay"]
+            await self._bump_config_version()
             print(f"Created channel {channel_id} in database")
             return result
         except Exception as e:
@@ -61,13 +343,167 @@ class Database:
         """Set approval delay for join requests in seconds"""
         await self.channels.update_one(
             {"channel_id": channel_id},
-            {"$set": {"approve_delay": delay}}
+            {"$set": {"approve_delay": delay}},
+            upsert=True
+        )
+        self.approve_delays[channel_id] = delay
+        await self._bump_config_version()
+
+    async def load_channel_config(self):
+        """Load every channel's approve_delay into memory"""
+        delays = {}
+        async for channel in self.channels.find({}, {"channel_id": 1, "approve_delay": 1}):
+            if "approve_delay" in channel:
+                delays[channel["channel_id"]] = channel["approve_delay"]
+        meta = await self.meta.find_one({"_id": "channel_config"})
+        self.approve_delays = delays
+        self.config_version = meta["version"] if meta else 0
+
+    async def _bump_config_version(self):
+        meta = await self.meta.find_one_and_update(
+            {"_id": "channel_config"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        self.config_version = meta["version"]
+
+    async def watch_channel_config(self, interval=30):
+        """Reload the delay map whenever another instance bumps the config version"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                meta = await self.meta.find_one({"_id": "channel_config"})
+                if meta and meta["version"] != self.config_version:
+                    await self.load_channel_config()
+                    print(f"Reloaded channel config (version {self.config_version})")
+            except Exception as e:
+                print(f"Error checking channel config version: {e}")
+
+    async def add_join_request(self, chat_id: int, user_id: int, due_at: float):
+        """Persist a join request that should be approved at `due_at` (epoch seconds)"""
+        await self.join_requests.update_one(
+            {"_id": f"{chat_id}:{user_id}"},
+            {"$set": {"chat_id": chat_id, "user_id": user_id, "due_at": due_at}},
+            upsert=True
+        )
+
+    async def remove_join_request(self, chat_id: int, user_id: int):
+        await self.join_requests.delete_one({"_id": f"{chat_id}:{user_id}"})
+
+    async def remove_join_requests(self, chat_id: int, user_ids):
+        await self.join_requests.delete_many({"_id": {"$in": [f"{chat_id}:{u}" for u in user_ids]}})
 
-    async def get_approve_delay(self, channel_id: int) -> int:
-        """Get approval delay for a channel"""
-        channel = await self.channels.find_one({"channel_id": channel_id})
-        return channel.get("approve_delay", 180) if channel else 180
+    async def get_stored_join_requests(self, chat_id: int, user_ids) -> set:
+        query = {"_id": {"$in": [f"{chat_id}:{u}" for u in user_ids]}}
+        return {request["user_id"] async for request in self.join_requests.find(query, {"user_id": 1})}
+
+    async def get_join_requests(self, due_before=None):
+        """Iterate over outstanding join requests (only those due by `due_before` if given)"""
+        query = {"due_at": {"$lte": due_before}} if due_before is not None else {}
+        async for request in self.join_requests.find(query):
+            yield request
+
+    async def save_link(self, link, owner_id, caption, logger_msg_id, delete_after=None, expire_at=None,
+                        max_access=None):
+        """Create the link stored at `logger_msg_id`, or update it (limits included) if it already exists"""
+        limits = _limits(expire_at, max_access)
+        update = {
+            "$set": {"link": link, "caption": caption, "delete_after": delete_after, **limits},
+            "$setOnInsert": {"owner_id": owner_id, "created_at": datetime.now(), "access_count": 0}
+        }
+        # A re-save without --ttl/--max lifts the limits of the previous save
+        unset = {field: "" for field in ("expire_at", "max_access") if field not in limits}
+        if unset:
+            update["$unset"] = unset
+        result = await self.links.update_one({"logger_msg_id": logger_msg_id}, update, upsert=True)
+        self.link_cache.pop(logger_msg_id)
+        if result.upserted_id is not None:
+            await self.update_stat("total_links", 1)
+            return result.upserted_id
+        link_id = (await self.get_link_by_msg_id(logger_msg_id))["_id"]
+        self.link_cache.pop(link_id)
+        return link_id
+
+    async def backfill_links(self, entries):
+        """Insert links recovered from the logger channel; existing links are left untouched"""
+        if not entries:
+            return 0
+        result = await self.links.bulk_write([
+            UpdateOne(
+                {"logger_msg_id": entry["logger_msg_id"]},
+                {"$setOnInsert": {**entry, "owner_id": None, "access_count": 0}},
+                upsert=True
+            ) for entry in entries
+        ], ordered=False)
+        return result.upserted_count
+
+    async def get_checkpoint(self, name):
+        doc = await self.meta.find_one({"_id": f"checkpoint:{name}"})
+        return doc["value"] if doc else None
+
+    async def set_checkpoint(self, name, value):
+        await self.meta.update_one({"_id": f"checkpoint:{name}"}, {"$set": {"value": value}}, upsert=True)
+
+    def _export_collection(self, collection):
+        return self.user_data if collection == "users" else getattr(self, collection)
+
+    async def get_documents_after(self, collection, last_key=None, limit=1000):
+        await self.writer.flush()  # buffered counters and stats
+        key = self.EXPORT_KEYS[collection]
+        query = _keys_after(key, last_key) if last_key is not None else {}
+        # Channels and stats are matched by their natural key; their ObjectIds mean nothing elsewhere
+        projection = None if key == "_id" else {"_id": 0}
+        cursor = self._export_collection(collection).find(query, projection).sort(key, ASCENDING).limit(limit)
+        return [doc async for doc in cursor]
+
+    async def import_documents(self, collection, docs):
+        if not docs:
+            return
+        key = self.EXPORT_KEYS[collection]
+        await self._export_collection(collection).bulk_write(
+            [ReplaceOne({key: doc[key]}, {k: v for k, v in doc.items() if k != "_id" or key == "_id"}, upsert=True)
+             for doc in docs],
+            ordered=True
+        )
+        if collection == "links":
+            for doc in docs:
+                self.link_cache.pop(doc["_id"])
+                self.link_cache.pop(doc.get("logger_msg_id"))
+        elif collection == "channels":
+            self.approve_delays.update({doc["channel_id"]: doc["approve_delay"] for doc in docs if "approve_delay" in doc})
+            await self._bump_config_version()
+
+    async def add_deletion(self, doc_id, chat_id: int, message_ids: list, due_at: float):
+        """Persist messages that should be deleted at `due_at`"""
+        await self.deletions.insert_one(
+            {"_id": doc_id, "chat_id": chat_id, "message_ids": message_ids, "due_at": due_at}
+        )
+
+    async def remove_deletions(self, doc_ids):
+        await self.deletions.delete_many({"_id": {"$in": doc_ids}})
+
+    async def get_deletions(self, due_before=None):
+        """Iterate over outstanding message deletions (only those due by `due_before` if given)"""
+        query = {"due_at": {"$lte": due_before}} if due_before is not None else {}
+        async for entry in self.deletions.find(query):
+            yield entry
+
+    async def acquire_lease(self, name, owner, ttl) -> bool:
+        """Take or renew a lease stored in meta; expiry uses wall-clock time, so keep `ttl` well above clock skew"""
+        now = time.time()
+        try:
+            await self.meta.update_one(
+                {"_id": f"lease:{name}", "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + ttl}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # held by someone else and not expired
+
+    async def release_lease(self, name, owner):
+        await self.meta.delete_one({"_id": f"lease:{name}", "owner": owner})
 
     async def create_link(self, link, owner_id, caption="Content Unlocked!"):
         link_data = {
@@ -82,46 +518,196 @@ class Database:
         await self.update_stat("total_links", 1)
         return result.inserted_id
 
-    async def increment_link_access(self, link_id):
-        await self.links.update_one(
-            {"_id": link_id},
-            {"$inc": {"access_count": 1}}
-        )
+    async def create_links(self, entries, owner_id):
+        """Insert a batch of links with one insert_many and one stats update"""
+        if not entries:
+            return []
+        now = datetime.now()
+        result = await self.links.insert_many([{
+            "link": entry["link"],
+            "caption": entry["caption"],
+            "delete_after": entry.get("delete_after"),
+            **_limits(entry.get("expire_at"), entry.get("max_access")),
+            "owner_id": owner_id,
+            "created_at": now,
+            "access_count": 0,
+            "logger_msg_id": None
+        } for entry in entries])
+        await self.update_stat("total_links", len(result.inserted_ids))
+        return result.inserted_ids
+
+    async def increment_link_access(self, link_id, limit=None) -> bool:
+        if limit is None:
+            await self.writer.inc(self.links, {"_id": link_id}, {"access_count": 1})
+        else:
+            # Capped links are counted atomically so several instances can't overshoot the cap
+            doc = await self.links.find_one_and_update(
+                {"_id": link_id, "access_count": {"$lt": limit}}, {"$inc": {"access_count": 1}},
+                projection={"access_count": 1, "logger_msg_id": 1}, return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                return False
+            if doc["access_count"] >= limit:
+                await self.links.update_one({"_id": link_id}, {"$min": {"expire_at": datetime.now(timezone.utc)}})
+                self.link_cache.pop(link_id)
+                self.link_cache.pop(doc.get("logger_msg_id"))
         await self.update_stat("total_accesses", 1)
+        await self.record_rollup("opens", "links", link_id)
+        return True
+
+    async def record_rollup(self, counter, group=None, key=None, amount=1):
+        """Add `amount` to `counter` (and to `group.key` if given) in the current minute/hour/day buckets.
+
+        Each bucket is one analytics document, so reports read a few documents
+        instead of scanning users or links. Writes go through the write-behind buffer.
+        """
+        fields = {counter: amount}
+        if group is not None:
+            fields[f"{group}.{key}"] = amount
+        for bucket, doc in self.rollup_buckets():
+            _id = {"_id": bucket}
+            await self.writer.inc(self.analytics, _id, fields, upsert=True)
+            await self.writer.set(self.analytics, _id, doc, upsert=True)
+
+    async def get_rollups(self, prefix, count):
+        """Get the last `count` buckets of one granularity, oldest first (missing buckets are empty)"""
+        await self.writer.flush()
+        ids = self.rollup_ids(prefix, count)
+        docs = {doc["_id"]: doc async for doc in self.analytics.find({"_id": {"$in": ids}})}
+        return [docs.get(_id, {"_id": _id}) for _id in ids]
+
+    async def update_sketch(self, key, index, rank, expire_at=None):
+        await self.writer.max(self.sketches, {"_id": key}, {f"r.{index}": rank}, upsert=True)
+        if expire_at:
+            await self.writer.set(self.sketches, {"_id": key}, {"expire_at": expire_at}, upsert=True)
+
+    async def get_sketches(self, keys):
+        await self.writer.flush()
+        return {doc["_id"]: doc.get("r", {}) async for doc in self.sketches.find({"_id": {"$in": list(keys)}}, {"r": 1})}
+
+    async def get_links(self, link_ids):
+        return [doc async for doc in self.links.find({"_id": {"$in": list(link_ids)}})]
+
+    async def archive_expired_links(self, batch_size=500) -> int:
+        """Copy expired links to links_archive with their final counters, then drop them and their sketches"""
+        await self.writer.flush()  # final access counts
+        now = datetime.now(timezone.utc)
+        docs = [doc async for doc in self.links.find({"expire_at": {"$lte": now}}).limit(batch_size)]
+        if not docs:
+            return 0
+        sketches = await self.get_sketches(self.visitor_keys(doc["_id"])[0] for doc in docs)
+        for doc in docs:
+            registers = sketches.get(self.visitor_keys(doc["_id"])[0], {})
+            doc.update(unique_visitors=HyperLogLog(registers).count(), archived_at=now)
+        await self.links_archive.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+                                            ordered=False)
+        ids = [doc["_id"] for doc in docs]
+        await self.links.delete_many({"_id": {"$in": ids}})
+        await self.sketches.delete_many({"_id": {"$in": list(sketches)}})
+        for doc in docs:
+            self.link_cache.pop(doc["_id"])
+            self.link_cache.pop(doc.get("logger_msg_id"))
+        await self.update_stat("expired_links", len(docs))
+        return len(docs)
+
+    async def get_archived_link(self, link_id):
+        return await self.links_archive.find_one({"_id": link_id})
+
+    async def get_archived_link_by_msg_id(self, logger_msg_id):
+        return await self.links_archive.find_one({"logger_msg_id": logger_msg_id})
         
     async def set_logger_msg_id(self, link_id, logger_msg_id):
         await self.links.update_one(
             {"_id": link_id},
             {"$set": {"logger_msg_id": logger_msg_id}}
         )
+        self.link_cache.pop(logger_msg_id)
+
+    async def get_link(self, link_id):
+        return await self.links.find_one({"_id": link_id})
+
+    async def get_link_by_msg_id(self, logger_msg_id):
+        return await self.links.find_one({"logger_msg_id": logger_msg_id})
 
     async def update_stat(self, stat_type, increment=1):
-        await self.stats.update_one(
-            {"type": stat_type},
-            {"$inc": {"count": increment}},
-            upsert=True
-        )
+        await self.writer.inc(self.stats, {"type": stat_type}, {"count": increment}, upsert=True)
 
     async def get_stat(self, stat_type):
+        await self.writer.flush()
         stat = await self.stats.find_one({"type": stat_type})
         return stat["count"] if stat else 0
 
     async def get_all_stats(self):
+        await self.writer.flush()
         stats = {}
         async for stat in self.stats.find({}):
             stats[stat["type"]] = stat["count"]
         return stats
 
-    async def get_all_user_ids(self):
-        """Get all user IDs from the database (demo-compatible)"""
-        user_ids = []
-        async for doc in self.user_data.find({}, {'_id': 1}):
-            user_ids.append(doc['_id'])
-        return user_ids
-
     async def delete_user(self, user_id: int):
         """Delete a user from the database (demo-compatible)"""
         result = await self.user_data.delete_one({'_id': user_id})
         if result.deleted_count:
             await self.update_stat("total_users", -1)
         return result.deleted_count > 0
+
+    def _segment_query(self, segment):
+        query = {}
+        seen_after, created_after = self.segment_bounds(segment)
+        if seen_after:
+            query['last_seen'] = {'$gte': seen_after}
+        if created_after:
+            query['created_at'] = {'$gte': created_after}
+        return query
+
+    async def get_user_ids_after(self, last_id=None, limit=500, segment=None):
+        """Get the next batch of user IDs in _id order (keyset pagination)"""
+        query = self._segment_query(segment)
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        cursor = self.user_data.find(query, {'_id': 1}).sort('_id', 1).limit(limit)
+        return [doc['_id'] async for doc in cursor]
+
+    async def count_users(self, segment=None):
+        if not segment:
+            return await self.user_data.estimated_document_count()
+        return await self.user_data.count_documents(self._segment_query(segment))
+
+    async def start_broadcast(self, from_chat_id, message_id, status_chat_id, status_message_id, segment=None):
+        """Create the checkpoint document for a new broadcast"""
+        await self.broadcasts.update_many({"status": "running"}, {"$set": {"status": "abandoned"}})
+        state = {
+            "status": "running",
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "last_user_id": None,
+            "segment": segment,
+            "audience": await self.count_users(segment),
+            "counters": {"total": 0, "successful": 0, "blocked": 0, "deleted": 0, "unsuccessful": 0},
+            "created_at": datetime.now()
+        }
+        result = await self.broadcasts.insert_one(state)
+        state["_id"] = result.inserted_id
+        return state
+
+    async def save_broadcast(self, state):
+        await self.broadcasts.update_one(
+            {"_id": state["_id"]},
+            {"$set": {
+                "last_user_id": state["last_user_id"],
+                "counters": state["counters"],
+                "updated_at": datetime.now()
+            }}
+        )
+
+    async def get_active_broadcast(self):
+        """Get the unfinished broadcast left behind by a crash or restart, if any"""
+        return await self.broadcasts.find_one({"status": "running"}, sort=[("created_at", -1)])
+
+    async def finish_broadcast(self, broadcast_id):
+        await self.broadcasts.update_one(
+            {"_id": broadcast_id},
+            {"$set": {"status": "done", "finished_at": datetime.now()}}
+        )
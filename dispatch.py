@@ -0,0 +1,94 @@
+import time, asyncio, functools
+from metrics import DISPATCH_WAIT, DISPATCH_SHED
+
+
+class Dispatcher:
+    """Runs update handlers in one worker pool per priority class.
+
+    pyrogram calls the wrapped handler, which only queues the work and
+    returns, so pyrogram's own workers never block on a slow class. Each class
+    ("admin", "join", "user", ...) has its own queue and `concurrency` workers,
+    so a /start flood can't delay admin commands or join requests. A class with
+    a `max_queue` sheds new updates once that many are waiting.
+    """
+
+    def __init__(self, limits: dict):
+        # class -> {"concurrency": int, "max_queue": int or None}
+        self.limits = limits
+        self.shed = {name: 0 for name in limits}
+        self.handled = {name: 0 for name in limits}
+        self._queues = {}
+        self._running = {name: 0 for name in limits}
+        self._workers = []
+
+    def _queue(self, name) -> asyncio.Queue:
+        queue = self._queues.get(name)
+        if queue is None:
+            # Created on first use so it binds to the running loop
+            queue = self._queues[name] = asyncio.Queue()
+            for _ in range(self.limits[name]["concurrency"]):
+                self._workers.append(asyncio.get_running_loop().create_task(self._worker(queue, name)))
+        return queue
+
+    def submit(self, name, func, *args, wait=False, **kwargs):
+        """Queue `func(*args)` in class `name`.
+
+        Returns False if the update was shed; with `wait=True` returns a future
+        for the handler's result instead (None if shed).
+        """
+        queue = self._queue(name)
+        max_queue = self.limits[name].get("max_queue")
+        if max_queue and queue.qsize() >= max_queue:
+            self.shed[name] += 1
+            DISPATCH_SHED.inc(**{"class": name})
+            return None if wait else False
+        future = asyncio.get_running_loop().create_future() if wait else None
+        queue.put_nowait((time.perf_counter(), func, args, kwargs, future))
+        return future if wait else True
+
+    async def _worker(self, queue: asyncio.Queue, name):
+        while True:
+            queued_at, func, args, kwargs, future = await queue.get()
+            DISPATCH_WAIT.observe(time.perf_counter() - queued_at, **{"class": name})
+            self._running[name] += 1
+            try:
+                result = await func(*args, **kwargs)
+                if future and not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if future and not future.done():
+                    future.set_exception(e)
+                else:
+                    print(f"Error in {name} handler {getattr(func, '__name__', func)}: {e}")
+            finally:
+                self._running[name] -= 1
+                self.handled[name] += 1
+
+    def route(self, name):
+        """Decorator that dispatches a handler in class `name`.
+
+        `name` may also be a function of the handler's arguments returning the
+        class, e.g. to give admins' /start its own lane. The original coroutine
+        stays reachable as `wrapper.dispatch(*args)`, which returns a future.
+        """
+        pick = name if callable(name) else (lambda *args: name)
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                self.submit(pick(*args), func, *args, **kwargs)
+
+            wrapper.dispatch = lambda *args, **kwargs: self.submit(pick(*args), func, *args, wait=True, **kwargs)
+            return wrapper
+        return decorator
+
+    def depths(self) -> dict:
+        return {name: self._queues[name].qsize() if name in self._queues else 0 for name in self.limits}
+
+    def running(self) -> dict:
+        return dict(self._running)
+
+    def stats(self) -> dict:
+        depths = self.depths()
+        return {name: {"queued": depths[name], "running": self._running[name],
+                       "handled": self.handled[name], "shed": self.shed[name]} for name in self.limits}
@@ -0,0 +1,56 @@
+import asyncio
+from storage import Storage
+
+
+class LeaderElection:
+    """Lease-based leader election between bot instances sharing one store.
+
+    Every instance calls `acquire_lease` every `ttl / 3` seconds. The one that
+    holds the lease is the leader and runs `on_elected()`; if a renewal fails or
+    the lease is lost it runs `on_demoted()` straight away, before the lease can
+    expire and another instance take over. Work that must happen exactly once
+    (approvals, deletions, broadcasts) runs on the leader only; any instance can
+    serve /start.
+    """
+
+    def __init__(self, db: Storage, owner: str, name="leader", ttl=30, on_elected=None, on_demoted=None):
+        self.db = db
+        self.owner = owner
+        self.name = name
+        self.ttl = ttl
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_leader = False
+        self.elections = 0
+
+    async def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        callback = self.on_elected if leader else self.on_demoted
+        if leader:
+            self.elections += 1
+        print(f"Instance {self.owner} {'is now the leader' if leader else 'is no longer the leader'}")
+        if callback:
+            try:
+                await callback()
+            except Exception as e:
+                print(f"Error handling leadership change: {e}")
+
+    async def run(self):
+        while True:
+            try:
+                acquired = await self.db.acquire_lease(self.name, self.owner, self.ttl)
+            except Exception as e:
+                print(f"Could not renew the {self.name} lease: {e}")
+                acquired = False
+            await self._set_leader(acquired)
+            await asyncio.sleep(self.ttl / 3)
+
+    async def resign(self):
+        """Give up the lease so another instance can take over without waiting for it to expire"""
+        await self._set_leader(False)
+        try:
+            await self.db.release_lease(self.name, self.owner)
+        except Exception as e:
+            print(f"Could not release the {self.name} lease: {e}")
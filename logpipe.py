@@ -0,0 +1,71 @@
+import time, asyncio
+from collections import deque, OrderedDict
+from pyrogram import Client, enums
+from pyrogram.errors import FloodWait
+
+
+class LogPipeline:
+    """Batches logger-channel events into periodic digest messages.
+
+    `log()` never waits on Telegram: events go into a bounded deque and are sent
+    every `interval` seconds as one message per digest, with a count per kind and
+    a sample of the entries. Events arriving while the queue is full are only
+    counted and reported as dropped in the next digest.
+    """
+
+    def __init__(self, client: Client, chat_id: int, interval=10, maxsize=1000, sample=10):
+        self.client = client
+        self.chat_id = chat_id
+        self.interval = interval
+        self.sample = sample
+        self._events = deque(maxlen=maxsize)
+        self.dropped = 0
+        self.sent = 0
+        self._last_flush = time.monotonic()
+
+    def log(self, kind: str, text: str):
+        """Queue an event such as ("starts", mention) for the next digest"""
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+            return
+        self._events.append((kind, text))
+
+    def _digest(self) -> str:
+        window = max(1, round(time.monotonic() - self._last_flush))
+        groups = OrderedDict()
+        while self._events:
+            kind, text = self._events.popleft()
+            groups.setdefault(kind, []).append(text)
+        lines = []
+        for kind, texts in groups.items():
+            lines.append(f"📈 **{len(texts)} {kind} in the last {window}s**")
+            lines += [f"• {text}" for text in texts[:self.sample]]
+            if len(texts) > self.sample:
+                lines.append(f"… and {len(texts) - self.sample} more")
+        if self.dropped:
+            lines.append(f"⚠️ {self.dropped} events dropped (queue full)")
+            self.dropped = 0
+        return "\n".join(lines)
+
+    async def flush(self):
+        if not self._events and not self.dropped:
+            self._last_flush = time.monotonic()
+            return
+        text = self._digest()
+        self._last_flush = time.monotonic()
+        try:
+            await self.client.send_message(self.chat_id, text, parse_mode=enums.ParseMode.MARKDOWN)
+            self.sent += 1
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+        except Exception:
+            print(f"WARNING: Could not log to LOGGER_ID {self.chat_id}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def close(self):
+        """Send whatever is still queued; call before the process exits"""
+        await self.flush()
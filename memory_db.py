@@ -0,0 +1,534 @@
+import os, time, heapq, bisect, asyncio
+from datetime import datetime, timezone
+from bson import ObjectId, json_util
+from storage import Storage
+from hll import HyperLogLog
+
+
+def _utc(value):
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _apply(doc, op, fields):
+    """Apply an "inc", "max" or "set" of dotted `fields` to `doc`, like the MongoDB operators"""
+    for path, value in fields.items():
+        *parents, name = path.split(".")
+        target = doc
+        for part in parents:
+            target = target.setdefault(part, {})
+        if op == "inc":
+            target[name] = target.get(name, 0) + value
+        elif op == "max":
+            if name not in target or value > target[name]:
+                target[name] = value
+        else:
+            target[name] = value
+    return doc
+
+
+def _export_order(key):
+    """Sort key putting numbers before strings, as MongoDB and SQLite do (channels mix chat ids with "default")"""
+    return isinstance(key, str), key
+
+
+class MemoryDatabase(Storage):
+    """In-process backend: every collection is a dict, so lookups cost no I/O at all.
+
+    With a `path`, every change is appended to that file as one JSON line
+    (`["put", table, key, doc]` or `["del", table, key]`) and the file is replayed
+    on start. Counters and other small changes to a record are journaled as just
+    the change, `["inc" | "max" | "set", table, key, {dotted field: value}]`. Appends are buffered and written every `flush_interval` seconds or
+    `flush_ops` changes; the file is compacted to one line per record on start
+    and on close. Only suitable for a single bot process.
+    """
+
+    TABLES = ("users", "channels", "links", "links_archive", "stats", "analytics", "sketches", "broadcasts",
+              "join_requests", "deletions", "meta")
+
+    def __init__(self, path=None, link_cache_size=10000, link_cache_ttl=600, flush_interval=0.5, flush_ops=500):
+        super().__init__(link_cache_size=link_cache_size, link_cache_ttl=link_cache_ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_ops = flush_ops
+        self.tables = {name: {} for name in self.TABLES}
+        self._user_ids = []  # sorted, for keyset pagination
+        self._links_by_msg = {}  # logger_msg_id -> link _id
+        self._archived_by_msg = {}  # logger_msg_id -> archived link _id
+        self._expiry = []  # heap of (expire_at timestamp, link _id); entries may be stale
+        self._journal = []
+        self._leases = {}  # name -> (owner, expires_at); never journaled
+        self._task = None
+        if path:
+            self._replay()
+            self._compact()
+
+    # Journal
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json_util.loads(line)
+                except ValueError:
+                    break  # torn final line after a crash
+                if entry[0] == "put":
+                    self.tables[entry[1]][entry[2]] = entry[3]
+                elif entry[0] == "del":
+                    self.tables[entry[1]].pop(entry[2], None)
+                elif entry[2] in self.tables[entry[1]]:
+                    _apply(self.tables[entry[1]][entry[2]], entry[0], entry[3])
+        self._user_ids = sorted(self.tables["users"])
+        self._links_by_msg = {doc["logger_msg_id"]: _id for _id, doc in self.tables["links"].items()
+                              if doc.get("logger_msg_id")}
+        self._archived_by_msg = {doc["logger_msg_id"]: _id for _id, doc in self.tables["links_archive"].items()
+                                 if doc.get("logger_msg_id")}
+        for doc in self.tables["links"].values():
+            self._track_expiry(doc)
+        print(f"Loaded {sum(len(t) for t in self.tables.values())} records from {self.path}")
+
+    def _compact(self):
+        now = datetime.now(timezone.utc)
+        for name in ("analytics", "sketches"):
+            for key, doc in list(self.tables[name].items()):
+                if doc.get("expire_at") and doc["expire_at"].replace(tzinfo=timezone.utc) < now:
+                    del self.tables[name][key]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for name, table in self.tables.items():
+                for key, doc in table.items():
+                    f.write(json_util.dumps(["put", name, key, doc]) + "\n")
+        os.replace(tmp, self.path)
+        self._journal = []
+
+    def _log(self, *entry):
+        if not self.path:
+            return
+        self._journal.append(json_util.dumps(entry))
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if len(self._journal) >= self.flush_ops:
+            self._write_journal()
+
+    def _put(self, table, key, doc):
+        self.tables[table][key] = doc
+        self._log("put", table, key, doc)
+
+    def _update(self, table, key, op, fields):
+        """Apply an "inc", "max" or "set" to an existing record and journal only that change"""
+        _apply(self.tables[table][key], op, fields)
+        self._log(op, table, key, fields)
+
+    def _delete(self, table, key):
+        if self.tables[table].pop(key, None) is not None:
+            self._log("del", table, key)
+            return True
+        return False
+
+    def _write_journal(self):
+        if not self._journal:
+            return
+        lines, self._journal = self._journal, []
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self._write_journal()
+            except Exception as e:
+                print(f"Error writing {self.path}: {e}")
+
+    def pending_writes(self) -> int:
+        return len(self._journal)
+
+    async def flush(self):
+        if self.path:
+            self._write_journal()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.path:
+            self._write_journal()
+            self._compact()
+
+    # Users
+
+    async def present_user(self, user_id: int):
+        return user_id in self.tables["users"]
+
+    async def add_user(self, user_id: int, username=None, first_name=None):
+        if user_id in self.tables["users"]:
+            return False
+        user_data = {"_id": user_id, "created_at": datetime.now(), "last_seen": datetime.now()}
+        if username:
+            user_data["username"] = username
+        if first_name:
+            user_data["first_name"] = first_name
+        self._put("users", user_id, user_data)
+        bisect.insort(self._user_ids, user_id)
+        await self.update_stat("total_users", 1)
+        await self.record_rollup("new_users")
+        return True
+
+    async def update_user_last_seen(self, user_id):
+        if user_id in self.tables["users"]:
+            self._update("users", user_id, "set", {"last_seen": datetime.now()})
+
+    async def delete_user(self, user_id: int):
+        if not self._delete("users", user_id):
+            return False
+        i = bisect.bisect_left(self._user_ids, user_id)
+        del self._user_ids[i]
+        await self.update_stat("total_users", -1)
+        return True
+
+    def _in_segment(self, user_id, bounds):
+        seen_after, created_after = bounds
+        user = self.tables["users"][user_id]
+        return ((not seen_after or user.get("last_seen", datetime.min) >= seen_after)
+                and (not created_after or user.get("created_at", datetime.min) >= created_after))
+
+    async def get_user_ids_after(self, last_id=None, limit=500, segment=None):
+        start = 0 if last_id is None else bisect.bisect_right(self._user_ids, last_id)
+        if not segment:
+            return self._user_ids[start:start + limit]
+        bounds = self.segment_bounds(segment)
+        batch = []
+        for user_id in self._user_ids[start:]:
+            if self._in_segment(user_id, bounds):
+                batch.append(user_id)
+                if len(batch) == limit:
+                    break
+        return batch
+
+    async def count_users(self, segment=None):
+        if not segment:
+            return len(self._user_ids)
+        bounds = self.segment_bounds(segment)
+        return sum(1 for user_id in self._user_ids if self._in_segment(user_id, bounds))
+
+    # Channels
+
+    async def create_channel(self, channel_id, title, username):
+        channel_data = {
+            "channel_id": channel_id,
+            "title": title,
+            "username": username,
+            "created_at": datetime.now(),
+            "approve_delay": 180  # Default 3 minutes
+        }
+        self._put("channels", channel_id, channel_data)
+        self.approve_delays[channel_id] = channel_data["approve_delay"]
+        print(f"Created channel {channel_id} in database")
+        return channel_data
+
+    async def set_approve_delay(self, channel_id: int, delay: int):
+        channel = self.tables["channels"].get(channel_id) or {"channel_id": channel_id}
+        channel["approve_delay"] = delay
+        self._put("channels", channel_id, channel)
+        self.approve_delays[channel_id] = delay
+
+    async def load_channel_config(self):
+        self.approve_delays = {key: doc["approve_delay"] for key, doc in self.tables["channels"].items()
+                               if "approve_delay" in doc}
+        self.config_version = 0
+
+    # Join requests and deletions
+
+    async def add_join_request(self, chat_id: int, user_id: int, due_at: float):
+        self._put("join_requests", f"{chat_id}:{user_id}", {"chat_id": chat_id, "user_id": user_id, "due_at": due_at})
+
+    async def remove_join_request(self, chat_id: int, user_id: int):
+        self._delete("join_requests", f"{chat_id}:{user_id}")
+
+    async def remove_join_requests(self, chat_id: int, user_ids):
+        for user_id in user_ids:
+            self._delete("join_requests", f"{chat_id}:{user_id}")
+
+    async def get_stored_join_requests(self, chat_id: int, user_ids) -> set:
+        return {user_id for user_id in user_ids if f"{chat_id}:{user_id}" in self.tables["join_requests"]}
+
+    async def get_join_requests(self, due_before=None):
+        for request in list(self.tables["join_requests"].values()):
+            if due_before is None or request["due_at"] <= due_before:
+                yield request
+
+    async def add_deletion(self, doc_id, chat_id: int, message_ids: list, due_at: float):
+        self._put("deletions", doc_id, {"_id": doc_id, "chat_id": chat_id, "message_ids": message_ids, "due_at": due_at})
+
+    async def remove_deletions(self, doc_ids):
+        for doc_id in doc_ids:
+            self._delete("deletions", doc_id)
+
+    async def get_deletions(self, due_before=None):
+        for entry in list(self.tables["deletions"].values()):
+            if due_before is None or entry["due_at"] <= due_before:
+                yield entry
+
+    async def acquire_lease(self, name, owner, ttl) -> bool:
+        now = time.time()
+        holder, expires_at = self._leases.get(name, (owner, 0))
+        if holder != owner and expires_at >= now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+    async def release_lease(self, name, owner):
+        if self._leases.get(name, (None,))[0] == owner:
+            del self._leases[name]
+
+    # Links
+
+    def _track_expiry(self, doc):
+        if doc.get("expire_at"):
+            heapq.heappush(self._expiry, (_utc(doc["expire_at"]).timestamp(), doc["_id"]))
+
+    def _insert_link(self, doc):
+        self._put("links", doc["_id"], doc)
+        self._track_expiry(doc)
+        if doc.get("logger_msg_id"):
+            self._links_by_msg[doc["logger_msg_id"]] = doc["_id"]
+
+    async def save_link(self, link, owner_id, caption, logger_msg_id, delete_after=None, expire_at=None,
+                        max_access=None):
+        self.link_cache.pop(logger_msg_id)
+        link_id = self._links_by_msg.get(logger_msg_id)
+        if link_id is None:
+            link_id = ObjectId()
+            self._insert_link({
+                "_id": link_id, "link": link, "caption": caption, "delete_after": delete_after,
+                "expire_at": expire_at, "max_access": max_access,
+                "owner_id": owner_id, "created_at": datetime.now(), "access_count": 0,
+                "logger_msg_id": logger_msg_id
+            })
+            await self.update_stat("total_links", 1)
+            return link_id
+        doc = self.tables["links"][link_id]
+        doc.update(link=link, caption=caption, delete_after=delete_after, expire_at=expire_at, max_access=max_access)
+        self._track_expiry(doc)
+        self._put("links", link_id, doc)
+        self.link_cache.pop(link_id)
+        return link_id
+
+    async def backfill_links(self, entries):
+        added = 0
+        for entry in entries:
+            if entry["logger_msg_id"] in self._links_by_msg:
+                continue
+            self._insert_link({"_id": ObjectId(), **entry, "owner_id": None, "access_count": 0})
+            added += 1
+        return added
+
+    async def create_link(self, link, owner_id, caption="Content Unlocked!"):
+        link_id = ObjectId()
+        self._insert_link({
+            "_id": link_id, "link": link, "caption": caption, "owner_id": owner_id,
+            "created_at": datetime.now(), "access_count": 0, "logger_msg_id": None
+        })
+        await self.update_stat("total_links", 1)
+        return link_id
+
+    async def create_links(self, entries, owner_id):
+        ids = []
+        for entry in entries:
+            ids.append(ObjectId())
+            self._insert_link({
+                "_id": ids[-1], "link": entry["link"], "caption": entry["caption"],
+                "delete_after": entry.get("delete_after"), "expire_at": entry.get("expire_at"),
+                "max_access": entry.get("max_access"), "owner_id": owner_id,
+                "created_at": datetime.now(), "access_count": 0, "logger_msg_id": None
+            })
+        if ids:
+            await self.update_stat("total_links", len(ids))
+        return ids
+
+    async def set_logger_msg_id(self, link_id, logger_msg_id):
+        doc = self.tables["links"].get(link_id)
+        if doc is not None:
+            doc["logger_msg_id"] = logger_msg_id
+            self._insert_link(doc)
+        self.link_cache.pop(logger_msg_id)
+
+    async def increment_link_access(self, link_id, limit=None) -> bool:
+        doc = self.tables["links"].get(link_id)
+        if doc is not None:
+            if limit is not None and doc.get("access_count", 0) >= limit:
+                return False
+            doc["access_count"] = doc.get("access_count", 0) + 1
+            if limit is not None and doc["access_count"] >= limit:
+                if not self.link_expired(doc):
+                    doc["expire_at"] = datetime.now(timezone.utc)
+                    self._track_expiry(doc)
+                self.link_cache.pop(link_id)
+                self.link_cache.pop(doc.get("logger_msg_id"))
+            self._log("put", "links", link_id, doc)
+        elif limit is not None:
+            return False
+        await self.update_stat("total_accesses", 1)
+        await self.record_rollup("opens", "links", link_id)
+        return True
+
+    async def get_link(self, link_id):
+        return self.tables["links"].get(link_id)
+
+    async def get_link_by_msg_id(self, logger_msg_id):
+        link_id = self._links_by_msg.get(logger_msg_id)
+        return self.tables["links"].get(link_id) if link_id is not None else None
+
+    async def get_links(self, link_ids):
+        links = self.tables["links"]
+        return [links[link_id] for link_id in link_ids if link_id in links]
+
+    async def archive_expired_links(self, batch_size=500) -> int:
+        now = datetime.now(timezone.utc)
+        expired = {}
+        while self._expiry and self._expiry[0][0] <= now.timestamp() and len(expired) < batch_size:
+            _, link_id = heapq.heappop(self._expiry)
+            doc = self.tables["links"].get(link_id)
+            # Skip entries for links already archived or whose expiry changed since
+            if doc is not None and self.link_expired(doc):
+                expired[link_id] = doc
+        for doc in expired.values():
+            key = self.visitor_keys(doc["_id"])[0]
+            sketch = self.tables["sketches"].get(key)
+            doc.update(unique_visitors=HyperLogLog(sketch["r"] if sketch else None).count(), archived_at=now)
+            self._put("links_archive", doc["_id"], doc)
+            self._delete("links", doc["_id"])
+            self._delete("sketches", key)
+            if doc.get("logger_msg_id"):
+                self._links_by_msg.pop(doc["logger_msg_id"], None)
+                self._archived_by_msg[doc["logger_msg_id"]] = doc["_id"]
+            self.link_cache.pop(doc["_id"])
+            self.link_cache.pop(doc.get("logger_msg_id"))
+        if expired:
+            await self.update_stat("expired_links", len(expired))
+        return len(expired)
+
+    async def get_archived_link(self, link_id):
+        return self.tables["links_archive"].get(link_id)
+
+    async def get_archived_link_by_msg_id(self, logger_msg_id):
+        link_id = self._archived_by_msg.get(logger_msg_id)
+        return self.tables["links_archive"].get(link_id) if link_id is not None else None
+
+    # Stats, analytics and checkpoints
+
+    async def update_stat(self, stat_type, increment=1):
+        self._put("stats", stat_type, self.tables["stats"].get(stat_type, 0) + increment)
+
+    async def get_stat(self, stat_type):
+        return self.tables["stats"].get(stat_type, 0)
+
+    async def get_all_stats(self):
+        return dict(self.tables["stats"])
+
+    async def record_rollup(self, counter, group=None, key=None, amount=1):
+        fields = {counter: amount}
+        if group is not None:
+            fields[f"{group}.{key}"] = amount
+        for bucket, doc in self.rollup_buckets():
+            if bucket in self.tables["analytics"]:
+                self._update("analytics", bucket, "inc", fields)
+            else:
+                self._put("analytics", bucket, _apply({"_id": bucket, **doc}, "inc", fields))
+
+    async def get_rollups(self, prefix, count):
+        analytics = self.tables["analytics"]
+        return [analytics.get(_id, {"_id": _id}) for _id in self.rollup_ids(prefix, count)]
+
+    async def update_sketch(self, key, index, rank, expire_at=None):
+        doc = self.tables["sketches"].get(key)
+        if doc is None:
+            self._put("sketches", key, {"r": {index: rank}, "expire_at": expire_at})
+        # Most visits don't raise a register, so most visits journal nothing
+        elif rank > doc["r"].get(index, 0):
+            self._update("sketches", key, "max", {f"r.{index}": rank})
+
+    async def get_sketches(self, keys):
+        sketches = self.tables["sketches"]
+        return {key: sketches[key]["r"] for key in keys if key in sketches}
+
+    async def get_checkpoint(self, name):
+        return self.tables["meta"].get(f"checkpoint:{name}")
+
+    async def set_checkpoint(self, name, value):
+        self._put("meta", f"checkpoint:{name}", value)
+
+    # Export / import
+
+    async def get_documents_after(self, collection, last_key=None, limit=1000):
+        if collection == "users":
+            return [self.tables["users"][user_id] for user_id in await self.get_user_ids_after(last_key, limit)]
+        table = self.tables[collection]
+        after = _export_order(last_key) if last_key is not None else None
+        keys = heapq.nsmallest(limit, (key for key in table if after is None or _export_order(key) > after),
+                               key=_export_order)
+        if collection == "channels":
+            return [{**table[key], "channel_id": key} for key in keys]
+        if collection == "stats":
+            return [{"type": key, "count": table[key]} for key in keys]
+        return [table[key] for key in keys]
+
+    async def import_documents(self, collection, docs):
+        for doc in docs:
+            if collection == "users":
+                if doc["_id"] not in self.tables["users"]:
+                    bisect.insort(self._user_ids, doc["_id"])  # appends when keys arrive in order
+                self._put("users", doc["_id"], doc)
+            elif collection == "links":
+                old = self.tables["links"].get(doc["_id"])
+                if old and old.get("logger_msg_id"):
+                    self._links_by_msg.pop(old["logger_msg_id"], None)
+                self._insert_link(doc)
+                self.link_cache.pop(doc["_id"])
+                self.link_cache.pop(doc.get("logger_msg_id"))
+            elif collection == "channels":
+                self._put("channels", doc["channel_id"], doc)
+                if "approve_delay" in doc:
+                    self.approve_delays[doc["channel_id"]] = doc["approve_delay"]
+            else:
+                self._put("stats", doc["type"], doc["count"])
+
+    # Broadcasts
+
+    async def start_broadcast(self, from_chat_id, message_id, status_chat_id, status_message_id, segment=None):
+        for doc in self.tables["broadcasts"].values():
+            if doc["status"] == "running":
+                doc["status"] = "abandoned"
+                self._log("put", "broadcasts", doc["_id"], doc)
+        state = {
+            "_id": ObjectId(),
+            "status": "running",
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "last_user_id": None,
+            "segment": segment,
+            "audience": await self.count_users(segment),
+            "counters": {"total": 0, "successful": 0, "blocked": 0, "deleted": 0, "unsuccessful": 0},
+            "created_at": datetime.now()
+        }
+        self._put("broadcasts", state["_id"], dict(state))
+        return state
+
+    async def save_broadcast(self, state):
+        doc = self.tables["broadcasts"].get(state["_id"])
+        if doc is not None:
+            doc.update(last_user_id=state["last_user_id"], counters=dict(state["counters"]), updated_at=datetime.now())
+            self._log("put", "broadcasts", doc["_id"], doc)
+
+    async def get_active_broadcast(self):
+        running = [doc for doc in self.tables["broadcasts"].values() if doc["status"] == "running"]
+        return dict(max(running, key=lambda doc: doc["created_at"])) if running else None
+
+    async def finish_broadcast(self, broadcast_id):
+        doc = self.tables["broadcasts"].get(broadcast_id)
+        if doc is not None:
+            doc.update(status="done", finished_at=datetime.now())
+            self._log("put", "broadcasts", broadcast_id, doc)
@@ -0,0 +1,174 @@
+import time, functools
+from pymongo import monitoring
+from pyrogram import Client
+from pyrogram.errors import FloodWait, RPCError
+import tracing
+
+# Minimal Prometheus text-format metrics, so the bot needs no extra dependency
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from `fn` at scrape time.
+
+    With `labels`, `fn` returns a dict of label value (or tuple of values) -> value.
+    """
+
+    def __init__(self, name, help_text, fn, labels=()):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if not self.labels:
+            return lines + [f"{self.name} {value}"]
+        for key, v in value.items():
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.labels, key)} {v}")
+        return lines
+
+
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, series in self.series.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Time spent in each update handler", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised", ["handler"])
+TELEGRAM_CALLS = Counter("bot_telegram_calls_total", "Telegram API calls", ["method"])
+TELEGRAM_ERRORS = Counter("bot_telegram_errors_total", "Telegram API calls that failed", ["method", "error"])
+FLOOD_WAITS = Counter("bot_flood_waits_total", "FloodWait errors returned by Telegram", ["method"])
+MONGO_LATENCY = Histogram("bot_mongo_command_seconds", "MongoDB command round-trip time", ["command"])
+MONGO_ERRORS = Counter("bot_mongo_errors_total", "MongoDB commands that failed", ["command"])
+BROADCAST_SENT = Counter("bot_broadcast_messages_total", "Broadcast deliveries by result", ["result"])
+DISPATCH_WAIT = Histogram("bot_dispatch_wait_seconds", "Time updates spend queued before a handler runs", ["class"])
+DISPATCH_SHED = Counter("bot_dispatch_shed_total", "Updates dropped because their queue was full", ["class"])
+WRITE_BEHIND_FAILED = Counter("bot_write_behind_failed_total", "Buffered writes whose flush failed, by outcome",
+                              ["collection", "result"])
+API_LINKS = Counter("bot_api_links_total", "Links created or read through the HTTP API", ["endpoint"])
+
+
+def timed(handler):
+    """Record the latency of an async handler under `handler` and trace it for the slow-log"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            trace = tracing.begin(handler)
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=handler)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                HANDLER_LATENCY.observe(elapsed, handler=handler)
+                if trace:
+                    tracing.end(trace, elapsed)
+        return wrapper
+    return decorator
+
+
+class InstrumentedClient(Client):
+    """pyrogram Client that counts every API call and error by method and traces it as a `tg.<method>` span"""
+
+    async def invoke(self, query, *args, **kwargs):
+        method = type(query).__name__
+        TELEGRAM_CALLS.inc(method=method)
+        try:
+            with tracing.span(f"tg.{method}"):
+                return await super().invoke(query, *args, **kwargs)
+        except FloodWait:
+            FLOOD_WAITS.inc(method=method)
+            TELEGRAM_ERRORS.inc(method=method, error="FLOOD_WAIT")
+            raise
+        except RPCError as e:
+            TELEGRAM_ERRORS.inc(method=method, error=e.ID or type(e).__name__)
+            raise
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo listener feeding MONGO_LATENCY"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_ERRORS.inc(command=event.command_name)
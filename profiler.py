@@ -0,0 +1,55 @@
+import os, sys, asyncio, threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's Python stack from a helper thread.
+
+    Nothing is hooked into the running code, so the bot pays only for the
+    sampling thread, and only while a profile runs. The result is in the
+    collapsed-stack format ("outer;inner;leaf count" per line) that
+    flamegraph.pl, speedscope and inferno read directly.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.running = False
+
+    async def run(self, seconds: float) -> tuple:
+        """Profile the calling loop's thread for `seconds`; returns (collapsed stacks, sample count)"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        thread_id = threading.get_ident()
+        stop = threading.Event()
+        counts = Counter()
+
+        def sample():
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                counts[";".join(reversed(stack))] += 1
+
+        sampler = threading.Thread(target=sample, name="profiler", daemon=True)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+        return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n", sum(counts.values())
+
+    @staticmethod
+    def top_functions(collapsed: str, limit=10):
+        """(leaf function, samples) pairs with the most samples, i.e. where the loop spends its time"""
+        leaves = Counter()
+        for line in collapsed.splitlines():
+            stack, _, count = line.rpartition(" ")
+            if stack:
+                leaves[stack.rsplit(";", 1)[-1]] += int(count)
+        return leaves.most_common(limit)
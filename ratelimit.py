@@ -0,0 +1,61 @@
+import time
+from cache import TTLCache
+
+OK = "ok"
+DUPLICATE = "duplicate"
+THROTTLED = "throttled"
+DROPPED = "dropped"
+
+
+class StartLimiter:
+    """Per-user token bucket and repeat-tap dedup for /start.
+
+    Every /start takes a token from the user's bucket, which holds `burst`
+    tokens and refills at `rate` tokens per second. A user whose bucket is
+    empty gets one "slow down" notice and is then ignored until it refills.
+    Tapping the same link again while the previous answer is still in the chat
+    (at most `dedup_window` seconds) is ignored without taking a token.
+
+    Both maps are TTL caches: an idle bucket is dropped once it would be full
+    again, so memory tracks recently active users only.
+    """
+
+    def __init__(self, rate=0.2, burst=5, dedup_window=30, maxsize=100000):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        # user_id -> [tokens, updated_at, notified]
+        self.buckets = TTLCache(maxsize=maxsize, ttl=burst / rate if rate else 3600)
+        # (user_id, token) -> time until which a repeat is a duplicate
+        self.recent = TTLCache(maxsize=maxsize, ttl=dedup_window)
+        self.duplicates = 0
+        self.throttled = 0
+
+    def check(self, user_id, token=None) -> str:
+        """OK to answer, DUPLICATE/DROPPED to ignore, THROTTLED to send the slow-down notice"""
+        now = time.monotonic()
+        until = self.recent.get((user_id, token))
+        if until is not None and until > now:
+            self.duplicates += 1
+            return DUPLICATE
+        bucket = self.buckets.get(user_id) or [self.burst, now, False]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            self.throttled += 1
+            result = DROPPED if bucket[2] else THROTTLED
+            bucket[2] = True
+        else:
+            bucket[0] -= 1
+            bucket[2] = False
+            result = OK
+        self.buckets.set(user_id, bucket)
+        return result
+
+    def answered(self, user_id, token=None, visible_for=None):
+        """Treat repeats of `token` as duplicates while the answer (shown for `visible_for` s) is still up"""
+        window = min(self.dedup_window, visible_for) if visible_for else self.dedup_window
+        self.recent.set((user_id, token), time.monotonic() + window)
+
+    def stats(self) -> dict:
+        return {"users": len(self.buckets), "duplicates": self.duplicates, "throttled": self.throttled}
@@ -0,0 +1,333 @@
+import time, heapq, asyncio
+from collections import Counter, defaultdict, deque
+from bson import ObjectId
+from pyrogram import Client
+from pyrogram.errors import ChannelInvalid, PeerIdInvalid, UserAlreadyParticipant, FloodWait
+from storage import Storage
+
+
+class ApprovalScheduler:
+    """Approves join requests from a single timer loop once their delay has passed.
+
+    Due times are persisted in the `join_requests` collection so a restart picks
+    them up again. In memory a heap orders them by due time and `pending` maps
+    chat -> user -> due_at, so cancelling is a dict delete; stale heap entries are
+    skipped when they are popped.
+
+    Requests coming due within `bulk_window` seconds of each other in the same chat
+    are approved as one batch, each user on its own, `concurrency` at a time.
+    FloodWait is waited out and retried, so a storm of joins is delayed rather
+    than dropped.
+
+    With several bot instances only the leader runs the loop. The others just
+    persist requests, and the leader picks them up by polling every
+    `poll_interval` seconds for requests coming due.
+    """
+
+    RATE_WINDOW = 60  # seconds used for the approvals-per-second figure
+
+    def __init__(self, client: Client, db: Storage, bulk_window=1.0, concurrency=5, poll_interval=None):
+        self.client = client
+        self.db = db
+        self.bulk_window = bulk_window
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.active = False
+        self.pending = defaultdict(dict)
+        self.in_flight = defaultdict(int)
+        self.approved = defaultdict(int)
+        self.failed = defaultdict(int)
+        self.skipped = defaultdict(int)  # requests that were gone (already a member, chat or user invalid)
+        self.flood_waits = 0
+        self._recent = defaultdict(deque)  # chat -> (timestamp, count) of recent approvals
+        self._chat_locks = defaultdict(asyncio.Lock)
+        self._claimed = set()  # (chat_id, user_id) popped from the heap and being approved
+        self._batches = set()  # running _approve_batch tasks
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._poller = None
+
+    def _push(self, chat_id: int, user_id: int, due_at: float):
+        self.pending[chat_id][user_id] = due_at
+        heapq.heappush(self._heap, (due_at, chat_id, user_id))
+        if self._heap[0][0] == due_at:
+            self._wakeup.set()
+
+    def _pop_pending(self, chat_id: int, user_id: int):
+        due_at = self.pending.get(chat_id, {}).pop(user_id, None)
+        if chat_id in self.pending and not self.pending[chat_id]:
+            del self.pending[chat_id]
+        return due_at
+
+    async def schedule(self, chat_id: int, user_id: int, delay: int):
+        """Approve `user_id` in `chat_id` after `delay` seconds"""
+        due_at = time.time() + delay
+        await self.db.add_join_request(chat_id, user_id, due_at)
+        if self.active:
+            self._push(chat_id, user_id, due_at)
+
+    async def cancel(self, chat_id: int, user_id: int) -> bool:
+        """Forget a pending request (e.g. the user withdrew it)"""
+        due_at = self._pop_pending(chat_id, user_id)
+        # Always delete the stored request; it may belong to the leader instance
+        await self.db.remove_join_request(chat_id, user_id)
+        return due_at is not None
+
+    def __len__(self):
+        return sum(len(users) for users in self.pending.values()) + sum(self.in_flight.values())
+
+    async def load(self):
+        """Reload stored requests"""
+        async for request in self.db.get_join_requests():
+            self._push(request["chat_id"], request["user_id"], request["due_at"])
+        print(f"Loaded {len(self)} pending join requests")
+
+    async def _record(self, chat_id: int, approved: int, failed: int = 0, skipped: int = 0):
+        self.approved[chat_id] += approved
+        self.failed[chat_id] += failed
+        self.skipped[chat_id] += skipped
+        if approved:
+            self._recent[chat_id].append((time.time(), approved))
+            await self.db.record_rollup("approvals", "channels", chat_id, approved)
+
+    def stats(self) -> dict:
+        """Per-channel backlog, totals and approvals/second over the last minute"""
+        cutoff = time.time() - self.RATE_WINDOW
+        result = {}
+        for chat_id in set(self.pending) | set(self.in_flight) | set(self.approved) | set(self.failed) | set(self.skipped):
+            recent = self._recent[chat_id]
+            while recent and recent[0][0] < cutoff:
+                recent.popleft()
+            result[chat_id] = {
+                "backlog": len(self.pending.get(chat_id, {})) + self.in_flight.get(chat_id, 0),
+                "approved": self.approved.get(chat_id, 0),
+                "failed": self.failed.get(chat_id, 0),
+                "skipped": self.skipped.get(chat_id, 0),
+                "rate": sum(n for _, n in recent) / self.RATE_WINDOW
+            }
+        return result
+
+    async def _call(self, method, *args):
+        """Call an approve method, waiting out FloodWait until it goes through"""
+        while True:
+            try:
+                return await method(*args)
+            except FloodWait as e:
+                self.flood_waits += 1
+                await asyncio.sleep(e.value)
+
+    async def _approve(self, chat_id: int, user_id: int, semaphore: asyncio.Semaphore) -> str:
+        """Approve one request: "approved", "failed", or "skipped" when there is nothing left to approve"""
+        async with semaphore:
+            try:
+                await self._call(self.client.approve_chat_join_request, chat_id, user_id)
+                return "approved"
+            except (ChannelInvalid, PeerIdInvalid, UserAlreadyParticipant):
+                return "skipped"
+            except Exception as e:
+                print(f"Error approving join request for user {user_id} in chat {chat_id}: {e}")
+                return "failed"
+
+    async def _approve_batch(self, chat_id: int, user_ids: list):
+        cancelled = False
+        try:
+            # Another instance's cancel() only deletes the stored request; skip those withdrawn since
+            stored = await self.db.get_stored_join_requests(chat_id, user_ids)
+            async with self._chat_locks[chat_id]:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                results = await asyncio.gather(*(self._approve(chat_id, u, semaphore)
+                                                 for u in user_ids if u in stored))
+                outcomes = Counter(results)
+                ok = outcomes["approved"]
+                await self._record(chat_id, ok, outcomes["failed"], outcomes["skipped"])
+                print(f"Approved {ok}/{len(user_ids)} join requests in chat {chat_id}")
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self.in_flight[chat_id] -= len(user_ids)
+            if not self.in_flight[chat_id]:
+                del self.in_flight[chat_id]
+            # A batch cancelled by stop() leaves its requests stored for the next leader
+            if not cancelled:
+                await self.db.remove_join_requests(chat_id, user_ids)
+            self._claimed.difference_update((chat_id, u) for u in user_ids)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            horizon = time.time() + self.bulk_window
+            due = defaultdict(list)
+            while self._heap and self._heap[0][0] <= horizon:
+                due_at, chat_id, user_id = heapq.heappop(self._heap)
+                if self.pending.get(chat_id, {}).get(user_id) != due_at:
+                    continue  # cancelled or rescheduled
+                self._pop_pending(chat_id, user_id)
+                self._claimed.add((chat_id, user_id))
+                due[chat_id].append(user_id)
+            for chat_id, user_ids in due.items():
+                self.in_flight[chat_id] += len(user_ids)
+                batch = asyncio.create_task(self._approve_batch(chat_id, user_ids))
+                self._batches.add(batch)
+                batch.add_done_callback(self._batches.discard)
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self):
+        """Pick up requests stored by other instances before they come due"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                async for request in self.db.get_join_requests(due_before=time.time() + 2 * self.poll_interval):
+                    chat_id, user_id = request["chat_id"], request["user_id"]
+                    if user_id not in self.pending.get(chat_id, {}) and (chat_id, user_id) not in self._claimed:
+                        self._push(chat_id, user_id, request["due_at"])
+            except Exception as e:
+                print(f"Error polling join requests: {e}")
+
+    async def start(self):
+        """Load outstanding requests and start the timer loop"""
+        self.active = True
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        if self.poll_interval and self._poller is None:
+            self._poller = asyncio.create_task(self.poll())
+
+    async def stop(self):
+        """Stop the timer loop and running batches and drop in-memory state, e.g. after losing leadership"""
+        self.active = False
+        for task in (self._task, self._poller, *self._batches):
+            if task:
+                task.cancel()
+        self._task = self._poller = None
+        self.pending.clear()
+        self._heap.clear()
+        self._claimed.clear()
+
+
+class DeletionScheduler:
+    """Deletes bot messages once their display window is over, from a single timer loop.
+
+    Each entry is `(chat_id, message_ids, due_at)` and is persisted in the
+    `deletions` collection so a restart still removes protected content. Entries
+    coming due within `window` seconds are grouped per chat into one
+    delete_messages call; FloodWait is waited out and retried. Like
+    ApprovalScheduler, only the leader instance runs the loop and polls for
+    entries stored by the others.
+    """
+
+    MAX_IDS = 100  # delete_messages limit per call
+
+    def __init__(self, client: Client, db: Storage, window=1.0, concurrency=10, poll_interval=None):
+        self.client = client
+        self.db = db
+        self.window = window
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.active = False
+        self.deleted = 0
+        self.flood_waits = 0
+        self._known = set()  # ids queued or being deleted
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._poller = None
+
+    def _push(self, doc_id, chat_id: int, message_ids: list, due_at: float):
+        if str(doc_id) in self._known:
+            return
+        self._known.add(str(doc_id))
+        heapq.heappush(self._heap, (due_at, str(doc_id), chat_id, message_ids))
+        if self._heap[0][0] == due_at:
+            self._wakeup.set()
+
+    async def schedule(self, chat_id: int, message_ids: list, delay: int):
+        """Delete `message_ids` in `chat_id` after `delay` seconds"""
+        doc_id = ObjectId()
+        due_at = time.time() + delay
+        await self.db.add_deletion(doc_id, chat_id, message_ids, due_at)
+        if self.active:
+            self._push(doc_id, chat_id, message_ids, due_at)
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def load(self):
+        async for entry in self.db.get_deletions():
+            self._push(entry["_id"], entry["chat_id"], entry["message_ids"], entry["due_at"])
+        print(f"Loaded {len(self)} pending message deletions")
+
+    async def _delete(self, chat_id: int, message_ids: list, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            for i in range(0, len(message_ids), self.MAX_IDS):
+                chunk = message_ids[i:i + self.MAX_IDS]
+                while True:
+                    try:
+                        await self.client.delete_messages(chat_id, chunk)
+                        self.deleted += len(chunk)
+                        break
+                    except FloodWait as e:
+                        self.flood_waits += 1
+                        await asyncio.sleep(e.value)
+                    except Exception:
+                        break  # already gone, chat blocked, etc.
+
+    async def _delete_due(self, due: dict, doc_ids: list):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.gather(*(self._delete(chat_id, ids, semaphore) for chat_id, ids in due.items()))
+        finally:
+            await self.db.remove_deletions([ObjectId(doc_id) for doc_id in doc_ids])
+            self._known.difference_update(doc_ids)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            horizon = time.time() + self.window
+            due = defaultdict(list)
+            doc_ids = []
+            while self._heap and self._heap[0][0] <= horizon:
+                _, doc_id, chat_id, message_ids = heapq.heappop(self._heap)
+                due[chat_id].extend(message_ids)
+                doc_ids.append(doc_id)
+            if due:
+                asyncio.create_task(self._delete_due(due, doc_ids))
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self):
+        """Pick up deletions stored by other instances before they come due"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                async for entry in self.db.get_deletions(due_before=time.time() + 2 * self.poll_interval):
+                    self._push(entry["_id"], entry["chat_id"], entry["message_ids"], entry["due_at"])
+            except Exception as e:
+                print(f"Error polling message deletions: {e}")
+
+    async def start(self):
+        """Load outstanding deletions and start the timer loop"""
+        self.active = True
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        if self.poll_interval and self._poller is None:
+            self._poller = asyncio.create_task(self.poll())
+
+    async def stop(self):
+        """Stop the timer loop and drop in-memory state, e.g. after losing leadership"""
+        self.active = False
+        for task in (self._task, self._poller):
+            if task:
+                task.cancel()
+        self._task = self._poller = None
+        self._heap.clear()
+        self._known.clear()
@@ -0,0 +1,595 @@
+import json, time, sqlite3, asyncio
+from datetime import datetime, timezone
+from bson import ObjectId, json_util
+from storage import Storage
+from hll import HyperLogLog
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, created_at REAL, last_seen REAL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id PRIMARY KEY, title TEXT, username TEXT, created_at REAL, approve_delay INTEGER
+);
+CREATE TABLE IF NOT EXISTS links (
+    id TEXT PRIMARY KEY, link TEXT, caption TEXT, owner_id INTEGER, logger_msg_id INTEGER,
+    delete_after INTEGER, access_count INTEGER NOT NULL DEFAULT 0, created_at REAL, expire_at REAL, max_access INTEGER
+);
+CREATE TABLE IF NOT EXISTS links_archive (id TEXT PRIMARY KEY, logger_msg_id INTEGER, archived_at REAL, doc TEXT);
+CREATE TABLE IF NOT EXISTS stats (type TEXT PRIMARY KEY, count INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS analytics (
+    bucket TEXT, field TEXT, key TEXT, value INTEGER NOT NULL DEFAULT 0, expire_at REAL,
+    PRIMARY KEY (bucket, field, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sketches (
+    key TEXT, idx TEXT, rank INTEGER NOT NULL, expire_at REAL, PRIMARY KEY (key, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS broadcasts (id TEXT PRIMARY KEY, status TEXT, created_at REAL, state TEXT);
+CREATE TABLE IF NOT EXISTS join_requests (
+    chat_id INTEGER, user_id INTEGER, due_at REAL, PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS deletions (id TEXT PRIMARY KEY, chat_id INTEGER, message_ids TEXT, due_at REAL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL);
+"""
+
+LINK_COLUMNS = ("id", "link", "caption", "owner_id", "logger_msg_id", "delete_after", "access_count", "created_at",
+                "expire_at", "max_access")
+
+# Columns added after the first release, added to existing files on open: (table, column, type)
+MIGRATIONS = [
+    ("links", "expire_at", "REAL"),
+    ("links", "max_access", "INTEGER"),
+]
+
+
+def _ts(value):
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+def _dt(value):
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+class SQLiteDatabase(Storage):
+    """Local SQLite backend for single-instance deployments.
+
+    The database runs in WAL mode with `synchronous=NORMAL`. Queries are plain
+    indexed lookups that take microseconds, so they run directly on the event
+    loop. Writes are grouped into one transaction that is committed every
+    `flush_interval` seconds or `flush_ops` statements, whichever comes first;
+    a crash loses at most that window, like the Mongo write-behind buffer.
+    """
+
+    # (index name, table, columns, unique) created by ensure_indexes
+    INDEXES = [
+        ("links_logger_msg_id", "links", "logger_msg_id", True),
+        ("broadcasts_status", "broadcasts", "status, created_at", False),
+        ("analytics_expire_at", "analytics", "expire_at", False),
+        ("sketches_expire_at", "sketches", "expire_at", False),
+        ("links_expire_at", "links", "expire_at", False),
+        ("links_archive_logger_msg_id", "links_archive", "logger_msg_id", False),
+        ("join_requests_due_at", "join_requests", "due_at", False),
+        ("deletions_due_at", "deletions", "due_at", False),
+        # Segmented broadcast pages filter on the segment column and page on id
+        ("users_last_seen", "users", "last_seen, id", False),
+        ("users_created_at", "users", "created_at, id", False),
+    ]
+
+    # (name, SQL, params) for the queries that run on every update
+    HOT_QUERIES = [
+        ("links by logger_msg_id", "SELECT * FROM links WHERE logger_msg_id = ?", (1,)),
+        ("channels by channel_id", "SELECT * FROM channels WHERE channel_id = ?", (1,)),
+        ("users by id", "SELECT id FROM users WHERE id = ?", (1,)),
+    ]
+
+    def __init__(self, path=":memory:", link_cache_size=10000, link_cache_ttl=600, flush_interval=0.5, flush_ops=500):
+        super().__init__(link_cache_size=link_cache_size, link_cache_ttl=link_cache_ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_ops = flush_ops
+        # Autocommit mode; transactions are opened explicitly by _write
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        for table, column, kind in MIGRATIONS:
+            if column not in {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        self._ops = 0
+        self._task = None
+
+    # Transactions
+
+    def _write(self, sql, params=()):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+            if self._task is None:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+        cursor = self.conn.execute(sql, params)
+        self._ops += 1
+        if self._ops >= self.flush_ops:
+            self._commit()
+        return cursor
+
+    def _commit(self):
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+        self._ops = 0
+
+    def _query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def _one(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchone()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self._commit()
+            except Exception as e:
+                print(f"Error committing to {self.path}: {e}")
+
+    def pending_writes(self) -> int:
+        return self._ops
+
+    async def flush(self):
+        self._commit()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._commit()
+        self.conn.close()
+
+    async def ping(self, timeout=2) -> bool:
+        try:
+            self._one("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    async def ensure_indexes(self):
+        """Create the indexes the hot queries rely on and verify none of them is a full table scan"""
+        for name, table, columns, unique in self.INDEXES:
+            try:
+                self.conn.execute(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+                )
+            except sqlite3.IntegrityError as e:
+                print(f"WARNING: duplicate values in {table}.{columns}, creating a non-unique index instead: {e}")
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+        for name, sql, params in self.HOT_QUERIES:
+            plan = " <- ".join(row["detail"] for row in self._query(f"EXPLAIN QUERY PLAN {sql}", params))
+            print(f"Query plan for {name}: {plan or 'unknown'}")
+            if "SCAN" in plan and "INDEX" not in plan:
+                raise RuntimeError(f"Hot query {name} runs as a full table scan; check its index")
+
+    # Users
+
+    async def present_user(self, user_id: int):
+        return self._one("SELECT 1 FROM users WHERE id = ?", (user_id,)) is not None
+
+    async def add_user(self, user_id: int, username=None, first_name=None):
+        now = time.time()
+        cursor = self._write(
+            "INSERT OR IGNORE INTO users (id, username, first_name, created_at, last_seen) VALUES (?, ?, ?, ?, ?)",
+            (user_id, username, first_name, now, now)
+        )
+        if not cursor.rowcount:
+            return False
+        await self.update_stat("total_users", 1)
+        await self.record_rollup("new_users")
+        return True
+
+    async def update_user_last_seen(self, user_id):
+        self._write("UPDATE users SET last_seen = ? WHERE id = ?", (time.time(), user_id))
+
+    async def delete_user(self, user_id: int):
+        if not self._write("DELETE FROM users WHERE id = ?", (user_id,)).rowcount:
+            return False
+        await self.update_stat("total_users", -1)
+        return True
+
+    def _segment_where(self, segment, last_id=None):
+        clauses, params = [], []
+        seen_after, created_after = self.segment_bounds(segment)
+        if last_id is not None:
+            clauses.append("id > ?")
+            params.append(last_id)
+        if seen_after:
+            clauses.append("last_seen >= ?")
+            params.append(_ts(seen_after))
+        if created_after:
+            clauses.append("created_at >= ?")
+            params.append(_ts(created_after))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    async def get_user_ids_after(self, last_id=None, limit=500, segment=None):
+        where, params = self._segment_where(segment, last_id)
+        return [row[0] for row in self._query(f"SELECT id FROM users{where} ORDER BY id LIMIT ?", (*params, limit))]
+
+    async def count_users(self, segment=None):
+        where, params = self._segment_where(segment)
+        return self._one(f"SELECT COUNT(*) FROM users{where}", params)[0]
+
+    # Channels
+
+    async def create_channel(self, channel_id, title, username):
+        try:
+            self._write(
+                "INSERT INTO channels (channel_id, title, username, created_at, approve_delay) VALUES (?, ?, ?, ?, ?)",
+                (channel_id, title, username, time.time(), 180)  # Default 3 minutes
+            )
+        except sqlite3.IntegrityError as e:
+            print(f"Error creating channel: {e}")
+            return None
+        self.approve_delays[channel_id] = 180
+        print(f"Created channel {channel_id} in database")
+        return channel_id
+
+    async def set_approve_delay(self, channel_id: int, delay: int):
+        self._write(
+            "INSERT INTO channels (channel_id, approve_delay) VALUES (?, ?) "
+            "ON CONFLICT (channel_id) DO UPDATE SET approve_delay = excluded.approve_delay",
+            (channel_id, delay)
+        )
+        self.approve_delays[channel_id] = delay
+
+    async def load_channel_config(self):
+        rows = self._query("SELECT channel_id, approve_delay FROM channels WHERE approve_delay IS NOT NULL")
+        self.approve_delays = {row[0]: row[1] for row in rows}
+        self.config_version = 0
+
+    # Join requests and deletions
+
+    async def add_join_request(self, chat_id: int, user_id: int, due_at: float):
+        self._write("INSERT OR REPLACE INTO join_requests (chat_id, user_id, due_at) VALUES (?, ?, ?)",
+                    (chat_id, user_id, due_at))
+
+    async def remove_join_request(self, chat_id: int, user_id: int):
+        self._write("DELETE FROM join_requests WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    async def remove_join_requests(self, chat_id: int, user_ids):
+        for user_id in user_ids:
+            self._write("DELETE FROM join_requests WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    async def get_stored_join_requests(self, chat_id: int, user_ids) -> set:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        rows = self._query(f"SELECT user_id FROM join_requests WHERE chat_id = ? AND user_id IN "
+                           f"({', '.join('?' * len(user_ids))})", (chat_id, *user_ids))
+        return {row["user_id"] for row in rows}
+
+    async def get_join_requests(self, due_before=None):
+        if due_before is None:
+            rows = self._query("SELECT chat_id, user_id, due_at FROM join_requests")
+        else:
+            rows = self._query("SELECT chat_id, user_id, due_at FROM join_requests WHERE due_at <= ?", (due_before,))
+        for row in rows:
+            yield dict(row)
+
+    async def add_deletion(self, doc_id, chat_id: int, message_ids: list, due_at: float):
+        self._write("INSERT OR REPLACE INTO deletions (id, chat_id, message_ids, due_at) VALUES (?, ?, ?, ?)",
+                    (str(doc_id), chat_id, json.dumps(message_ids), due_at))
+
+    async def remove_deletions(self, doc_ids):
+        for doc_id in doc_ids:
+            self._write("DELETE FROM deletions WHERE id = ?", (str(doc_id),))
+
+    async def get_deletions(self, due_before=None):
+        if due_before is None:
+            rows = self._query("SELECT id, chat_id, message_ids, due_at FROM deletions")
+        else:
+            rows = self._query("SELECT id, chat_id, message_ids, due_at FROM deletions WHERE due_at <= ?", (due_before,))
+        for row in rows:
+            yield {"_id": ObjectId(row["id"]), "chat_id": row["chat_id"],
+                   "message_ids": json.loads(row["message_ids"]), "due_at": row["due_at"]}
+
+    async def acquire_lease(self, name, owner, ttl) -> bool:
+        """Take or renew a lease; committed at once so other processes sharing the file see it"""
+        now = time.time()
+        acquired = self._write(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner, now + ttl, now)
+        ).rowcount > 0
+        self._commit()
+        return acquired
+
+    async def release_lease(self, name, owner):
+        self._write("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+        self._commit()
+
+    # Links
+
+    @staticmethod
+    def _link(row):
+        if row is None:
+            return None
+        doc = dict(row)
+        doc["_id"] = ObjectId(doc.pop("id"))
+        doc["created_at"] = _dt(doc["created_at"])
+        doc["expire_at"] = datetime.fromtimestamp(doc["expire_at"], timezone.utc) if doc.get("expire_at") else None
+        return doc
+
+    def _insert_link(self, doc, conflict="IGNORE"):
+        values = {**doc, "id": str(doc["_id"]), "created_at": _ts(doc.get("created_at")),
+                  "expire_at": _ts(doc.get("expire_at"))}
+        return self._write(
+            f"INSERT OR {conflict} INTO links ({', '.join(LINK_COLUMNS)}) VALUES ({', '.join('?' * len(LINK_COLUMNS))})",
+            tuple(values.get(column) for column in LINK_COLUMNS)
+        ).rowcount
+
+    async def save_link(self, link, owner_id, caption, logger_msg_id, delete_after=None, expire_at=None,
+                        max_access=None):
+        self.link_cache.pop(logger_msg_id)
+        row = self._one("SELECT id FROM links WHERE logger_msg_id = ?", (logger_msg_id,))
+        if row is None:
+            link_id = ObjectId()
+            self._insert_link({
+                "_id": link_id, "link": link, "caption": caption, "delete_after": delete_after,
+                "expire_at": expire_at, "max_access": max_access,
+                "owner_id": owner_id, "created_at": time.time(), "access_count": 0, "logger_msg_id": logger_msg_id
+            })
+            await self.update_stat("total_links", 1)
+            return link_id
+        self._write("UPDATE links SET link = ?, caption = ?, delete_after = ?, expire_at = ?, max_access = ? "
+                    "WHERE id = ?", (link, caption, delete_after, _ts(expire_at), max_access, row[0]))
+        link_id = ObjectId(row[0])
+        self.link_cache.pop(link_id)
+        return link_id
+
+    async def backfill_links(self, entries):
+        added = 0
+        for entry in entries:
+            if self._one("SELECT 1 FROM links WHERE logger_msg_id = ?", (entry["logger_msg_id"],)):
+                continue
+            added += self._insert_link({"_id": ObjectId(), **entry, "owner_id": None, "access_count": 0})
+        return added
+
+    async def create_link(self, link, owner_id, caption="Content Unlocked!"):
+        link_id = ObjectId()
+        self._insert_link({"_id": link_id, "link": link, "caption": caption, "owner_id": owner_id,
+                           "created_at": time.time(), "access_count": 0})
+        await self.update_stat("total_links", 1)
+        return link_id
+
+    async def create_links(self, entries, owner_id):
+        ids = []
+        now = time.time()
+        for entry in entries:
+            ids.append(ObjectId())
+            self._insert_link({"_id": ids[-1], "link": entry["link"], "caption": entry["caption"],
+                               "delete_after": entry.get("delete_after"), "expire_at": entry.get("expire_at"),
+                               "max_access": entry.get("max_access"), "owner_id": owner_id,
+                               "created_at": now, "access_count": 0})
+        if ids:
+            await self.update_stat("total_links", len(ids))
+        return ids
+
+    async def set_logger_msg_id(self, link_id, logger_msg_id):
+        self._write("UPDATE links SET logger_msg_id = ? WHERE id = ?", (logger_msg_id, str(link_id)))
+        self.link_cache.pop(logger_msg_id)
+
+    async def increment_link_access(self, link_id, limit=None) -> bool:
+        if limit is None:
+            self._write("UPDATE links SET access_count = access_count + 1 WHERE id = ?", (str(link_id),))
+        else:
+            cursor = self._write("UPDATE links SET access_count = access_count + 1 WHERE id = ? AND access_count < ?",
+                                 (str(link_id), limit))
+            if not cursor.rowcount:
+                return False
+            row = self._one("SELECT access_count, logger_msg_id FROM links WHERE id = ?", (str(link_id),))
+            if row["access_count"] >= limit:
+                now = time.time()
+                self._write("UPDATE links SET expire_at = MIN(COALESCE(expire_at, ?), ?) WHERE id = ?",
+                            (now, now, str(link_id)))
+                self.link_cache.pop(link_id)
+                self.link_cache.pop(row["logger_msg_id"])
+        await self.update_stat("total_accesses", 1)
+        await self.record_rollup("opens", "links", link_id)
+        return True
+
+    async def get_link(self, link_id):
+        return self._link(self._one("SELECT * FROM links WHERE id = ?", (str(link_id),)))
+
+    async def get_link_by_msg_id(self, logger_msg_id):
+        return self._link(self._one("SELECT * FROM links WHERE logger_msg_id = ?", (logger_msg_id,)))
+
+    async def get_links(self, link_ids):
+        ids = [str(link_id) for link_id in link_ids]
+        if not ids:
+            return []
+        rows = self._query(f"SELECT * FROM links WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        return [self._link(row) for row in rows]
+
+    async def archive_expired_links(self, batch_size=500) -> int:
+        now = time.time()
+        docs = [self._link(row) for row in
+                self._query("SELECT * FROM links WHERE expire_at <= ? LIMIT ?", (now, batch_size))]
+        if not docs:
+            return 0
+        keys = [self.visitor_keys(doc["_id"])[0] for doc in docs]
+        sketches = await self.get_sketches(keys)
+        archived_at = datetime.fromtimestamp(now, timezone.utc)
+        for doc, key in zip(docs, keys):
+            doc.update(unique_visitors=HyperLogLog(sketches.get(key)).count(), archived_at=archived_at)
+            self._write("INSERT OR REPLACE INTO links_archive (id, logger_msg_id, archived_at, doc) VALUES (?, ?, ?, ?)",
+                        (str(doc["_id"]), doc.get("logger_msg_id"), now, json_util.dumps(doc)))
+            self._write("DELETE FROM links WHERE id = ?", (str(doc["_id"]),))
+            self._write("DELETE FROM sketches WHERE key = ?", (key,))
+            self.link_cache.pop(doc["_id"])
+            self.link_cache.pop(doc.get("logger_msg_id"))
+        await self.update_stat("expired_links", len(docs))
+        self._commit()
+        return len(docs)
+
+    async def get_archived_link(self, link_id):
+        row = self._one("SELECT doc FROM links_archive WHERE id = ?", (str(link_id),))
+        return json_util.loads(row[0]) if row else None
+
+    async def get_archived_link_by_msg_id(self, logger_msg_id):
+        row = self._one("SELECT doc FROM links_archive WHERE logger_msg_id = ?", (logger_msg_id,))
+        return json_util.loads(row[0]) if row else None
+
+    # Stats, analytics and checkpoints
+
+    async def update_stat(self, stat_type, increment=1):
+        self._write("INSERT INTO stats (type, count) VALUES (?, ?) "
+                    "ON CONFLICT (type) DO UPDATE SET count = count + excluded.count", (stat_type, increment))
+
+    async def get_stat(self, stat_type):
+        row = self._one("SELECT count FROM stats WHERE type = ?", (stat_type,))
+        return row[0] if row else 0
+
+    async def get_all_stats(self):
+        return {row[0]: row[1] for row in self._query("SELECT type, count FROM stats")}
+
+    async def record_rollup(self, counter, group=None, key=None, amount=1):
+        """Rows are (bucket, field, key): ("m:…", counter, "") for totals, ("m:…", group, key) per key"""
+        rows = [(counter, "")]
+        if group is not None:
+            rows.append((group, str(key)))
+        for bucket, fields in self.rollup_buckets():
+            expire_at = _ts(fields.get("expire_at"))
+            for field, field_key in rows:
+                self._write(
+                    "INSERT INTO analytics (bucket, field, key, value, expire_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (bucket, field, key) DO UPDATE SET value = value + excluded.value",
+                    (bucket, field, field_key, amount, expire_at)
+                )
+
+    async def get_rollups(self, prefix, count):
+        self._write("DELETE FROM analytics WHERE expire_at < ?", (time.time(),))
+        ids = self.rollup_ids(prefix, count)
+        docs = {_id: {"_id": _id} for _id in ids}
+        rows = self._query(f"SELECT bucket, field, key, value FROM analytics WHERE bucket IN ({', '.join('?' * len(ids))})",
+                           ids)
+        for row in rows:
+            doc = docs[row["bucket"]]
+            if row["key"]:
+                doc.setdefault(row["field"], {})[row["key"]] = row["value"]
+            else:
+                doc[row["field"]] = row["value"]
+        return [docs[_id] for _id in ids]
+
+    async def update_sketch(self, key, index, rank, expire_at=None):
+        """One row per non-zero register of each HyperLogLog sketch"""
+        self._write("INSERT INTO sketches (key, idx, rank, expire_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key, idx) DO UPDATE SET rank = excluded.rank WHERE excluded.rank > rank",
+                    (key, index, rank, _ts(expire_at)))
+
+    async def get_sketches(self, keys):
+        keys = list(keys)
+        self._write("DELETE FROM sketches WHERE expire_at < ?", (time.time(),))
+        rows = self._query(f"SELECT key, idx, rank FROM sketches WHERE key IN ({', '.join('?' * len(keys))})", keys)
+        sketches = {}
+        for row in rows:
+            sketches.setdefault(row["key"], {})[row["idx"]] = row["rank"]
+        return sketches
+
+    async def get_checkpoint(self, name):
+        row = self._one("SELECT value FROM meta WHERE key = ?", (f"checkpoint:{name}",))
+        return json.loads(row[0]) if row else None
+
+    async def set_checkpoint(self, name, value):
+        self._write("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"checkpoint:{name}", json.dumps(value)))
+
+    # Export / import
+
+    async def get_documents_after(self, collection, last_key=None, limit=1000):
+        table, column = {"users": ("users", "id"), "links": ("links", "id"),
+                         "channels": ("channels", "channel_id"), "stats": ("stats", "type")}[collection]
+        where = f" WHERE {column} > ?" if last_key is not None else ""
+        params = (str(last_key) if collection == "links" else last_key,) if last_key is not None else ()
+        rows = self._query(f"SELECT * FROM {table}{where} ORDER BY {column} LIMIT ?", (*params, limit))
+        docs = []
+        for row in rows:
+            if collection == "links":
+                doc = self._link(row)
+                # Same shape as MongoDB links: no limit fields unless the link has limits
+                for field in ("expire_at", "max_access"):
+                    if doc[field] is None:
+                        del doc[field]
+            elif collection == "users":
+                doc = {"_id": row["id"], "created_at": _dt(row["created_at"]), "last_seen": _dt(row["last_seen"])}
+                doc.update((field, row[field]) for field in ("username", "first_name") if row[field])
+            elif collection == "channels":
+                # Channels created by set_approve_delay alone have no title or creation date
+                doc = {key: value for key, value in dict(row).items() if value is not None}
+                if "created_at" in doc:
+                    doc["created_at"] = _dt(doc["created_at"])
+            else:
+                doc = dict(row)
+            docs.append(doc)
+        return docs
+
+    async def import_documents(self, collection, docs):
+        for doc in docs:
+            if collection == "users":
+                self._write("INSERT OR REPLACE INTO users (id, username, first_name, created_at, last_seen) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (doc["_id"], doc.get("username"), doc.get("first_name"), _ts(doc.get("created_at")),
+                             _ts(doc.get("last_seen"))))
+            elif collection == "links":
+                self._insert_link(doc, "REPLACE")
+                self.link_cache.pop(doc["_id"])
+                self.link_cache.pop(doc.get("logger_msg_id"))
+            elif collection == "channels":
+                self._write("INSERT OR REPLACE INTO channels (channel_id, title, username, created_at, approve_delay) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (doc["channel_id"], doc.get("title"), doc.get("username"), _ts(doc.get("created_at")),
+                             doc.get("approve_delay")))
+                if doc.get("approve_delay") is not None:
+                    self.approve_delays[doc["channel_id"]] = doc["approve_delay"]
+            else:
+                self._write("INSERT OR REPLACE INTO stats (type, count) VALUES (?, ?)", (doc["type"], doc["count"]))
+
+    # Broadcasts
+
+    async def start_broadcast(self, from_chat_id, message_id, status_chat_id, status_message_id, segment=None):
+        for row in self._query("SELECT state FROM broadcasts WHERE status = 'running'"):
+            await self._save_state({**json_util.loads(row[0]), "status": "abandoned"})
+        state = {
+            "_id": ObjectId(),
+            "status": "running",
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "last_user_id": None,
+            "segment": segment,
+            "audience": await self.count_users(segment),
+            "counters": {"total": 0, "successful": 0, "blocked": 0, "deleted": 0, "unsuccessful": 0},
+            "created_at": datetime.now()
+        }
+        await self._save_state(state)
+        return state
+
+    async def _save_state(self, state):
+        self._write("INSERT OR REPLACE INTO broadcasts (id, status, created_at, state) VALUES (?, ?, ?, ?)",
+                    (str(state["_id"]), state["status"], _ts(state["created_at"]), json_util.dumps(state)))
+        # Broadcast checkpoints must survive a crash
+        self._commit()
+
+    async def save_broadcast(self, state):
+        row = self._one("SELECT state FROM broadcasts WHERE id = ?", (str(state["_id"]),))
+        if row:
+            await self._save_state({**json_util.loads(row[0]), "last_user_id": state["last_user_id"],
+                                    "counters": state["counters"], "updated_at": datetime.now()})
+
+    async def get_active_broadcast(self):
+        row = self._one("SELECT state FROM broadcasts WHERE status = 'running' ORDER BY created_at DESC LIMIT 1")
+        return json_util.loads(row[0]) if row else None
+
+    async def finish_broadcast(self, broadcast_id):
+        row = self._one("SELECT state FROM broadcasts WHERE id = ?", (str(broadcast_id),))
+        if row:
+            await self._save_state({**json_util.loads(row[0]), "status": "done", "finished_at": datetime.now()})
@@ -0,0 +1,378 @@
+from datetime import datetime, timedelta, timezone
+from cache import TTLCache
+from hll import HyperLogLog
+
+
+class Storage:
+    """The storage interface every handler, scheduler and tool goes through.
+
+    Backends (`database.Database` for MongoDB, `memory_db.MemoryDatabase` and
+    `sqlite_db.SQLiteDatabase`) implement the abstract methods below. The link
+    cache and the channel delay map live in process memory for every backend,
+    so those lookups never touch the store. Use `open_storage()` to pick a
+    backend from a URL.
+    """
+
+    # Rollup granularities: (prefix, strftime key, bucket length, retention or None to keep)
+    ROLLUPS = [
+        ("m", "%Y%m%d%H%M", timedelta(minutes=1), timedelta(days=2)),
+        ("h", "%Y%m%d%H", timedelta(hours=1), timedelta(days=90)),
+        ("d", "%Y%m%d", timedelta(days=1), None),
+    ]
+    # How long per-link daily unique-visitor sketches are kept (all-time and bot-wide ones are kept)
+    LINK_SKETCH_RETENTION = timedelta(days=35)
+    # Collections moved by export/import, and the key each is ordered and upserted by
+    EXPORT_KEYS = {"users": "_id", "links": "_id", "channels": "channel_id", "stats": "type"}
+
+    def __init__(self, link_cache_size=10000, link_cache_ttl=600):
+        # channel_id (or "default") -> approve_delay
+        self.approve_delays = {}
+        self.config_version = None
+        # logger_msg_id or link _id -> {"link", "caption", "_id"} for the /start hot path
+        self.link_cache = TTLCache(maxsize=link_cache_size, ttl=link_cache_ttl)
+        # sketch key -> registers this process has already written; the store holds at least these
+        self.sketch_floor = TTLCache(maxsize=link_cache_size, ttl=link_cache_ttl)
+
+    # Shared in-memory helpers
+
+    def cache_link(self, key, link, caption, link_id=None, delete_after=None, expire_at=None, max_access=None):
+        """Remember a resolved link so repeated /start calls skip Telegram and the store.
+
+        `key` is the logger_msg_id for v1 tokens and the link _id for v2 tokens.
+        """
+        entry = {"link": link, "caption": caption, "_id": link_id, "delete_after": delete_after,
+                 "expire_at": expire_at, "max_access": max_access}
+        self.link_cache.set(key, entry)
+        return entry
+
+    @staticmethod
+    def link_expired(entry) -> bool:
+        """True once a link (or cached entry) is past its expire_at; naive datetimes are UTC"""
+        expire_at = entry.get("expire_at")
+        if expire_at is None:
+            return False
+        if expire_at.tzinfo is None:
+            expire_at = expire_at.replace(tzinfo=timezone.utc)
+        return expire_at <= datetime.now(timezone.utc)
+
+    async def has_channel(self, channel_id) -> bool:
+        return channel_id in self.approve_delays
+
+    async def get_approve_delay(self, channel_id: int) -> int:
+        """Get approval delay for a channel, falling back to the "default" entry (no store read)"""
+        delay = self.approve_delays.get(channel_id)
+        if delay is None:
+            delay = self.approve_delays.get("default", 180)
+        return delay
+
+    def rollup_buckets(self):
+        """Yield (bucket id, fields) for the current minute/hour/day buckets"""
+        now = datetime.now(timezone.utc)
+        for prefix, fmt, length, retention in self.ROLLUPS:
+            bucket = now.strftime(fmt)
+            doc = {"gran": prefix, "ts": datetime.strptime(bucket, fmt).replace(tzinfo=timezone.utc)}
+            if retention:
+                doc["expire_at"] = doc["ts"] + length + retention
+            yield f"{prefix}:{bucket}", doc
+
+    def rollup_ids(self, prefix, count):
+        """Bucket ids of the last `count` buckets of one granularity, oldest first"""
+        fmt, length = next((f, l) for p, f, l, _ in self.ROLLUPS if p == prefix)
+        now = datetime.now(timezone.utc)
+        return [f"{prefix}:{(now - length * i).strftime(fmt)}" for i in range(count - 1, -1, -1)]
+
+    def visitor_keys(self, link_id=None, days=None):
+        """Sketch keys for one link (or the whole bot): all time, or one per day for the last `days` days"""
+        base = f"link:{link_id}" if link_id is not None else "all"
+        if days is None:
+            return [base]
+        now = datetime.now(timezone.utc)
+        return [f"{base}:{(now - timedelta(days=i)).strftime('%Y%m%d')}" for i in range(days)]
+
+    async def record_visitor(self, link_id, user_id):
+        """Add `user_id` to the unique-visitor sketches of `link_id` and of the bot, all-time and today.
+
+        Most visits don't raise any register, so only updates that can change a
+        sketch are sent to the store.
+        """
+        index, rank = HyperLogLog.position(user_id)
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        expire_at = today + timedelta(days=1) + self.LINK_SKETCH_RETENTION
+        for key, expires in ((self.visitor_keys(link_id)[0], None), (self.visitor_keys(link_id, 1)[0], expire_at),
+                             (self.visitor_keys()[0], None), (self.visitor_keys(days=1)[0], None)):
+            floor = self.sketch_floor.get(key)
+            if floor is None:
+                floor = {}
+                self.sketch_floor.set(key, floor)
+            if floor.get(index, 0) >= rank:
+                continue
+            floor[index] = rank
+            await self.update_sketch(key, index, rank, expires)
+
+    async def count_unique(self, keys) -> int:
+        """Approximate number of distinct visitors across the sketches in `keys`"""
+        sketch = HyperLogLog()
+        for registers in (await self.get_sketches(keys)).values():
+            sketch.merge(registers)
+        return sketch.count()
+
+    def pending_writes(self) -> int:
+        """Number of writes buffered but not yet persisted"""
+        return 0
+
+    async def flush(self):
+        """Persist buffered writes"""
+
+    async def close(self):
+        """Flush buffered writes; call before the process exits"""
+        await self.flush()
+
+    async def ping(self, timeout=2) -> bool:
+        return True
+
+    async def ensure_indexes(self):
+        """Create whatever indexes/schema the hot queries rely on"""
+
+    async def watch_channel_config(self, interval=30):
+        """Reload the delay map when another instance changes it (only needed for shared stores)"""
+
+    # Users
+
+    async def present_user(self, user_id: int):
+        raise NotImplementedError
+
+    async def add_user(self, user_id: int, username=None, first_name=None):
+        raise NotImplementedError
+
+    async def update_user_last_seen(self, user_id):
+        raise NotImplementedError
+
+    async def delete_user(self, user_id: int):
+        raise NotImplementedError
+
+    async def get_user_ids_after(self, last_id=None, limit=500, segment=None):
+        """Get the next batch of user IDs in `segment`, in id order (keyset pagination)"""
+        raise NotImplementedError
+
+    async def count_users(self, segment=None):
+        raise NotImplementedError
+
+    async def iter_user_ids(self, segment=None, batch_size=500, after=None):
+        """Stream the IDs of users in `segment` as batches, starting after user id `after`.
+
+        Only one batch is held at a time, so memory stays flat however many
+        users there are and the first batch is ready after one indexed query.
+        """
+        while True:
+            batch = await self.get_user_ids_after(after, batch_size, segment)
+            if not batch:
+                return
+            yield batch
+            after = batch[-1]
+
+    @staticmethod
+    def segment_bounds(segment):
+        """(minimum last_seen, minimum created_at) for a segment such as
+        {"active_within": seconds, "created_after": datetime}; None means no limit"""
+        segment = segment or {}
+        seen_after = None
+        if segment.get("active_within"):
+            seen_after = datetime.now() - timedelta(seconds=segment["active_within"])
+        return seen_after, segment.get("created_after")
+
+    # Channels
+
+    async def create_channel(self, channel_id, title, username):
+        raise NotImplementedError
+
+    async def set_approve_delay(self, channel_id: int, delay: int):
+        raise NotImplementedError
+
+    async def load_channel_config(self):
+        """Load every channel's approve_delay into `approve_delays`"""
+        raise NotImplementedError
+
+    # Join requests and deletions
+
+    async def add_join_request(self, chat_id: int, user_id: int, due_at: float):
+        raise NotImplementedError
+
+    async def remove_join_request(self, chat_id: int, user_id: int):
+        raise NotImplementedError
+
+    async def remove_join_requests(self, chat_id: int, user_ids):
+        raise NotImplementedError
+
+    async def get_stored_join_requests(self, chat_id: int, user_ids) -> set:
+        """The subset of `user_ids` whose request in `chat_id` is still stored"""
+        raise NotImplementedError
+
+    async def get_join_requests(self, due_before=None):
+        """Async iterator over {"chat_id", "user_id", "due_at"} dicts, optionally only those due by `due_before`"""
+        raise NotImplementedError
+
+    async def add_deletion(self, doc_id, chat_id: int, message_ids: list, due_at: float):
+        raise NotImplementedError
+
+    async def remove_deletions(self, doc_ids):
+        raise NotImplementedError
+
+    async def get_deletions(self, due_before=None):
+        """Async iterator over {"_id", "chat_id", "message_ids", "due_at"} dicts, optionally only those due by `due_before`"""
+        raise NotImplementedError
+
+    # Leases
+
+    async def acquire_lease(self, name, owner, ttl) -> bool:
+        """Take or renew lease `name` for `ttl` seconds; False while another owner holds it"""
+        raise NotImplementedError
+
+    async def release_lease(self, name, owner):
+        raise NotImplementedError
+
+    # Links
+
+    async def save_link(self, link, owner_id, caption, logger_msg_id, delete_after=None, expire_at=None,
+                        max_access=None):
+        """Create the link stored at `logger_msg_id` (or update its caption) and return its ObjectId.
+
+        A link with `expire_at` (UTC) or `max_access` opens stops working after
+        that and is later moved to the archive by `archive_expired_links`.
+        """
+        raise NotImplementedError
+
+    async def backfill_links(self, entries):
+        """Insert links that don't exist yet and return how many were added"""
+        raise NotImplementedError
+
+    async def create_link(self, link, owner_id, caption="Content Unlocked!"):
+        raise NotImplementedError
+
+    async def create_links(self, entries, owner_id):
+        """Insert many {"link", "caption", "delete_after", "expire_at", "max_access"} entries in one batch
+        and return their ids in order"""
+        raise NotImplementedError
+
+    async def set_logger_msg_id(self, link_id, logger_msg_id):
+        raise NotImplementedError
+
+    async def increment_link_access(self, link_id, limit=None) -> bool:
+        """Count one open; with `limit`, only while fewer than `limit` opens were counted (False otherwise).
+
+        The open that reaches the limit also expires the link.
+        """
+        raise NotImplementedError
+
+    async def get_link(self, link_id):
+        raise NotImplementedError
+
+    async def get_link_by_msg_id(self, logger_msg_id):
+        raise NotImplementedError
+
+    async def get_links(self, link_ids):
+        raise NotImplementedError
+
+    async def archive_expired_links(self, batch_size=500) -> int:
+        """Move up to `batch_size` expired links to the archive with their final counters
+        (opens and unique visitors) and return how many were moved"""
+        raise NotImplementedError
+
+    async def get_archived_link(self, link_id):
+        raise NotImplementedError
+
+    async def get_archived_link_by_msg_id(self, logger_msg_id):
+        raise NotImplementedError
+
+    # Stats, analytics and checkpoints
+
+    async def update_stat(self, stat_type, increment=1):
+        raise NotImplementedError
+
+    async def get_stat(self, stat_type):
+        raise NotImplementedError
+
+    async def get_all_stats(self):
+        raise NotImplementedError
+
+    async def record_rollup(self, counter, group=None, key=None, amount=1):
+        """Add `amount` to `counter` (and to `group.key` if given) in the current rollup buckets"""
+        raise NotImplementedError
+
+    async def get_rollups(self, prefix, count):
+        """Get the last `count` buckets of one granularity, oldest first (missing buckets are empty)"""
+        raise NotImplementedError
+
+    async def update_sketch(self, key, index, rank, expire_at=None):
+        """Raise register `index` of sketch `key` to at least `rank`"""
+        raise NotImplementedError
+
+    async def get_sketches(self, keys):
+        """{key: registers ({"index": rank})} for each existing sketch in `keys`"""
+        raise NotImplementedError
+
+    async def get_checkpoint(self, name):
+        raise NotImplementedError
+
+    async def set_checkpoint(self, name, value):
+        raise NotImplementedError
+
+    # Export / import
+
+    async def get_documents_after(self, collection, last_key=None, limit=1000):
+        """Next `limit` documents of `collection` (one of EXPORT_KEYS) in key order after `last_key`.
+
+        Documents have the MongoDB shape whatever the backend, so an export from
+        one backend imports into any other.
+        """
+        raise NotImplementedError
+
+    async def iter_documents(self, collection, batch_size=1000, after=None):
+        """Stream `collection` as batches in key order, starting after key `after` (like iter_user_ids)"""
+        while True:
+            batch = await self.get_documents_after(collection, after, batch_size)
+            if not batch:
+                return
+            yield batch
+            after = batch[-1][self.EXPORT_KEYS[collection]]
+
+    async def import_documents(self, collection, docs):
+        """Upsert exported documents in order, replacing any with the same key"""
+        raise NotImplementedError
+
+    # Broadcasts
+
+    async def start_broadcast(self, from_chat_id, message_id, status_chat_id, status_message_id, segment=None):
+        raise NotImplementedError
+
+    async def save_broadcast(self, state):
+        raise NotImplementedError
+
+    async def get_active_broadcast(self):
+        raise NotImplementedError
+
+    async def finish_broadcast(self, broadcast_id):
+        raise NotImplementedError
+
+
+def _url_path(url: str, scheme: str):
+    """`scheme:///relative/path` or `scheme:////absolute/path` -> path, `scheme://` -> None"""
+    rest = url[len(scheme) + 3:]
+    return rest[1:] if rest.startswith("/") and len(rest) > 1 else None
+
+
+def open_storage(url: str, **options) -> Storage:
+    """Open the backend named by `url`.
+
+    - `memory://` keeps everything in process memory; `memory:///data/bot.log`
+      also appends every change to that file and replays it on start.
+    - `sqlite:///data/bot.db` (or `sqlite:////abs/path.db`) uses a local SQLite file.
+    - anything else is treated as a MongoDB connection string.
+    """
+    if url.startswith("memory://"):
+        from memory_db import MemoryDatabase
+        return MemoryDatabase(_url_path(url, "memory"), **options)
+    if url.startswith("sqlite://"):
+        from sqlite_db import SQLiteDatabase
+        return SQLiteDatabase(_url_path(url, "sqlite") or ":memory:", **options)
+    from database import Database
+    return Database(url, **options)
@@ -1,30 +1,27 @@
-import time, asyncio, random
-from datetime import timedelta
+import io, re, csv, html, math, time, asyncio, random
+from datetime import datetime, timedelta, timezone
 from pyrogram import Client, enums, filters
-from pyrogram.types import Message, ChatJoinRequest
+from pyrogram.types import Message, ChatJoinRequest, LinkPreviewOptions
 from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked
-from database import Database
+from storage import Storage
 from collections import defaultdict
 import asyncio
 from pyrogram import enums
 from pyrogram.errors import ChannelInvalid, PeerIdInvalid, UserAlreadyParticipant
+from broadcast import BroadcastEngine
+from bson import ObjectId
+import tracing
 
 REPLY_ERROR = "<b>Use this command as a reply to any message</b>"
-pending_requests = defaultdict(dict)
-
-async def delayed_approve(client: Client, chat_id: int, user_id: int, delay: int):
-    try:
-        await asyncio.sleep(delay)
-        if chat_id in pending_requests and user_id in pending_requests[chat_id]:
-            await client.approve_chat_join_request(chat_id, user_id)
-            print(f"Approved join request for user {user_id} in chat {chat_id} after {delay} seconds")
-    except (ChannelInvalid, PeerIdInvalid, UserAlreadyParticipant):
-        pass
-    except Exception as e:
-        print(f"Error approving join request: {e}")
-    finally:
-        if chat_id in pending_requests and user_id in pending_requests[chat_id]:
-            del pending_requests[chat_id][user_id]
+LINK_TEXT_RE = re.compile(r"^(https?://|t\.me/|@)\S+", re.IGNORECASE)
+LINK_FLAG_RE = re.compile(r"(?:^|\s+)--(\w+)=(\S+)(?=\s|$)")
+active_broadcast = None
+active_backfill = None
+BULK_MAX_LINES = 10000
+BULK_MAX_BYTES = 5 * 1024 * 1024
+BULK_BATCH = 1000
+PROFILE_MIN_SECONDS = 0.1
+PROFILE_MAX_SECONDS = 60
 
 async def handle_join_request(client: Client, update):
     chat_id = update.chat.id
@@ -34,23 +31,14 @@ async def handle_join_request(client: Client, update):
         print("Error: client has no db attribute")
         return
     
-    channel = await client.db.channels.find_one({"channel_id": chat_id})
-    if channel and "approve_delay" in channel:
-        delay = channel["approve_delay"]
-    else:
-        default_setting = await client.db.channels.find_one({"channel_id": "default"})
-        delay = default_setting.get("approve_delay", 180) if default_setting else 180
-    
-    task = asyncio.create_task(delayed_approve(client, chat_id, user_id, delay))
-    pending_requests[chat_id][user_id] = task
+    delay = await client.db.get_approve_delay(chat_id)
+    await client.approvals.schedule(chat_id, user_id, delay)
 
 
 async def handle_deleted_request(client: Client, update):
     chat_id = update.chat.id
     user_id = update.from_user.id
-    if chat_id in pending_requests and user_id in pending_requests[chat_id]:
-        pending_requests[chat_id][user_id].cancel()
-        del pending_requests[chat_id][user_id]
+    await client.approvals.cancel(chat_id, user_id)
 
 
 async def set_approve_delay(client: Client, message: Message):
@@ -95,7 +83,7 @@ async def set_approve_delay(client: Client, message: Message):
         await message.reply("❌ Database not initialized")
         return
     
-    if not await client.db.channels.find_one({"channel_id": target_chat_id}):
+    if not await client.db.has_channel(target_chat_id):
         try:
             chat = await client.get_chat(target_chat_id)
             await client.db.create_channel(target_chat_id, chat.title, chat.username)
@@ -120,8 +108,7 @@ async def reset_delay(client: Client, message: Message):
         return await message.reply("❌ Groups/Channels/Private only")
 
     args = message.command[1:]
-    db_setting = await client.db.channels.find_one({"channel_id": "default"})
-    current = db_setting.get("approve_delay", 180) if db_setting else 180
+    current = await client.db.get_approve_delay("default")
 
     def fmt_time(sec):
         return (f"{sec//86400}d" if sec >= 86400 else
@@ -167,8 +154,167 @@ def parse_time(time_str: str) -> int:
 
 
 
-async def handle_stats(client, message, db: Database, bot_start_time: float):
-    """Provide bot statistics to the owner"""
+def parse_link_flags(caption: str):
+    """Split `--name=value` options (e.g. `--del=5mi`) off a link caption"""
+    flags = {}
+
+    def take(match):
+        flags[match.group(1).lower()] = match.group(2)
+        return ""
+
+    return LINK_FLAG_RE.sub(take, caption).strip(), flags
+
+
+def parse_link_options(flags: dict) -> dict:
+    """`--del=5mi`, `--ttl=7d` and `--max=100` -> delete_after, expire_at (UTC) and max_access.
+
+    Raises ValueError for a malformed value.
+    """
+    max_access = int(flags["max"]) if "max" in flags else None
+    if max_access is not None and max_access < 1:
+        raise ValueError("--max must be at least 1")
+    return {
+        "delete_after": parse_time(flags["del"]) if "del" in flags else None,
+        "expire_at": datetime.now(timezone.utc) + timedelta(seconds=parse_time(flags["ttl"])) if "ttl" in flags else None,
+        "max_access": max_access,
+    }
+
+
+def describe_limits(options: dict) -> str:
+    parts = []
+    if options.get("expire_at"):
+        parts.append(f"expires {options['expire_at']:%Y-%m-%d %H:%M} UTC")
+    if options.get("max_access"):
+        parts.append(f"max {options['max_access']} opens")
+    return ", ".join(parts)
+
+
+def parse_bulk_links(text: str, is_csv=False):
+    """Parse `link caption --del=5mi --ttl=7d --max=100` lines (or `link,caption` CSV rows).
+
+    Returns the link entries and the numbers of the lines that were skipped.
+    """
+    entries, skipped = [], []
+    rows = csv.reader(io.StringIO(text)) if is_csv else (line.split(maxsplit=1) for line in text.splitlines())
+    for number, row in enumerate(rows, 1):
+        row = [cell.strip() for cell in row if cell.strip()]
+        if not row or (number == 1 and row[0].lower() == "link"):
+            continue  # blank line or CSV header
+        if not LINK_TEXT_RE.match(row[0]):
+            skipped.append(number)
+            continue
+        caption, flags = parse_link_flags(" ".join(row[1:]))
+        try:
+            options = parse_link_options(flags)
+        except ValueError:
+            skipped.append(number)
+            continue
+        entries.append({"link": row[0], "caption": caption or "Content Unlocked!", **options})
+    return entries, skipped
+
+
+def parse_segment(flags: dict):
+    """Build a broadcast audience segment from `--active=30d` / `--since=2024-01-31` flags"""
+    segment = {}
+    if "active" in flags:
+        segment["active_within"] = parse_time(flags["active"])
+    if "since" in flags:
+        segment["created_after"] = datetime.strptime(flags["since"], "%Y-%m-%d")
+    return segment or None
+
+
+def describe_segment(segment) -> str:
+    if not segment:
+        return "all"
+    parts = []
+    if segment.get("active_within"):
+        parts.append(f"active in the last {timedelta(seconds=segment['active_within'])}")
+    if segment.get("created_after"):
+        parts.append(f"joined since {segment['created_after']:%Y-%m-%d}")
+    return ", ".join(parts)
+
+
+def _sum_rollups(docs, counter):
+    return sum(doc.get(counter, 0) for doc in docs)
+
+
+def _merge_rollups(docs, group):
+    totals = {}
+    for doc in docs:
+        for key, count in doc.get(group, {}).items():
+            totals[key] = totals.get(key, 0) + count
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+
+
+async def handle_trends(message, db: Storage):
+    """Opens, new users and approvals from the pre-aggregated rollups"""
+    minutes = await db.get_rollups("m", 60)
+    hours = await db.get_rollups("h", 24)
+    days = await db.get_rollups("d", 7)
+
+    def rate(docs, counter):
+        return _sum_rollups(docs, counter) / len(docs)
+
+    text = (
+        f"📈 <b>Trends</b>\n\n"
+        f"🔓 <b>Link opens:</b> {_sum_rollups(minutes, 'opens')} /1h, "
+        f"{_sum_rollups(hours, 'opens')} /24h, {_sum_rollups(days, 'opens')} /7d\n"
+        f"   now {rate(minutes[-5:], 'opens'):.1f}/min vs {rate(minutes, 'opens'):.1f}/min hourly avg\n"
+        f"👤 <b>New users:</b> {_sum_rollups(minutes, 'new_users')} /1h, "
+        f"{_sum_rollups(hours, 'new_users')} /24h, {_sum_rollups(days, 'new_users')} /7d\n"
+        f"✅ <b>Approvals:</b> {_sum_rollups(minutes, 'approvals')} /1h, "
+        f"{_sum_rollups(hours, 'approvals')} /24h, {_sum_rollups(days, 'approvals')} /7d"
+    )
+
+    top_links = _merge_rollups(hours, "links")[:10]
+    if top_links:
+        links = {str(doc["_id"]): doc for doc in await db.get_links(ObjectId(k) for k, _ in top_links if ObjectId.is_valid(k))}
+        text += "\n\n🏆 <b>Top links (24h)</b>"
+        for key, count in top_links:
+            link = links.get(key, {})
+            text += f"\n• {count} — <code>{html.escape(link.get('link', key))}</code> {html.escape(link.get('caption', '')[:30])}"
+
+    channels = _merge_rollups(hours, "channels")[:10]
+    if channels:
+        text += "\n\n📢 <b>Approvals per channel (24h)</b>"
+        for chat_id, count in channels:
+            text += f"\n• <code>{chat_id}</code>: {count}"
+
+    await message.reply(text, parse_mode=enums.ParseMode.HTML, link_preview_options=LinkPreviewOptions(is_disabled=True))
+
+
+async def handle_link_stats(message, db: Storage, record):
+    """Opens and approximate unique visitors of one link (final counters if it has been archived)"""
+    link_id = record["_id"]
+    text = (
+        f"🔗 <b>Link Stats</b>\n\n"
+        f"<code>{html.escape(record['link'])}</code>\n"
+        f"📝 {html.escape(record.get('caption') or '')}\n\n"
+        f"🔓 <b>Opens:</b> {record.get('access_count', 0)}"
+        f"{' / ' + str(record['max_access']) if record.get('max_access') else ''}\n"
+    )
+    if record.get("archived_at"):
+        text += (f"👁 <b>Unique Visitors (≈):</b> {record.get('unique_visitors', 0)} total\n"
+                 f"⌛ <b>Expired</b>, archived {record['archived_at']:%Y-%m-%d %H:%M}")
+    else:
+        text += (f"👁 <b>Unique Visitors (≈):</b> {await db.count_unique(db.visitor_keys(link_id, 1))} today, "
+                 f"{await db.count_unique(db.visitor_keys(link_id, 7))} /7d, "
+                 f"{await db.count_unique(db.visitor_keys(link_id))} total")
+        if record.get("expire_at"):
+            text += f"\n⏳ <b>Expires:</b> {record['expire_at']:%Y-%m-%d %H:%M} UTC"
+    await message.reply(text, parse_mode=enums.ParseMode.HTML, link_preview_options=LinkPreviewOptions(is_disabled=True))
+
+
+async def handle_stats(client, message, db: Storage, bot_start_time: float, find_link=None):
+    """Provide bot statistics to the owner; `/stats <bot link>` shows one link via `find_link`"""
+    if len(message.command) > 1 and message.command[1].lower() == "trends":
+        return await handle_trends(message, db)
+    if len(message.command) > 1 and find_link:
+        record = await find_link(message.command[1])
+        if not record:
+            return await message.reply("❌ Link not found.")
+        return await handle_link_stats(message, db, record)
+
     # Calculate uptime
     uptime_seconds = time.time() - bot_start_time
     uptime = str(timedelta(seconds=int(uptime_seconds)))
@@ -177,84 +323,310 @@ async def handle_stats(client, message, db: Database, bot_start_time: float):
     total_users = await db.get_stat("total_users")
     total_groups = await db.get_stat("group_chats")
     total_links = await db.get_stat("total_links")
+    cache = db.link_cache.stats()
     
     stats_message = (
         f"📊 <b>Bot Statistics</b>\n\n"
         f"⏱ <b>Uptime:</b> {uptime}\n"
         f"👤 <b>Total Users:</b> {total_users}\n"
         f"👥 <b>Total Group Chats:</b> {total_groups}\n"
-        f"🔗 <b>Total Links Generated:</b> {total_links}"
+        f"🔗 <b>Total Links Generated:</b> {total_links}\n"
+        f"👁 <b>Unique Visitors (≈):</b> {await db.count_unique(db.visitor_keys(days=1))} today, "
+        f"{await db.count_unique(db.visitor_keys(days=7))} /7d, {await db.count_unique(db.visitor_keys())} total\n"
+        f"⚡ <b>Link Cache:</b> {cache['size']} cached, {cache['hits']} hits / {cache['misses']} misses "
+        f"({cache['hit_rate']:.0%})"
     )
+
+    leader = getattr(client, "leader", None)
+    if leader is not None:
+        role = "leader" if leader.is_leader else "follower"
+        stats_message += f"\n🖥 <b>Instance:</b> <code>{html.escape(leader.owner)}</code> ({role})"
+
+    limiter = getattr(client, "start_limiter", None)
+    if limiter is not None:
+        limits = limiter.stats()
+        stats_message += (
+            f"\n🛑 <b>/start Limits:</b> {limits['duplicates']} repeat taps ignored, "
+            f"{limits['throttled']} throttled ({limits['users']} users tracked)"
+        )
+
+    dispatcher = getattr(client, "priority_dispatcher", None)
+    if dispatcher is not None:
+        stats_message += "\n\n🚦 <b>Handler Queues:</b>"
+        for name, q in dispatcher.stats().items():
+            stats_message += f"\n• {name}: {q['queued']} queued, {q['running']} running, {q['handled']} handled, {q['shed']} shed"
+
+    approvals = getattr(client, "approvals", None)
+    if approvals is not None:
+        channels = sorted(approvals.stats().items(), key=lambda kv: kv[1]["backlog"], reverse=True)[:5]
+        stats_message += (
+            f"\n\n✅ <b>Join Requests:</b> {len(approvals)} pending, "
+            f"{approvals.flood_waits} FloodWaits"
+        )
+        for chat_id, c in channels:
+            stats_message += (
+                f"\n• <code>{chat_id}</code>: {c['backlog']} waiting, {c['approved']} approved, "
+                f"{c['failed']} failed, {c['skipped']} skipped, {c['rate']:.1f}/s"
+            )
     
     await message.reply(stats_message, parse_mode=enums.ParseMode.HTML)
 
-async def handle_broadcast(client: Client, message: Message, db: Database):
-    """Broadcast messages to all users"""
-    if message.reply_to_message:
+def run_broadcast(client: Client, db: Storage, state: dict, workers: int = 20, rate: float = 25.0):
+    """Start the broadcast described by `state` as a background task on this instance"""
+    global active_broadcast
+    engine = BroadcastEngine(client, db, state, workers=workers, rate=rate)
+
+    async def run():
         try:
-            # Get all user IDs from database
-            query = await db.get_all_user_ids()
-            
-            broadcast_msg = message.reply_to_message
-            total = 0
-            successful = 0
-            blocked = 0
-            deleted = 0
-            unsuccessful = 0
-            
-            pls_wait = await message.reply(f"<i>Broadcasting to {len(query)} users... This may take some time</i>")
-            
-            for chat_id in query:
-                try:
-                    # Check if we can send messages to this user
-                    user_chat = await client.get_chat(chat_id)
-                    if user_chat.type == enums.ChatType.PRIVATE:
-                        await broadcast_msg.copy(chat_id)
-                        successful += 1
-                    else:
-                        # Skip non-private chats
-                        unsuccessful += 1
-                except FloodWait as e:
-                    await asyncio.sleep(e.x)
-                    await broadcast_msg.copy(chat_id)
-                    successful += 1
-                except (UserIsBlocked, InputUserDeactivated):
-                    # Remove blocked/deactivated users
-                    await db.delete_user(chat_id)
-                    if isinstance(e, UserIsBlocked):
-                        blocked += 1
-                    else:
-                        deleted += 1
-                except Exception as e:
-                    # Handle other errors
-                    if "USER_IS_BLOCKED" in str(e):
-                        await db.delete_user(chat_id)
-                        blocked += 1
-                    elif "USER_DEACTIVATED" in str(e):
-                        await db.delete_user(chat_id)
-                        deleted += 1
-                    else:
-                        unsuccessful += 1
-                total += 1
-            
-            status = f"""<b><u>Broadcast Completed</u>
-
-Total Users: <code>{total}</code>
-Successful: <code>{successful}</code>
-Blocked Users: <code>{blocked}</code>
-Deleted Accounts: <code>{deleted}</code>
-Unsuccessful: <code>{unsuccessful}</code></b>"""
-            
-            return await pls_wait.edit(status)
-        
+            await engine.run()
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             error_msg = f"Broadcast failed: {type(e).__name__} - {str(e)}"
-            await message.reply(f"❌ {error_msg}")
+            await client.send_message(state["status_chat_id"], f"❌ {error_msg}\nUse /broadcast resume to continue")
+
+    active_broadcast = asyncio.create_task(run())
 
+
+def stop_broadcast():
+    """Cancel the broadcast running on this instance; its checkpoint lets the next leader resume it"""
+    if active_broadcast and not active_broadcast.done():
+        active_broadcast.cancel()
+
+
+async def sweep_expired_links(db: Storage, interval: int = 60, batch_size: int = 500):
+    """Leader loop: move expired links to the archive so `links` only holds live links"""
+    while True:
+        try:
+            archived = 0
+            while True:
+                moved = await db.archive_expired_links(batch_size)
+                archived += moved
+                if moved < batch_size:
+                    break
+            if archived:
+                print(f"Archived {archived} expired links")
+        except Exception as e:
+            print(f"Error archiving expired links: {e}")
+        await asyncio.sleep(interval)
+
+
+async def watch_broadcasts(client: Client, db: Storage, workers: int = 20, rate: float = 25.0, interval: int = 10):
+    """Leader loop: run broadcasts queued by other instances or left behind by a previous leader"""
+    while True:
+        try:
+            if not active_broadcast or active_broadcast.done():
+                state = await db.get_active_broadcast()
+                if state:
+                    print(f"Running broadcast {state['_id']} from {state['counters']['total']} users")
+                    run_broadcast(client, db, state, workers, rate)
+        except Exception as e:
+            print(f"Error checking for queued broadcasts: {e}")
+        await asyncio.sleep(interval)
+
+
+async def handle_broadcast(client: Client, message: Message, db: Storage, workers: int = 20, rate: float = 25.0):
+    """Broadcast messages to all users, or resume an interrupted broadcast"""
+    if active_broadcast and not active_broadcast.done():
+        return await message.reply("<b>A broadcast is already running</b>")
+
+    if len(message.command) > 1 and message.command[1].lower() == "resume":
+        state = await db.get_active_broadcast()
+        if not state:
+            return await message.reply("<b>No interrupted broadcast to resume</b>")
+        pls_wait = await message.reply(
+            f"<i>Resuming broadcast after {state['counters']['total']} users... This may take some time</i>"
+        )
+        state["status_chat_id"] = pls_wait.chat.id
+        state["status_message_id"] = pls_wait.id
+    elif message.reply_to_message:
+        _, flags = parse_link_flags(" ".join(message.command[1:]))
+        try:
+            segment = parse_segment(flags)
+        except ValueError:
+            return await message.reply("<b>Invalid segment. Use --active=30d and/or --since=2024-01-31</b>")
+        pls_wait = await message.reply(
+            f"<i>Broadcasting to {await db.count_users(segment)} users ({describe_segment(segment)})... "
+            f"This may take some time</i>"
+        )
+        state = await db.start_broadcast(
+            message.reply_to_message.chat.id, message.reply_to_message.id, pls_wait.chat.id, pls_wait.id, segment
+        )
     else:
         msg = await message.reply(REPLY_ERROR)
         await asyncio.sleep(8)
         await msg.delete()
+        return
+
+    leader = getattr(client, "leader", None)
+    if leader is not None and not leader.is_leader:
+        return  # stored as running; the leader instance's watch_broadcasts picks it up
+    run_broadcast(client, db, state, workers, rate)
+
+def is_bulk_file(document) -> bool:
+    """A .txt/.csv (or text/*) upload that handle_bulk_links can read"""
+    name = (document.file_name or "").lower()
+    return name.endswith((".txt", ".csv")) or (document.mime_type or "").startswith("text/")
+
+# Only bulk-link files reach handle_bulk_links; other documents go on to the other admin handlers
+bulk_file = filters.create(lambda _, __, message: bool(message.document) and is_bulk_file(message.document))
+
+async def handle_bulk_links(client: Client, message: Message, db: Storage, logger_id: int, make_link):
+    """Create one link per line of an uploaded .txt/.csv file and reply with a CSV of deep links.
+
+    Links are inserted `BULK_BATCH` at a time and the logger channel gets the
+    result file as a single document instead of one message per link.
+    """
+    document = message.document
+    name = document.file_name or "links.txt"
+    is_csv = name.lower().endswith(".csv")
+    if not is_bulk_file(document):
+        return await message.reply("❌ Send a .txt or .csv file with one `link caption` per line")
+    if document.file_size and document.file_size > BULK_MAX_BYTES:
+        return await message.reply(f"❌ File too large (max {BULK_MAX_BYTES // 1024 // 1024} MB)")
+
+    status = await message.reply("<i>Reading links...</i>")
+    try:
+        data = await client.download_media(message, in_memory=True)
+        entries, skipped = parse_bulk_links(bytes(data.getbuffer()).decode("utf-8-sig", errors="replace"), is_csv)
+    except Exception as e:
+        return await status.edit(f"❌ Could not read {html.escape(name)}: {type(e).__name__} - {html.escape(str(e))}")
+    if len(entries) > BULK_MAX_LINES:
+        return await status.edit(f"❌ Too many links ({len(entries)}); the limit is {BULK_MAX_LINES} per file")
+    if not entries:
+        return await status.edit("❌ No valid links found. Each line should look like: <code>https://t.me/example Caption</code>")
+
+    link_ids = []
+    for i in range(0, len(entries), BULK_BATCH):
+        link_ids += await db.create_links(entries[i:i + BULK_BATCH], message.from_user.id)
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["deep_link", "link", "caption"])
+    for entry, link_id in zip(entries, link_ids):
+        writer.writerow([make_link(link_id), entry["link"], entry["caption"]])
+    result = io.BytesIO(out.getvalue().encode())
+    result.name = f"links_{name.rsplit('.', 1)[0]}.csv"
+
+    summary = f"✅ {len(link_ids)} links created"
+    if skipped:
+        summary += f", {len(skipped)} lines skipped (line {', '.join(map(str, skipped[:10]))}{'…' if len(skipped) > 10 else ''})"
+    await message.reply_document(result, caption=summary)
+    await status.delete()
+    try:
+        result.seek(0)
+        await client.send_document(logger_id, result, caption=f"📦 Bulk import by {message.from_user.id}: {len(link_ids)} links")
+    except Exception as e:
+        print(f"WARNING: Could not send bulk import to LOGGER_ID {logger_id}: {e}")
+
+def profile_seconds(value) -> float:
+    """Profile duration from user input, clamped to [PROFILE_MIN_SECONDS, PROFILE_MAX_SECONDS]; ValueError if not a number"""
+    seconds = float(value)
+    if math.isnan(seconds):
+        raise ValueError(f"Not a number: {value}")
+    return min(max(seconds, PROFILE_MIN_SECONDS), PROFILE_MAX_SECONDS)
+
+async def handle_profile(client: Client, message: Message, profiler, default_seconds: int = 10):
+    """`/profile [seconds]`: sample the event loop and send the stacks as a flame-graph-ready file"""
+    try:
+        seconds = profile_seconds(message.command[1]) if len(message.command) > 1 else default_seconds
+    except ValueError:
+        return await message.reply("Usage: /profile [seconds]")
+    if profiler.running:
+        return await message.reply("❌ A profile is already running.")
+    status = await message.reply(f"<i>Profiling for {seconds:g}s…</i>", parse_mode=enums.ParseMode.HTML)
+
+    async def run():
+        try:
+            stacks, samples = await profiler.run(seconds)
+            top = "\n".join(f"• {count * 100 // max(samples, 1)}% <code>{html.escape(name[:60])}</code>"
+                            for name, count in profiler.top_functions(stacks, 8))
+            document = io.BytesIO(stacks.encode())
+            document.name = f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded"
+            await client.send_document(
+                message.chat.id, document, parse_mode=enums.ParseMode.HTML,
+                caption=f"<b>🔥 Profile:</b> {samples} samples in {seconds:g}s\n{top}\n\n"
+                        f"<i>Open with speedscope.app or flamegraph.pl</i>"
+            )
+            await status.delete()
+        except Exception as e:
+            await status.edit(f"❌ Profile failed: {type(e).__name__} - {e}")
+
+    # The sampler runs in the background so the admin lane isn't held for the whole profile
+    asyncio.create_task(run())
+
+
+async def handle_slow_log(message: Message, limit: int = 8):
+    """`/slowlog`: the most recent handlers that took longer than SLOW_LOG_MS, with their call breakdown"""
+    if not tracing.threshold_ms:
+        return await message.reply("Slow-log is off (set SLOW_LOG_MS).")
+    entries = list(tracing.SLOW_LOG)[-limit:]
+    if not entries:
+        return await message.reply(f"No requests slower than {tracing.threshold_ms:g}ms yet.")
+    text = f"<b>🐢 Slow requests (&gt; {tracing.threshold_ms:g}ms)</b>\n"
+    for entry in reversed(entries):
+        text += f"\n<code>{html.escape(tracing.format_entry(entry)[:450])}</code>\n"
+    await message.reply(text, parse_mode=enums.ParseMode.HTML)
+
+
+async def handle_backfill(client: Client, message: Message, db: Storage, logger_id: int, batch_size: int = 200):
+    """Copy links that only exist in the logger channel into the links collection"""
+    global active_backfill
+    if active_backfill and not active_backfill.done():
+        return await message.reply("<b>A backfill is already running</b>")
+
+    async def run(status):
+        start = (await db.get_checkpoint("backfill") or 0) + 1
+        # Only sent to learn the logger channel's latest message id
+        probe = await client.send_message(logger_id, "🔄 Link backfill started")
+        last = probe.id - 1
+        try:
+            await probe.delete()
+        except Exception:
+            pass
+        await status.edit(f"<i>Backfilling logger messages {start}–{last}...</i>")
+        msg_id, migrated, scanned = start, 0, 0
+        started = time.monotonic()
+        while msg_id <= last:
+            ids = list(range(msg_id, min(msg_id + batch_size, last + 1)))
+            try:
+                msgs = await client.get_messages(logger_id, ids)
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+                continue
+            entries = []
+            for msg in msgs:
+                if not msg or msg.empty or not msg.text or not LINK_TEXT_RE.match(msg.text):
+                    continue
+                parts = msg.text.split(maxsplit=1)
+                entries.append({
+                    "logger_msg_id": msg.id,
+                    "link": parts[0],
+                    "caption": parts[1] if len(parts) > 1 else "Content Unlocked!",
+                    "created_at": msg.date
+                })
+            migrated += await db.backfill_links(entries)
+            scanned += len(ids)
+            msg_id = ids[-1] + 1
+            await db.set_checkpoint("backfill", ids[-1])
+            if scanned % (batch_size * 10) == 0:
+                rate = scanned / max(time.monotonic() - started, 1e-6)
+                try:
+                    await status.edit(f"<i>Backfill: {ids[-1]}/{last} scanned, {migrated} links added ({rate:.0f} msg/s)</i>")
+                except Exception:
+                    pass
+        await status.edit(f"<b>✅ Backfill completed</b>\nScanned: <code>{scanned}</code>\nLinks added: <code>{migrated}</code>")
+
+    async def guarded():
+        status = await message.reply("<i>Starting backfill...</i>")
+        try:
+            await run(status)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await status.edit(f"❌ Backfill failed: {type(e).__name__} - {str(e)}\nUse /backfill to continue")
+
+    active_backfill = asyncio.create_task(guarded())
 
 # Help message texts
 ADMIN_HELP_TEXT = (
@@ -262,13 +634,23 @@ ADMIN_HELP_TEXT = (
     "**Cᴏᴍᴍᴀɴᴅs:**\n"
     "/start - Bᴏᴛ ᴋᴀ ᴜsᴇ ᴋᴀʀɴᴇ ᴋᴀ ᴛᴀʀɪᴋᴀ\n"
     "/stats - Bᴏᴛ ᴋᴇ sᴛᴀᴛɪsᴛɪᴄs ᴅᴇᴋʜᴇ\n"
+    "/stats trends - Tᴏᴘ ʟɪɴᴋs ᴀᴜʀ ᴛʀᴇɴᴅs ᴅᴇᴋʜᴇ\n"
+    "/stats [bot link] - Eᴋ ʟɪɴᴋ ᴋᴇ ᴏᴘᴇɴs ᴀᴜʀ ᴜɴɪǫᴜᴇ ᴠɪsɪᴛᴏʀs ᴅᴇᴋʜᴇ\n"
     "/broadcast - Sᴀʙʜɪ ᴜsᴇʀs ᴋᴏ ᴍᴇssᴀɢᴇ ʙʜᴇᴊᴇ\n"
+    "/broadcast resume - Rᴜᴋᴀ ʜᴜᴀ ʙʀᴏᴀᴅᴄᴀsᴛ ᴡᴀʜɪɴ sᴇ sʜᴜʀᴜ ᴋᴀʀᴇ\n"
+    "/broadcast --active=30d --since=2024-01-31 - Sɪʀғ ᴀᴄᴛɪᴠᴇ/ɴᴀʏᴇ ᴜsᴇʀs ᴋᴏ ʙʜᴇᴊᴇ\n"
+    "/slowlog - Sʟᴏᴡ ʀᴇǫᴜᴇsᴛs ᴀᴜʀ ᴜɴᴋᴀ ʙʀᴇᴀᴋᴅᴏᴡɴ ᴅᴇᴋʜᴇ\n"
+    "/profile [seconds] - Bᴏᴛ ᴋᴏ ᴘʀᴏꜰɪʟᴇ ᴋᴀʀᴋᴇ ꜰʟᴀᴍᴇ ɢʀᴀᴘʜ ꜰɪʟᴇ ʟᴇ\n"
+    "/backfill - Pᴜʀᴀɴᴇ ʟᴏɢɢᴇʀ ʟɪɴᴋs ᴋᴏ ᴅᴀᴛᴀʙᴀsᴇ ᴍᴇ ᴄᴏᴘʏ ᴋᴀʀᴇ\n"
     "/settime [seconds] - Aᴘᴘʀᴏᴠᴇ ᴅᴇʟᴀʏ sᴇᴛ ᴋᴀʀᴇ\n"
     "/default - Dᴇꜰᴀᴜʟᴛ ᴅᴇʟᴀʏ ᴘᴀʀ ʀᴇsᴇᴛ ᴋᴀʀᴇ\n\n"
     "**Lɪɴᴋ Bᴀɴᴀɴᴇ ᴋᴀ Tᴀʀɪᴋᴀ:**\n"
     "1. Kᴏɪ ʙʜɪ ʟɪɴᴋ ʙʜᴇᴊᴏ\n"
     "2. Aɢᴀʀ ᴄᴀᴘᴛɪᴏɴ ᴀᴅᴅ ᴋᴀʀɴᴀ ʜᴏ, ᴛᴏ ʟɪɴᴋ ᴋᴇ ʙᴀᴀᴅ sᴘᴀᴄᴇ ᴅᴇᴋᴀʀ ᴄᴀᴘᴛɪᴏɴ ʟɪᴋʜᴏ\n"
-    "3. Aɢᴀʀ ᴄᴀᴘᴛɪᴏɴ ɴᴀʜɪɴ ᴅɪʏᴀ, ᴛᴏ 'Cᴏɴᴛᴇɴᴛ Uɴʟᴏᴄᴋᴇᴅ!' ᴅᴇꜰᴀᴜʟᴛ ʜᴏɢᴀ"
+    "3. Aɢᴀʀ ᴄᴀᴘᴛɪᴏɴ ɴᴀʜɪɴ ᴅɪʏᴀ, ᴛᴏ 'Cᴏɴᴛᴇɴᴛ Uɴʟᴏᴄᴋᴇᴅ!' ᴅᴇꜰᴀᴜʟᴛ ʜᴏɢᴀ\n"
+    "4. `--del=5mi` ʟɪᴋʜᴏ ᴛᴏ ᴜɴʟᴏᴄᴋ ᴍᴇssᴀɢᴇ 5 ᴍɪɴᴜᴛᴇ ʙᴀᴀᴅ ᴅᴇʟᴇᴛᴇ ʜᴏɢᴀ\n"
+    "5. `--ttl=7d` ʟɪᴋʜᴏ ᴛᴏ ʟɪɴᴋ 7 ᴅɪɴ ʙᴀᴀᴅ ᴇxᴘɪʀᴇ ʜᴏɢᴀ, `--max=100` ʟɪᴋʜᴏ ᴛᴏ 100 ᴏᴘᴇɴs ᴋᴇ ʙᴀᴀᴅ\n"
+    "6. Eᴋ sᴀᴀᴛʜ ʙᴀʜᴜᴛ sᴀᴀʀᴇ ʟɪɴᴋs: .txt/.csv ꜰɪʟᴇ ʙʜᴇᴊᴏ (ʜᴀʀ ʟɪɴᴇ ᴘᴀʀ `link caption`), ʙᴏᴛ ᴅᴇᴇᴘ ʟɪɴᴋs ᴋɪ CSV ʙʜᴇᴊᴇɢᴀ"
 )
 
 USER_HELP_TEXT = (
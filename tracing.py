@@ -0,0 +1,116 @@
+import time, inspect, functools, contextvars
+from collections import deque
+from datetime import datetime
+
+# Handlers slower than this (ms) are written to the slow-log; 0 turns tracing off
+threshold_ms = 0
+# The most recent slow requests, newest last
+SLOW_LOG = deque(maxlen=100)
+slow_requests = 0
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Spans recorded while one handler runs: [(name, offset s, duration s)]"""
+
+    __slots__ = ("name", "start", "spans", "done", "token")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        # Tasks spawned by the handler inherit the trace; stop recording once it's over
+        self.done = False
+        self.token = None
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.trace.done:
+            self.trace.spans.append((self.name, self.start - self.trace.start, time.perf_counter() - self.start))
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def configure(slow_ms=0, size=100):
+    global threshold_ms, SLOW_LOG
+    threshold_ms = slow_ms
+    SLOW_LOG = deque(SLOW_LOG, maxlen=size)
+
+
+def span(name):
+    """Context manager timing one call inside the current trace; a shared no-op when nothing is traced"""
+    trace = _current.get()
+    return NULL_SPAN if trace is None else _Span(trace, name)
+
+
+def begin(name):
+    """Start tracing the current handler; returns None while tracing is off"""
+    if not threshold_ms:
+        return None
+    trace = Trace(name)
+    trace.token = _current.set(trace)
+    return trace
+
+
+def end(trace, elapsed):
+    """Finish `trace` and add it to the slow-log if it took longer than the threshold"""
+    global slow_requests
+    trace.done = True
+    _current.reset(trace.token)
+    if elapsed * 1000 < threshold_ms:
+        return
+    slow_requests += 1
+    entry = {"handler": trace.name, "at": datetime.now(), "ms": elapsed * 1000,
+             "spans": [(name, offset * 1000, duration * 1000) for name, offset, duration in trace.spans]}
+    SLOW_LOG.append(entry)
+    print(f"Slow request: {format_entry(entry)}")
+
+
+def format_entry(entry) -> str:
+    spans = ", ".join(f"{name} +{offset:.0f}ms {duration:.0f}ms" for name, offset, duration in entry["spans"])
+    return f"{entry['handler']} {entry['ms']:.0f}ms at {entry['at']:%H:%M:%S} [{spans or 'no calls'}]"
+
+
+def instrument(obj, prefix):
+    """Wrap every public coroutine method of `obj` in a span named `prefix.method`"""
+    for name in dir(type(obj)):
+        if name.startswith("_"):
+            continue
+        method = getattr(obj, name)
+        if inspect.iscoroutinefunction(method):
+            setattr(obj, name, _traced(method, f"{prefix}.{name}"))
+    return obj
+
+
+def _traced(method, name):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return await method(*args, **kwargs)
+        with _Span(trace, name):
+            return await method(*args, **kwargs)
+    return wrapper